@@ -0,0 +1,141 @@
+# activity.py - Append-only log of document changes and the recently modified documents
+import time
+from coordination import get_coordination_db
+
+def init_activity_db(work_dir):
+    """Initialize the activity tables in the coordination database."""
+    with get_coordination_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time REAL NOT NULL,
+            action TEXT NOT NULL,
+            type TEXT NOT NULL,
+            path TEXT NOT NULL,
+            new_path TEXT,
+            username TEXT,
+            session_id TEXT
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS activity_log_time ON activity_log (time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS activity_log_path ON activity_log (path)")
+        # The last change of each existing document, so recent files never need the whole log
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS recent_documents (
+            path TEXT PRIMARY KEY,
+            time REAL NOT NULL,
+            action TEXT NOT NULL,
+            username TEXT
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS recent_documents_time ON recent_documents (time)")
+        conn.commit()
+
+def _row_to_entry(row):
+    entry_id, entry_time, action, kind, path, new_path, username, session_id = row
+    return {
+        'id': entry_id,
+        'time': entry_time,
+        'action': action,
+        'type': kind,
+        'path': path,
+        'newPath': new_path,
+        'username': username,
+        'sessionId': session_id
+    }
+
+def _update_recent(conn, now, action, kind, path, new_path, username, documents):
+    prefix = path + '/'
+    if action == 'delete':
+        conn.execute(
+            "DELETE FROM recent_documents WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(prefix), prefix)
+        )
+    elif action == 'rename' and kind == 'directory':
+        # Moving a directory doesn't change its documents, they keep their place in the list
+        conn.execute(
+            "UPDATE recent_documents SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+            (new_path, len(path) + 1, len(prefix), prefix)
+        )
+    elif action == 'rename':
+        conn.execute("DELETE FROM recent_documents WHERE path = ?", (path,))
+        conn.execute(
+            "INSERT OR REPLACE INTO recent_documents (path, time, action, username) VALUES (?, ?, ?, ?)",
+            (new_path, now, action, username)
+        )
+    elif action in ('save', 'restore') and kind == 'file':
+        conn.execute(
+            "INSERT OR REPLACE INTO recent_documents (path, time, action, username) VALUES (?, ?, ?, ?)",
+            (path, now, action, username)
+        )
+    elif action == 'restore' and kind == 'directory':
+        conn.executemany(
+            "INSERT OR REPLACE INTO recent_documents (path, time, action, username) VALUES (?, ?, ?, ?)",
+            [(document, now, action, username) for document in documents]
+        )
+
+def record(work_dir, action, path, kind='file', new_path=None, username=None, session_id=None, documents=()):
+    """
+    Append a change to the log. action is save, delete, rename, restore,
+    upload or lock-takeover; kind is file, directory or attachment.
+    A restored directory passes the documents it brought back as documents.
+    """
+    now = time.time()
+    with get_coordination_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO activity_log (time, action, type, path, new_path, username, session_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (now, action, kind, path, new_path, username, session_id)
+        )
+        _update_recent(conn, now, action, kind, path, new_path, username, documents)
+        conn.commit()
+
+def get_recent(work_dir, limit=20):
+    """Get the most recently changed documents that still exist, newest first."""
+    with get_coordination_db(work_dir) as conn:
+        rows = conn.execute(
+            "SELECT path, time, action, username FROM recent_documents ORDER BY time DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    return [{'path': path, 'time': changed, 'action': action, 'username': username}
+            for path, changed, action, username in rows]
+
+def get_activity(work_dir, since_id=0, limit=200):
+    """
+    Get the changes logged after the entry with id since_id, oldest first.
+    Ids only grow, so unlike times they never skip entries logged together.
+    Returns (entries, more), more is True when the limit cut the entries short.
+    """
+    with get_coordination_db(work_dir) as conn:
+        rows = conn.execute(
+            "SELECT id, time, action, type, path, new_path, username, session_id FROM activity_log "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (since_id, limit + 1)
+        ).fetchall()
+    return [_row_to_entry(row) for row in rows[:limit]], len(rows) > limit
+
+def compact(work_dir, retention, max_entries, merge_window):
+    """
+    Drop entries older than the retention or beyond max_entries, and merge
+    runs of saves of a document by one user, such as autosaves, into their
+    last save. Returns the number of entries removed.
+    """
+    now = time.time()
+    with get_coordination_db(work_dir) as conn:
+        removed = conn.execute("DELETE FROM activity_log WHERE time < ?", (now - retention,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM activity_log WHERE id <= (SELECT id FROM activity_log ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (max_entries,)
+        ).rowcount
+        # Only settled runs are merged, clients may still be reading the latest entries
+        removed += conn.execute('''
+        DELETE FROM activity_log WHERE action = 'save' AND time < ? AND EXISTS (
+            SELECT 1 FROM activity_log later
+            WHERE later.path = activity_log.path AND later.action = 'save'
+            AND later.username IS activity_log.username
+            AND later.id > activity_log.id AND later.time - activity_log.time <= ?
+        )
+        ''', (now - merge_window, merge_window)).rowcount
+        conn.commit()
+    return removed
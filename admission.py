@@ -0,0 +1,51 @@
+# admission.py - Per-class concurrency limits and load shedding for the worker threads
+import random
+import threading
+
+class AdmissionController:
+    """
+    Bounds how many requests of each class run at once in this process, so
+    background polls and uploads can't take every waitress thread from
+    interactive saves and opens. A request waits up to its class's wait
+    time for a slot and is shed when none frees up.
+    """
+
+    def __init__(self, limits, waits, retry_after, retry_jitter):
+        self.slots = {
+            request_class: threading.BoundedSemaphore(limit)
+            for request_class, limit in limits.items() if limit is not None
+        }
+        self.waits = waits
+        self.retry_after = retry_after
+        self.retry_jitter = retry_jitter
+        self.shed_counts = {request_class: 0 for request_class in limits}
+        self.counts_lock = threading.Lock()
+
+    def acquire(self, request_class):
+        """Take a slot for a request. Returns False if the request should be shed."""
+        slots = self.slots.get(request_class)
+        if slots is None:
+            return True
+
+        wait = self.waits.get(request_class, 0)
+        if slots.acquire(timeout=wait) if wait > 0 else slots.acquire(blocking=False):
+            return True
+
+        with self.counts_lock:
+            self.shed_counts[request_class] = self.shed_counts.get(request_class, 0) + 1
+        return False
+
+    def release(self, request_class):
+        """Give back the slot of a finished request."""
+        slots = self.slots.get(request_class)
+        if slots is not None:
+            slots.release()
+
+    def retry_delay(self):
+        """Get the seconds a shed client should wait, jittered so retries don't arrive together."""
+        return self.retry_after + random.randint(0, self.retry_jitter)
+
+    def get_shed_counts(self):
+        """Get the number of requests shed per class since startup."""
+        with self.counts_lock:
+            return dict(self.shed_counts)
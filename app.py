@@ -1,17 +1,36 @@
 import os
 import json
-import shutil
 import hashlib
 import uuid
 import time
 import sqlite3
+import threading
+import subprocess
+import sys
 from contextlib import contextmanager
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, g
+from flask.json import JSONEncoder, JSONDecoder
 from waitress import serve
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 from config import Config
 from auth import requires_auth, load_users, authenticate, add_user, delete_user, update_user_password, get_users
+import document_index
+import renderer
+import publisher
+import coordination
+import prefork
+import profiling
+import admission
+import quick_open
+import sync
+import collab
+import trash
+import usage
+import activity
+import scrub
+from storage import create_storage, CHUNK_SIZE, DocumentTooLarge
 
 # Make the template folder explicit to avoid path issues
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
@@ -23,14 +42,90 @@ app.config.from_object(Config)
 
 # Ensure work directories exist
 os.makedirs(os.path.join(app.config['WORK_DIR']), exist_ok=True)
-os.makedirs(os.path.join(app.config['WORK_DIR'], 'documents'), exist_ok=True)
 os.makedirs(os.path.join(app.config['WORK_DIR'], 'attachments'), exist_ok=True)
 
+# Documents and their format options, on disk or packed into a database
+storage = create_storage(app.config)
+
+# Opt-in profiling of the waitress worker threads
+sampler = profiling.StackSampler(app.config['PROFILING_SAMPLE_INTERVAL'])
+profiling.tracer.configure(app.config['SLOW_REQUEST_THRESHOLD'], app.config['SLOW_REQUEST_BUFFER_SIZE'])
+
+class TracedJSONEncoder(JSONEncoder):
+    """JSON encoder attributing its time to the request's json category."""
+    def encode(self, o):
+        with profiling.track('json'):
+            return super().encode(o)
+
+class TracedJSONDecoder(JSONDecoder):
+    """JSON decoder attributing its time to the request's json category."""
+    def decode(self, s, *args, **kwargs):
+        with profiling.track('json'):
+            return super().decode(s, *args, **kwargs)
+
+if app.config['PROFILING_ENABLED']:
+    app.json_encoder = TracedJSONEncoder
+    app.json_decoder = TracedJSONDecoder
+    
+    @app.before_request
+    def start_request_trace():
+        """Start sampling in this worker process and time the request."""
+        sampler.ensure_started()
+        profiling.tracer.start_request()
+    
+    @app.after_request
+    def finish_request_trace(response):
+        """Record the request if it was slower than the threshold."""
+        profiling.tracer.finish_request(request.method, request.path, response.status_code)
+        return response
+
+# Per-class concurrency limits, so polls and uploads can't occupy every worker thread
+admission_controller = admission.AdmissionController(
+    app.config['ADMISSION_LIMITS'],
+    app.config['ADMISSION_WAIT'],
+    app.config['ADMISSION_RETRY_AFTER'],
+    app.config['ADMISSION_RETRY_JITTER']
+)
+
+# Requests moving large bodies, limited apart from saves and opens
+UPLOAD_ENDPOINTS = {'upload_attachment', 'save_file_raw', 'publish_site'}
+
+def get_request_class():
+    """Classify the current request for admission control."""
+    if request.endpoint in UPLOAD_ENDPOINTS:
+        return 'upload'
+    # Clients mark their periodic polls, which are shed first under load
+    if request.headers.get('X-Request-Class') == 'background':
+        return 'background'
+    return 'interactive'
+
+@app.before_request
+def admit_request():
+    """Take a slot for the request's class, or shed it with a jittered Retry-After."""
+    request_class = get_request_class()
+    if not admission_controller.acquire(request_class):
+        delay = admission_controller.retry_delay()
+        response = jsonify({'error': 'Server is busy, retry later', 'retryAfter': delay})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(delay)
+        return response
+    g.admission_class = request_class
+
+@app.teardown_request
+def release_admission(exc):
+    """Give back the request's slot, streamed bodies are sent by waitress after this."""
+    request_class = g.pop('admission_class', None)
+    if request_class is not None:
+        admission_controller.release(request_class)
+
 # File lock helper functions
 def init_lock_db():
     """Initialize the locks database."""
     with get_lock_db() as conn:
         cursor = conn.cursor()
+        # Several server processes share the locks, so use write-ahead logging
+        coordination.enable_wal(conn)
+        
         # Create locks table if it doesn't exist
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS file_locks (
@@ -57,12 +152,13 @@ def get_lock_db():
     """Context manager for database connections."""
     db_path = os.path.join(app.config['WORK_DIR'], 'locks.db')
     conn = None
-    try:
-        conn = sqlite3.connect(db_path, timeout=10.0)  # 10-second timeout
-        yield conn
-    finally:
-        if conn:
-            conn.close()
+    with profiling.track('lockDb'):
+        try:
+            conn = sqlite3.connect(db_path, timeout=10.0)  # 10-second timeout
+            yield conn
+        finally:
+            if conn:
+                conn.close()
 
 def sqlite_acquire_lock(file_path, session_id):
     """
@@ -74,6 +170,9 @@ def sqlite_acquire_lock(file_path, session_id):
     with get_lock_db() as conn:
         cursor = conn.cursor()
         
+        # Take the write lock up front so the check and update are atomic across processes
+        cursor.execute("BEGIN IMMEDIATE")
+        
         # Check if lock exists and is valid
         cursor.execute(
             "SELECT session_id, timestamp FROM file_locks WHERE file_path = ?", 
@@ -148,6 +247,9 @@ def sqlite_release_lock(file_path, session_id):
     with get_lock_db() as conn:
         cursor = conn.cursor()
         
+        # Take the write lock up front so the check and delete are atomic across processes
+        cursor.execute("BEGIN IMMEDIATE")
+        
         # Check if lock exists and is owned by this session
         cursor.execute(
             "SELECT session_id FROM file_locks WHERE file_path = ?", 
@@ -251,6 +353,9 @@ def sqlite_cleanup_expired_locks():
 # Initialize the database on startup
 init_lock_db()
 
+# Initialize the shared coordination state on startup
+coordination.init_coordination_db(app.config['WORK_DIR'], os.path.join(app.config['WORK_DIR'], 'attachments'))
+
 # Setup a periodic cleanup task
 def setup_lock_cleanup():
     """Setup periodic cleanup of expired locks."""
@@ -261,6 +366,17 @@ def setup_lock_cleanup():
             try:
                 deleted = sqlite_cleanup_expired_locks()
                 app.logger.info(f"Cleanup task removed {deleted} expired locks")
+                
+                pruned = invalidations.prune()
+                app.logger.info(f"Cleanup task pruned {pruned} cache invalidations")
+                
+                compacted = activity.compact(
+                    app.config['WORK_DIR'],
+                    app.config['ACTIVITY_RETENTION'],
+                    app.config['ACTIVITY_MAX_ENTRIES'],
+                    app.config['ACTIVITY_MERGE_WINDOW']
+                )
+                app.logger.info(f"Cleanup task compacted {compacted} activity entries")
             except Exception as e:
                 app.logger.error(f"Error in cleanup task: {e}")
             
@@ -271,16 +387,263 @@ def setup_lock_cleanup():
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
 
-# Start the cleanup task in a separate thread
-# Need to make sure this works with Waitress
-if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':  # Avoid duplicate in reloader
+def setup_collab_snapshots():
+    """Setup periodic snapshots of the collaborative editing hubs."""
+    def snapshot_task():
+        while True:
+            time.sleep(app.config['COLLAB_SNAPSHOT_INTERVAL'])
+            try:
+                written = collab_hub.run_maintenance()
+                if written:
+                    app.logger.info(f"Collaboration task saved {written} documents")
+            except Exception as e:
+                app.logger.error(f"Error in collaboration snapshot task: {e}")
+    
+    threading.Thread(target=snapshot_task, name='collab-snapshots', daemon=True).start()
+
+def setup_trash_purger():
+    """Setup periodic purging of old trash in throttled batches."""
+    def purge_task():
+        while True:
+            time.sleep(app.config['TRASH_PURGE_INTERVAL'])
+            try:
+                purged = trash_bin.purge(
+                    app.config['TRASH_RETENTION'],
+                    app.config['TRASH_MAX_SIZE'],
+                    app.config['TRASH_PURGE_BATCH'],
+                    app.config['TRASH_PURGE_PAUSE']
+                )
+                if purged:
+                    app.logger.info(f"Trash purger removed {purged} items")
+            except Exception as e:
+                app.logger.error(f"Error in trash purge task: {e}")
+    
+    threading.Thread(target=purge_task, name='trash-purger', daemon=True).start()
+
+def setup_usage_index():
+    """Count the stored documents once if the usage index has never been built."""
+    def build_task():
+        try:
+            if not usage.is_built(app.config['WORK_DIR']):
+                counted = usage.rebuild(
+                    app.config['WORK_DIR'], storage, os.path.join(app.config['WORK_DIR'], 'attachments')
+                )
+                app.logger.info(f"Usage index counted {counted} documents")
+        except Exception as e:
+            app.logger.error(f"Error building usage index: {e}")
+    
+    threading.Thread(target=build_task, name='usage-index', daemon=True).start()
+
+def setup_scrubber():
+    """Setup throttled verification passes, resuming an interrupted one."""
+    def scrub_task():
+        while True:
+            # Give startup a head start before reading everything
+            time.sleep(max(scrubber.seconds_until_due(app.config['SCRUB_INTERVAL']), 60))
+            try:
+                found = scrubber.run_pass(
+                    app.config['SCRUB_BYTES_PER_SECOND'],
+                    app.config['SCRUB_PAUSE'],
+                    app.config['SCRUB_CHECKPOINT']
+                )
+                if found:
+                    app.logger.warning(f"Scrubber found {found} integrity problems, see /api/admin/scrub")
+            except Exception as e:
+                app.logger.error(f"Error in scrub task: {e}")
+                time.sleep(app.config['SCRUB_INTERVAL'])
+    
+    threading.Thread(target=scrub_task, name='scrubber', daemon=True).start()
+
+def start_background_tasks():
+    """Start the tasks that must only run once per server."""
     setup_lock_cleanup()
+    setup_usage_index()
+    setup_trash_purger()
+    if app.config['SCRUB_ENABLED']:
+        setup_scrubber()
+    if app.config['COLLABORATION_ENABLED']:
+        setup_collab_snapshots()
 
 # Replace the existing lock functions with the SQLite versions
 acquire_lock = sqlite_acquire_lock
 release_lock = sqlite_release_lock
 check_lock_status = sqlite_check_lock_status
 
+# Initialize the document index on startup
+document_index.init_index_db(app.config['WORK_DIR'])
+sync.init_sync_db(app.config['WORK_DIR'])
+usage.init_usage_db(app.config['WORK_DIR'])
+
+# Cache of server-rendered documents for the read-only view
+render_cache = renderer.RenderCache(app.config['RENDER_CACHE_SIZE'])
+
+# Invalidate in-process caches across worker processes
+invalidations = coordination.InvalidationChannel(app.config['WORK_DIR'], app.config['INVALIDATION_POLL_INTERVAL'])
+invalidations.subscribe('render', render_cache.invalidate)
+invalidations.subscribe('render-directory', render_cache.invalidate_prefix)
+
+# Fuzzy path and title lookup for the file pickers, built on first use
+quick_open_index = quick_open.TrigramIndex()
+quick_open_state = {'built': False}
+quick_open_lock = threading.Lock()
+
+def build_quick_open_index():
+    """Index every document and directory with the titles stored in the document index."""
+    titles = document_index.get_all_titles(app.config['WORK_DIR'])
+    quick_open_index.replace_all(
+        (entry.path, entry.type, titles.get(entry.path)) for entry in storage.walk()
+    )
+
+def ensure_quick_open_index():
+    """Build the quick-open index once per process."""
+    if quick_open_state['built']:
+        return
+    with quick_open_lock:
+        if not quick_open_state['built']:
+            build_quick_open_index()
+            quick_open_state['built'] = True
+
+def refresh_quick_open(path):
+    """Re-read one changed file or directory into the quick-open index."""
+    if not quick_open_state['built']:
+        return
+    
+    quick_open_index.remove_prefix(path)
+    if storage.is_dir(path):
+        quick_open_index.add(path, 'directory')
+        titles = document_index.get_all_titles(app.config['WORK_DIR'])
+        for entry in storage.walk(path):
+            quick_open_index.add(entry.path, entry.type, titles.get(entry.path))
+    elif path.endswith('.md') and storage.is_file(path):
+        stats = document_index.get_document_stats(
+            app.config['WORK_DIR'], storage, path,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        title = stats['outline'][0]['text'] if stats['outline'] else None
+        quick_open_index.add(path, 'file', title)
+
+invalidations.subscribe('quick-open', refresh_quick_open)
+
+def record_document_usage(file_path):
+    """Roll the stored size of a written document up its directories."""
+    usage.set_document(app.config['WORK_DIR'], file_path, usage.document_bytes(storage, file_path))
+
+def document_growth(file_path, content_size, options):
+    """Get the bytes a save adds to a document, options None keeps the stored ones."""
+    try:
+        _, size, _, options_size = storage.version(file_path)
+    except FileNotFoundError:
+        size, options_size = 0, -1
+    growth = content_size - size
+    if options is not None:
+        growth += len(options.encode('utf-8')) - max(options_size, 0)
+    return growth
+
+def find_quotas(file_path, growth):
+    """
+    Check a write against the storage quotas, file_path None for an attachment.
+    Returns (exceeded hard quota or None, soft quota warnings).
+    """
+    # Until the first count finishes the totals are incomplete
+    if not usage.is_built(app.config['WORK_DIR']):
+        return None, []
+    return usage.check_quotas(app.config['WORK_DIR'], file_path, growth, app.config)
+
+def quota_headroom(file_path):
+    """Get (bytes a document may still grow by, the hard quota limiting it), or (None, None) without one."""
+    if not usage.is_built(app.config['WORK_DIR']):
+        return None, None
+    return usage.hard_headroom(app.config['WORK_DIR'], file_path, app.config)
+
+def quota_error(exceeded):
+    """Get the response refusing a write that would pass a hard quota."""
+    return jsonify({'error': str(usage.QuotaExceeded(exceeded)), 'quota': exceeded}), 507
+
+def check_quota(file_path, growth):
+    """
+    Check a write against the storage quotas, file_path None for an attachment.
+    Returns (error response or None, soft quota warnings).
+    """
+    exceeded, warnings = find_quotas(file_path, growth)
+    return (quota_error(exceeded) if exceeded else None), warnings
+
+def load_collab_document(file_path):
+    """Read the stored text a collaborative hub starts from."""
+    return storage.read(file_path)
+
+def save_collab_document(file_path, content):
+    """
+    Write a snapshot of a collaborative hub to its document.
+    Raises QuotaExceeded instead if it would pass a hard quota, the hub
+    then keeps the edits until there is room for them.
+    """
+    exceeded, _ = find_quotas(file_path, document_growth(file_path, len(content.encode('utf-8')), None))
+    if exceeded:
+        raise usage.QuotaExceeded(exceeded)
+    storage.write(file_path, content)
+    sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+    record_document_usage(file_path)
+    document_index.update_document(
+        app.config['WORK_DIR'], storage, file_path, content,
+        words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+    )
+    invalidations.publish('render', file_path)
+    invalidations.publish('quick-open', file_path)
+
+# Operation hubs for documents edited collaboratively, shared through the coordination database
+collab.init_collab_db(app.config['WORK_DIR'])
+collab_hub = collab.CollabHub(
+    app.config['WORK_DIR'],
+    load_collab_document,
+    save_collab_document,
+    op_retention=app.config['COLLAB_OP_RETENTION'],
+    client_timeout=app.config['COLLAB_CLIENT_TIMEOUT']
+)
+
+# Deleted documents wait in the trash until the background purger removes them
+trash.init_trash_db(app.config['WORK_DIR'])
+trash_bin = trash.TrashBin(app.config['WORK_DIR'], storage)
+
+# Who changed what, shared by every worker process
+activity.init_activity_db(app.config['WORK_DIR'])
+
+# Integrity checks of the stored data, run by the background scrubber
+scrub.init_scrub_db(app.config['WORK_DIR'])
+scrubber = scrub.Scrubber(app.config['WORK_DIR'], storage, os.path.join(app.config['WORK_DIR'], 'attachments'))
+
+def current_username():
+    """Get the user of the current request, None without authentication."""
+    return request.authorization.username if request.authorization else None
+
+def record_activity(action, path, session_id=None, **details):
+    """Log a change made by the current request."""
+    activity.record(
+        app.config['WORK_DIR'], action, path,
+        username=current_username(), session_id=session_id, **details
+    )
+
+def acquire_document_lock(file_path, session_id):
+    """Acquire a lock for the current request, logging when it takes over an expired or invalid one."""
+    lock_success, lock_owner, lock_message = acquire_lock(file_path, session_id)
+    if lock_success and lock_message.endswith('taken over'):
+        record_activity('lock-takeover', file_path, session_id)
+    return lock_success, lock_owner, lock_message
+
+@app.before_request
+def poll_invalidations():
+    """Catch up with cache invalidations from other worker processes."""
+    try:
+        invalidations.poll()
+    except Exception as e:
+        app.logger.error(f"Error polling cache invalidations: {str(e)}")
+
+# Start the cleanup task in a separate thread
+# Need to make sure this works with Waitress
+# With several worker processes the pre-fork parent starts it instead
+is_prefork_parent = __name__ == '__main__' and app.config['SERVER_WORKERS'] > 1
+if os.environ.get('WERKZEUG_RUN_MAIN') != 'true' and not is_prefork_parent:  # Avoid duplicate in reloader
+    start_background_tasks()
+
 def calculate_md5(file_path):
     """Calculate MD5 hash of a file."""
     hash_md5 = hashlib.md5()
@@ -289,81 +652,146 @@ def calculate_md5(file_path):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-def get_image_hash_mapping(directory):
-    """Get or create the image hash mapping file."""
-    map_file = os.path.join(directory, 'image_hashes.json')
-    if os.path.exists(map_file):
-        with open(map_file, 'r') as f:
-            return json.load(f)
-    else:
-        # Initialize with existing files
-        hash_map = {}
-        for filename in os.listdir(directory):
-            if os.path.isfile(os.path.join(directory, filename)) and not filename.endswith('.json'):
-                file_path = os.path.join(directory, filename)
-                file_hash = calculate_md5(file_path)
-                hash_map[file_hash] = filename
-        
-        # Save the initial mapping
-        with open(map_file, 'w') as f:
-            json.dump(hash_map, f, indent=2)
-        
-        return hash_map
-
-def save_hash_mapping(directory, hash_map):
-    """Save the hash mapping to file."""
-    map_file = os.path.join(directory, 'image_hashes.json')
-    with open(map_file, 'w') as f:
-        json.dump(hash_map, f, indent=2)
+def init_attachment_hashes(directory):
+    """Index existing attachments when the shared hash map is empty."""
+    if coordination.get_all_attachments(app.config['WORK_DIR']):
+        return
+    
+    for filename in os.listdir(directory):
+        file_path = os.path.join(directory, filename)
+        if os.path.isfile(file_path) and not filename.endswith('.json'):
+            coordination.register_attachment(app.config['WORK_DIR'], calculate_md5(file_path), filename)
+
+# Index existing attachments on first startup
+init_attachment_hashes(os.path.join(app.config['WORK_DIR'], 'attachments'))
 
 @app.route('/')
 def index():
     """Render the main application page."""
-    return render_template('index.html')
+    return render_template('index.html', collaboration_enabled=app.config['COLLABORATION_ENABLED'])
+
+def get_listing_stats(entry, cached_stats):
+    """
+    Get the statistics of a document for the file listing.
+    Uses the cached entry unless the document changed since it was indexed.
+    """
+    file_path = entry.path
+    try:
+        cached = cached_stats.get(file_path)
+        if cached and cached[0] == entry.mtime_ns and cached[1] == entry.size:
+            return cached[2]
+        
+        stats = document_index.update_document(
+            app.config['WORK_DIR'], storage, file_path,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        stats.pop('outline', None)
+        return stats
+    except Exception as e:
+        app.logger.error(f"Error indexing file {file_path}: {str(e)}")
+        return None
+
+@app.route('/view/<path:file_path>')
+def view_file(file_path):
+    """Render a markdown file to HTML for read-only viewing."""
+    # Basic path validation but preserving directory structure
+    if '..' in file_path or file_path.startswith('/'):
+        return jsonify({'error': 'Invalid file path'}), 400
+    
+    if not file_path.endswith('.md') or not storage.is_file(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        content = storage.read(file_path)
+        
+        format_options = app.config['DEFAULT_FORMAT_OPTIONS']
+        raw_options = b''
+        options = storage.read_options(file_path)
+        if options is not None:
+            raw_options = options.encode('utf-8')
+            format_options = json.loads(options)
+        
+        # The ETag covers both the content and the format options
+        digest = renderer.content_hash(content.encode('utf-8'))
+        etag = renderer.content_hash(digest.encode('utf-8') + raw_options)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        html, _ = render_cache.render(file_path, content, digest)
+        
+        stats = document_index.get_document_stats(
+            app.config['WORK_DIR'], storage, file_path, content,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        title = stats['outline'][0]['text'] if stats['outline'] else os.path.basename(file_path)[:-3]
+        
+        response = app.make_response(render_template(
+            'view.html',
+            title=title,
+            path=file_path,
+            content=html,
+            stats=stats,
+            format_options=format_options
+        ))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        app.logger.error(f"Error rendering file {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to render file: {str(e)}"}), 500
 
 @app.route('/api/files', methods=['GET'])
 def list_files():
-    """List all files in the documents directory."""
-    documents_dir = os.path.join(app.config['WORK_DIR'], 'documents')
+    """List all files in the documents store."""
     file_list = []
     
     try:
-        for root, dirs, files in os.walk(documents_dir):
-            # Get relative path from documents directory
-            rel_path = os.path.relpath(root, documents_dir)
-            
-            # Skip the root dir in the path string
-            if rel_path == '.':
-                rel_path = ''
-                
-            # Add directories
-            for directory in dirs:
-                dir_path = os.path.join(rel_path, directory) if rel_path else directory
-                # Use forward slashes for consistency across platforms
-                dir_path = dir_path.replace('\\', '/')
-                file_list.append({
-                    'type': 'directory',
-                    'name': directory,
-                    'path': dir_path
-                })
-                
-            # Add files
-            for file in files:
-                if file.endswith('.md'):
-                    file_path = os.path.join(rel_path, file) if rel_path else file
-                    # Use forward slashes for consistency
-                    file_path = file_path.replace('\\', '/')
-                    file_list.append({
-                        'type': 'file',
-                        'name': file,
-                        'path': file_path
-                    })
+        # Load all cached document statistics with a single query
+        cached_stats = document_index.get_all_document_stats(app.config['WORK_DIR'])
+        directory_usage = usage.get_all_directories(app.config['WORK_DIR'])
+        
+        for entry in storage.walk():
+            item = {
+                'type': entry.type,
+                'name': entry.path.rsplit('/', 1)[-1],
+                'path': entry.path
+            }
+            if entry.type == 'file':
+                item['stats'] = get_listing_stats(entry, cached_stats)
+            else:
+                item['usage'] = directory_usage.get(entry.path, {'files': 0, 'bytes': 0})
+            file_list.append(item)
         
         return jsonify(file_list)
     except Exception as e:
         app.logger.error(f"Error listing files: {str(e)}")
         return jsonify({'error': f"Failed to list files: {str(e)}"}), 500
 
+@app.route('/api/files/suggest', methods=['GET'])
+def suggest_files():
+    """Get the files and directories best matching a quick-open query."""
+    query = request.args.get('q', '')
+    kind = request.args.get('type') or None
+    
+    if kind not in (None, 'file', 'directory'):
+        return jsonify({'error': 'Type must be file or directory'}), 400
+    
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'Limit must be a number'}), 400
+    limit = max(1, min(limit, app.config['QUICK_OPEN_MAX_RESULTS']))
+    
+    try:
+        ensure_quick_open_index()
+        results = quick_open_index.search(query, limit, kind)
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        app.logger.error(f"Error searching files for {query}: {str(e)}")
+        return jsonify({'error': f"Failed to search files: {str(e)}"}), 500
+
 @app.route('/api/file', methods=['GET'])
 def get_file():
     """Get the content of a markdown file and check lock status."""
@@ -374,23 +802,25 @@ def get_file():
     if '..' in file_path or file_path.startswith('/'):
         return jsonify({'error': 'Invalid file path'}), 400
     
-    full_path = os.path.join(app.config['WORK_DIR'], 'documents', file_path)
-    
-    if not os.path.exists(full_path) or not file_path.endswith('.md'):
+    if not file_path.endswith('.md') or not storage.is_file(file_path):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = storage.read(file_path)
         
-        # Get the associated JSON file if it exists
-        json_path = full_path.replace('.md', '.json')
-        if os.path.exists(json_path):
-            with open(json_path, 'r', encoding='utf-8') as f:
-                format_options = json.load(f)
+        # Get the associated format options if they exist
+        options = storage.read_options(file_path)
+        if options is not None:
+            format_options = json.loads(options)
         else:
             format_options = app.config['DEFAULT_FORMAT_OPTIONS']
         
+        # Get the cached outline and statistics, refreshing them if stale
+        stats = document_index.get_document_stats(
+            app.config['WORK_DIR'], storage, file_path, content,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        
         # Check lock status
         is_locked, lock_owner, lock_time, is_expired = check_lock_status(file_path)
         
@@ -398,11 +828,12 @@ def get_file():
         lock_success = False
         lock_message = ""
         if session_id:
-            lock_success, _, lock_message = acquire_lock(file_path, session_id)
+            lock_success, _, lock_message = acquire_document_lock(file_path, session_id)
         
         return jsonify({
             'content': content,
             'formatOptions': format_options,
+            'stats': stats,
             'lockStatus': {
                 'isLocked': is_locked,
                 'lockOwner': lock_owner,
@@ -416,17 +847,8 @@ def get_file():
         app.logger.error(f"Error reading file {file_path}: {str(e)}")
         return jsonify({'error': f"Failed to read file: {str(e)}"}), 500
 
-@app.route('/api/file', methods=['POST'])
-@requires_auth
-def save_file():
-    """Save or update a markdown file with lock checking."""
-    data = request.json
-    file_path = data.get('path', '')
-    content = data.get('content', '')
-    format_options = data.get('formatOptions', app.config['DEFAULT_FORMAT_OPTIONS'])
-    session_id = data.get('session_id', '')
-    force_save = data.get('force_save', False)  # Option to force save and override locks
-    
+def secure_document_path(file_path):
+    """Sanitize a document path sent for saving, keeping its directories."""
     # Custom path handling for subfolders
     if '/' in file_path:
         # Split path into directory and filename parts
@@ -455,7 +877,20 @@ def save_file():
     if not file_path.endswith('.md'):
         file_path += '.md'
     
-    full_path = os.path.join(app.config['WORK_DIR'], 'documents', file_path)
+    return file_path
+
+def check_save_allowed(file_path, session_id, force_save):
+    """
+    Check that a session may save a document, acquiring or refreshing its lock.
+    Returns an error response, or None when the save can go ahead.
+    """
+    # The hub owns the content of documents being edited collaboratively
+    if collab_hub.is_active(file_path):
+        return jsonify({
+            'success': False,
+            'error': 'File is being edited collaboratively',
+            'collaborative': True
+        }), 409
     
     # Check lock status if not forcing save
     if not force_save and session_id:
@@ -475,49 +910,209 @@ def save_file():
     
     # Acquire or refresh the lock if session_id is provided
     if session_id:
-        lock_success, _, lock_message = acquire_lock(file_path, session_id)
+        lock_success, _, lock_message = acquire_document_lock(file_path, session_id)
         if not lock_success and not force_save:
             return jsonify({
                 'success': False,
                 'error': lock_message
             }), 423  # 423 Locked
     
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    return None
+
+@app.route('/api/file', methods=['POST'])
+@requires_auth
+def save_file():
+    """Save or update a markdown file with lock checking."""
+    data = request.json
+    file_path = secure_document_path(data.get('path', ''))
+    content = data.get('content', '')
+    format_options = data.get('formatOptions', app.config['DEFAULT_FORMAT_OPTIONS'])
+    session_id = data.get('session_id', '')
+    force_save = data.get('force_save', False)  # Option to force save and override locks
+    
+    error = check_save_allowed(file_path, session_id, force_save)
+    if error:
+        return error
+    
+    options = json.dumps(format_options, indent=2)
+    error, quota_warnings = check_quota(file_path, document_growth(file_path, len(content.encode('utf-8')), options))
+    if error:
+        return error
     
     try:
-        with open(full_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # Save the document with its format options
+        storage.write(file_path, content, options)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+        record_document_usage(file_path)
+        record_activity('save', file_path, session_id)
         
-        # Save format options to JSON file
-        json_path = full_path.replace('.md', '.json')
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(format_options, f, indent=2)
+        # Drop the stale rendered output
+        invalidations.publish('render', file_path)
         
-        return jsonify({'success': True})
+        # Compute the outline and statistics once per save
+        stats = document_index.update_document(
+            app.config['WORK_DIR'], storage, file_path, content,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        
+        # New files and changed first headings show up in quick-open
+        invalidations.publish('quick-open', file_path)
+        
+        return jsonify({'success': True, 'path': file_path, 'stats': stats, 'quotaWarnings': quota_warnings})
     except Exception as e:
         app.logger.error(f"Error saving file {file_path}: {str(e)}")
         return jsonify({'error': f"Failed to save file: {str(e)}"}), 500
 
+@app.route('/api/file/raw', methods=['GET'])
+def get_file_raw():
+    """
+    Stream the markdown of a file as the response body, for documents too
+    large to copy into a JSON response. Format options, statistics and
+    lock status are sent as JSON in X- headers.
+    """
+    file_path = request.args.get('path', '')
+    session_id = request.args.get('session_id', '')
+    
+    # Basic path validation but preserving directory structure
+    if '..' in file_path or file_path.startswith('/'):
+        return jsonify({'error': 'Invalid file path'}), 400
+    
+    if not file_path.endswith('.md') or not storage.is_file(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        options = storage.read_options(file_path)
+        format_options = json.loads(options) if options is not None else app.config['DEFAULT_FORMAT_OPTIONS']
+        
+        # The outline grows with the document, so only the totals fit in a header
+        stats = document_index.get_document_stats(
+            app.config['WORK_DIR'], storage, file_path,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE'],
+            include_outline=False
+        )
+        
+        is_locked, lock_owner, lock_time, is_expired = check_lock_status(file_path)
+        lock_success = False
+        lock_message = ""
+        if session_id:
+            lock_success, _, lock_message = acquire_document_lock(file_path, session_id)
+        
+        # Sized from the open handle, the document may be replaced meanwhile
+        body, size = storage.stream(file_path)
+    except Exception as e:
+        app.logger.error(f"Error reading file {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to read file: {str(e)}"}), 500
+    
+    response = app.response_class(
+        wrap_file(request.environ, body, CHUNK_SIZE),
+        mimetype='text/markdown',
+        direct_passthrough=True
+    )
+    response.content_length = size
+    response.headers['X-Format-Options'] = json.dumps(format_options)
+    response.headers['X-Document-Stats'] = json.dumps(stats)
+    response.headers['X-Lock-Status'] = json.dumps({
+        'isLocked': is_locked,
+        'lockOwner': lock_owner,
+        'lockTime': lock_time,
+        'isExpired': is_expired,
+        'lockSuccess': lock_success,
+        'lockMessage': lock_message
+    })
+    return response
+
+@app.route('/api/file/raw', methods=['PUT'])
+@requires_auth
+def save_file_raw():
+    """
+    Save a markdown file from the raw request body, streamed to storage in
+    chunks. Format options may be sent as JSON in the X-Format-Options
+    header, otherwise the stored ones are kept.
+    """
+    file_path = secure_document_path(request.args.get('path', ''))
+    session_id = request.args.get('session_id', '')
+    force_save = request.args.get('force_save') == 'true'
+    
+    # The body is read as a stream, so a declared size is checked up front
+    # and a chunked body is counted while it is written
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'Document is too large'}), 413
+    
+    options = request.headers.get('X-Format-Options')
+    if options is not None:
+        try:
+            options = json.dumps(json.loads(options), indent=2)
+        except ValueError:
+            return jsonify({'error': 'Invalid format options'}), 400
+    
+    error = check_save_allowed(file_path, session_id, force_save)
+    if error:
+        return error
+    
+    error, quota_warnings = check_quota(file_path, document_growth(file_path, request.content_length or 0, options))
+    if error:
+        return error
+    
+    # A chunked body has no declared size, so the write is also cut off
+    # once the document would grow past a hard quota
+    max_size = app.config['MAX_CONTENT_LENGTH']
+    headroom, quota = quota_headroom(file_path)
+    if headroom is not None:
+        max_size = min(max_size, headroom - document_growth(file_path, 0, options))
+    
+    try:
+        storage.write_stream(file_path, request.stream, options, max_size=max_size)
+    except DocumentTooLarge:
+        if max_size < app.config['MAX_CONTENT_LENGTH']:
+            return quota_error(quota)
+        return jsonify({'error': 'Document is too large'}), 413
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Document must be UTF-8 text'}), 400
+    except Exception as e:
+        app.logger.error(f"Error saving file {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to save file: {str(e)}"}), 500
+    
+    try:
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+        record_document_usage(file_path)
+        record_activity('save', file_path, session_id)
+        invalidations.publish('render', file_path)
+        stats = document_index.update_document(
+            app.config['WORK_DIR'], storage, file_path,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        invalidations.publish('quick-open', file_path)
+        
+        return jsonify({'success': True, 'path': file_path, 'stats': stats, 'quotaWarnings': quota_warnings})
+    except Exception as e:
+        app.logger.error(f"Error indexing file {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to index file: {str(e)}"}), 500
+
 @app.route('/api/file', methods=['DELETE'])
 @requires_auth
 def delete_file():
-    """Delete a markdown file and its associated JSON file."""
+    """Move a markdown file and its associated JSON file to the trash."""
     file_path = request.args.get('path', '')
-    full_path = os.path.join(app.config['WORK_DIR'], 'documents', file_path)
+    session_id = request.args.get('session_id')
     
-    if not os.path.exists(full_path):
+    if '..' in file_path or not storage.is_file(file_path):
         return jsonify({'error': 'File not found'}), 404
     
-    # Delete the markdown file
-    os.remove(full_path)
-    
-    # Delete the associated JSON file if it exists
-    json_path = full_path.replace('.md', '.json')
-    if os.path.exists(json_path):
-        os.remove(json_path)
-    
-    return jsonify({'success': True})
+    try:
+        trash_id = trash_bin.move(file_path, 'file', session_id)
+    except Exception as e:
+        app.logger.error(f"Error deleting file {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to delete file: {str(e)}"}), 500
+    
+    document_index.remove_document(app.config['WORK_DIR'], file_path)
+    usage.remove(app.config['WORK_DIR'], file_path)
+    sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+    record_activity('delete', file_path, session_id)
+    invalidations.publish('render', file_path)
+    invalidations.publish('quick-open', file_path)
+    collab_hub.close(file_path)
+    
+    return jsonify({'success': True, 'trashId': trash_id})
 
 @app.route('/api/directory', methods=['POST'])
 @requires_auth
@@ -545,10 +1140,15 @@ def create_directory():
         # Just a single directory name, basic sanitization
         dir_path = dir_path.replace('..', '').strip()
     
-    full_path = os.path.join(app.config['WORK_DIR'], 'documents', dir_path)
+    # Only the outermost directory created needs indexing, it covers the rest
+    new_root = dir_path
+    while '/' in new_root and not storage.is_dir(new_root.rsplit('/', 1)[0]):
+        new_root = new_root.rsplit('/', 1)[0]
     
     try:
-        os.makedirs(full_path, exist_ok=True)
+        storage.make_dirs(dir_path)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], new_root)
+        invalidations.publish('quick-open', new_root)
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"Error creating directory {dir_path}: {str(e)}")
@@ -557,16 +1157,68 @@ def create_directory():
 @app.route('/api/directory', methods=['DELETE'])
 @requires_auth
 def delete_directory():
-    """Delete a directory and all its contents."""
+    """Move a directory and all its contents to the trash."""
     dir_path = request.args.get('path', '')
-    full_path = os.path.join(app.config['WORK_DIR'], 'documents', dir_path)
+    session_id = request.args.get('session_id')
     
-    if not os.path.exists(full_path) or not os.path.isdir(full_path):
+    if not dir_path or '..' in dir_path or not storage.is_dir(dir_path):
         return jsonify({'error': 'Directory not found'}), 404
     
-    shutil.rmtree(full_path)
+    try:
+        trash_id = trash_bin.move(dir_path, 'directory', session_id)
+    except Exception as e:
+        app.logger.error(f"Error deleting directory {dir_path}: {str(e)}")
+        return jsonify({'error': f"Failed to delete directory: {str(e)}"}), 500
+    
+    document_index.remove_directory(app.config['WORK_DIR'], dir_path)
+    usage.remove(app.config['WORK_DIR'], dir_path)
+    sync.invalidate_directory_hashes(app.config['WORK_DIR'], dir_path)
+    record_activity('delete', dir_path, session_id, kind='directory')
+    invalidations.publish('render-directory', dir_path)
+    invalidations.publish('quick-open', dir_path)
+    collab_hub.close(dir_path, prefix=True)
+    
+    return jsonify({'success': True, 'trashId': trash_id})
+
+@app.route('/api/trash', methods=['GET'])
+def list_trash():
+    """List the deleted files and directories that can still be restored."""
+    try:
+        items = trash_bin.list_items()
+        return jsonify({'items': items, 'totalSize': sum(item['size'] or 0 for item in items)})
+    except Exception as e:
+        app.logger.error(f"Error listing trash: {str(e)}")
+        return jsonify({'error': f"Failed to list trash: {str(e)}"}), 500
+
+@app.route('/api/trash/restore', methods=['POST'])
+@requires_auth
+def restore_trash():
+    """Move a deleted file or directory back to where it was deleted from."""
+    trash_id = (request.json or {}).get('id', '')
     
-    return jsonify({'success': True})
+    try:
+        item = trash_bin.restore(trash_id)
+    except trash.TrashError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        app.logger.error(f"Error restoring {trash_id} from trash: {str(e)}")
+        return jsonify({'error': f"Failed to restore: {str(e)}"}), 500
+    
+    if item is None:
+        return jsonify({'error': 'Item not found in trash'}), 404
+    
+    # Statistics are indexed again the next time the documents are listed
+    usage.add_tree(app.config['WORK_DIR'], storage, item['path'])
+    sync.invalidate_directory_hashes(app.config['WORK_DIR'], item['path'])
+    # A restored directory brings its documents back to the recent list
+    documents = ()
+    if item['type'] == 'directory':
+        documents = [entry.path for entry in storage.walk(item['path']) if entry.type == 'file']
+    record_activity('restore', item['path'], kind=item['type'], documents=documents)
+    invalidations.publish('render-directory' if item['type'] == 'directory' else 'render', item['path'])
+    invalidations.publish('quick-open', item['path'])
+    
+    return jsonify({'success': True, 'path': item['path'], 'type': item['type']})
 
 @app.route('/api/upload', methods=['POST'])
 @requires_auth
@@ -580,8 +1232,8 @@ def upload_attachment():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
-    # Create a temporary file to calculate hash
-    temp_path = os.path.join(app.config['WORK_DIR'], 'temp_upload')
+    # Create a temporary file to calculate hash, unique so concurrent uploads don't collide
+    temp_path = os.path.join(app.config['WORK_DIR'], f'temp_upload_{uuid.uuid4().hex}')
     file.save(temp_path)
     
     # Calculate MD5 hash
@@ -590,13 +1242,10 @@ def upload_attachment():
     # Get the attachment directory
     attachments_dir = os.path.join(app.config['WORK_DIR'], 'attachments')
     
-    # Load hash mapping
-    hash_map = get_image_hash_mapping(attachments_dir)
-    
     # Check if this hash already exists
-    if file_hash in hash_map:
+    filename = coordination.get_attachment_filename(app.config['WORK_DIR'], file_hash)
+    if filename:
         # File already exists, use the existing one
-        filename = hash_map[file_hash]
         # Remove the temporary file
         os.remove(temp_path)
         
@@ -607,6 +1256,13 @@ def upload_attachment():
             'duplicate': True
         })
     
+    # Only new content takes up space
+    size = os.path.getsize(temp_path)
+    error, quota_warnings = check_quota(None, size)
+    if error:
+        os.remove(temp_path)
+        return error
+    
     # This is a new file, generate a filename based on hash
     file_ext = os.path.splitext(file.filename)[1].lower()
     if not file_ext:
@@ -617,17 +1273,23 @@ def upload_attachment():
     file_path = os.path.join(attachments_dir, hash_filename)
     
     # Move the temp file to the final location
-    os.rename(temp_path, file_path)
+    # Identical content races to the same name, so replacing is safe
+    os.replace(temp_path, file_path)
     
-    # Update the hash mapping
-    hash_map[file_hash] = hash_filename
-    save_hash_mapping(attachments_dir, hash_map)
+    # Update the hash mapping, another upload of the same file may have won the race
+    hash_filename, created = coordination.register_attachment(app.config['WORK_DIR'], file_hash, hash_filename)
+    if not created and os.path.basename(file_path) != hash_filename:
+        os.remove(file_path)
+    if created:
+        usage.add_attachment(app.config['WORK_DIR'], size, current_username())
+        record_activity('upload', hash_filename, kind='attachment')
     
     return jsonify({
         'success': True,
         'filename': hash_filename,
         'url': f'/attachment/{hash_filename}',
-        'duplicate': False
+        'duplicate': not created,
+        'quotaWarnings': quota_warnings
     })
 
 @app.route('/attachment/<path:filename>')
@@ -635,6 +1297,71 @@ def get_attachment(filename):
     """Serve an attachment file."""
     return send_from_directory(os.path.join(app.config['WORK_DIR'], 'attachments'), filename)
 
+@app.route('/api/usage', methods=['GET'])
+def get_usage():
+    """Get the space used by a directory, its subdirectories and the attachments."""
+    dir_path = request.args.get('path', '').strip('/')
+    
+    if '..' in dir_path:
+        return jsonify({'error': 'Invalid path'}), 400
+    
+    if dir_path and not storage.is_dir(dir_path):
+        return jsonify({'error': 'Directory not found'}), 404
+    
+    try:
+        totals, directories = usage.get_directory(app.config['WORK_DIR'], dir_path)
+        if dir_path:
+            quota = app.config['DIRECTORY_QUOTAS'].get(dir_path, {})
+        else:
+            quota = {'soft': app.config['QUOTA_SOFT_LIMIT'], 'hard': app.config['QUOTA_HARD_LIMIT']}
+        
+        return jsonify({
+            'path': dir_path,
+            'files': totals['files'],
+            'bytes': totals['bytes'],
+            'directories': directories,
+            'attachments': usage.get_attachments(app.config['WORK_DIR']),
+            'quota': {'soft': quota.get('soft'), 'hard': quota.get('hard')},
+            'complete': usage.is_built(app.config['WORK_DIR'])
+        })
+    except Exception as e:
+        app.logger.error(f"Error getting usage of {dir_path}: {str(e)}")
+        return jsonify({'error': f"Failed to get usage: {str(e)}"}), 500
+
+@app.route('/api/recent', methods=['GET'])
+def get_recent_files():
+    """Get the most recently changed documents, newest first."""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), app.config['ACTIVITY_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'Limit must be a number'}), 400
+    
+    try:
+        return jsonify({'items': activity.get_recent(app.config['WORK_DIR'], limit)})
+    except Exception as e:
+        app.logger.error(f"Error getting recent files: {str(e)}")
+        return jsonify({'error': f"Failed to get recent files: {str(e)}"}), 500
+
+@app.route('/api/activity', methods=['GET'])
+def get_activity():
+    """
+    Get the changes logged after an entry, oldest first. Clients pass the
+    id of the last entry they have as since_id to page through the log.
+    """
+    try:
+        since_id = int(request.args.get('since_id', 0))
+        page_size = app.config['ACTIVITY_PAGE_SIZE']
+        limit = max(1, min(int(request.args.get('limit', page_size)), page_size))
+    except ValueError:
+        return jsonify({'error': 'since_id and limit must be whole numbers'}), 400
+    
+    try:
+        entries, more = activity.get_activity(app.config['WORK_DIR'], since_id, limit)
+        return jsonify({'items': entries, 'more': more})
+    except Exception as e:
+        app.logger.error(f"Error getting activity: {str(e)}")
+        return jsonify({'error': f"Failed to get activity: {str(e)}"}), 500
+
 @app.route('/api/file/rename', methods=['POST'])
 @requires_auth
 def rename_file():
@@ -654,31 +1381,34 @@ def rename_file():
     if old_path.endswith('.md') and not new_path.endswith('.md'):
         new_path += '.md'
     
-    # Full paths
-    old_full_path = os.path.join(app.config['WORK_DIR'], 'documents', old_path)
-    new_full_path = os.path.join(app.config['WORK_DIR'], 'documents', new_path)
-    
     # Check if source exists
-    if not os.path.exists(old_full_path):
+    if not storage.is_file(old_path):
         return jsonify({'error': 'Source file not found'}), 404
     
     # Check if destination already exists
-    if os.path.exists(new_full_path):
+    if storage.is_file(new_path) or storage.is_dir(new_path):
         return jsonify({'error': 'A file with the new name already exists'}), 409
     
+    # Moving the document would drop the edits merged in its hub since the last snapshot
+    if collab_hub.is_active(old_path):
+        return jsonify({
+            'error': 'File is being edited collaboratively',
+            'collaborative': True
+        }), 409
+    
     try:
-        # Create the target directory if it doesn't exist
-        os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
-        
-        # Move/rename the file
-        shutil.move(old_full_path, new_full_path)
+        # Move/rename the file along with its format options
+        storage.rename(old_path, new_path)
         
-        # Also move the format options JSON file if it exists
-        old_json_path = old_full_path.replace('.md', '.json')
-        new_json_path = new_full_path.replace('.md', '.json')
-        
-        if os.path.exists(old_json_path):
-            shutil.move(old_json_path, new_json_path)
+        document_index.rename_document(app.config['WORK_DIR'], old_path, new_path)
+        usage.move(app.config['WORK_DIR'], old_path, new_path)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], old_path)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], new_path)
+        record_activity('rename', old_path, new_path=new_path)
+        invalidations.publish('render', old_path)
+        invalidations.publish('quick-open', old_path)
+        invalidations.publish('quick-open', new_path)
+        collab_hub.close(old_path)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -700,32 +1430,415 @@ def rename_directory():
     if '..' in old_path or '..' in new_path:
         return jsonify({'error': 'Invalid path'}), 400
     
-    # Full paths
-    old_full_path = os.path.join(app.config['WORK_DIR'], 'documents', old_path)
-    new_full_path = os.path.join(app.config['WORK_DIR'], 'documents', new_path)
-    
     # Check if source exists
-    if not os.path.exists(old_full_path) or not os.path.isdir(old_full_path):
+    if not storage.is_dir(old_path):
         return jsonify({'error': 'Source directory not found'}), 404
     
     # Check if destination already exists
-    if os.path.exists(new_full_path):
+    if storage.is_file(new_path) or storage.is_dir(new_path):
         return jsonify({'error': 'A directory with the new name already exists'}), 409
     
+    if collab_hub.is_active(old_path, prefix=True):
+        return jsonify({
+            'error': 'A file in this directory is being edited collaboratively',
+            'collaborative': True
+        }), 409
+    
     try:
-        # Create the parent directory structure if needed
-        parent_dir = os.path.dirname(new_full_path)
-        if parent_dir:
-            os.makedirs(parent_dir, exist_ok=True)
-        
         # Move/rename the directory
-        shutil.move(old_full_path, new_full_path)
+        storage.rename_dir(old_path, new_path)
+        document_index.rename_directory(app.config['WORK_DIR'], old_path, new_path)
+        usage.move(app.config['WORK_DIR'], old_path, new_path)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], old_path)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], new_path)
+        record_activity('rename', old_path, kind='directory', new_path=new_path)
+        invalidations.publish('render-directory', old_path)
+        invalidations.publish('quick-open', old_path)
+        invalidations.publish('quick-open', new_path)
+        collab_hub.close(old_path, prefix=True)
         
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"Error renaming directory from {old_path} to {new_path}: {str(e)}")
         return jsonify({'error': f"Failed to rename directory: {str(e)}"}), 500
 
+def is_valid_sync_path(path):
+    """Check a document path sent by a sync client."""
+    return bool(path) and '..' not in path and not path.startswith('/') and '\\' not in path
+
+@app.route('/api/sync/manifest', methods=['GET'])
+def get_sync_manifest():
+    """Get the content hash manifest of a documents directory."""
+    dir_path = request.args.get('path', '').strip('/')
+    if dir_path and not is_valid_sync_path(dir_path):
+        return jsonify({'error': 'Invalid path'}), 400
+    
+    if not storage.is_dir(dir_path):
+        return jsonify({'error': 'Directory not found'}), 404
+    
+    try:
+        return jsonify(sync.directory_manifest(app.config['WORK_DIR'], storage, dir_path))
+    except Exception as e:
+        app.logger.error(f"Error building sync manifest for {dir_path}: {str(e)}")
+        return jsonify({'error': f"Failed to build manifest: {str(e)}"}), 500
+
+@app.route('/api/sync/attachments', methods=['GET'])
+def get_sync_attachments():
+    """Get the attachment manifest, or the names in one bucket of it."""
+    bucket = request.args.get('bucket')
+    attachments_dir = os.path.join(app.config['WORK_DIR'], 'attachments')
+    
+    try:
+        return jsonify(sync.attachment_manifest(attachments_dir, bucket))
+    except Exception as e:
+        app.logger.error(f"Error building attachment manifest: {str(e)}")
+        return jsonify({'error': f"Failed to build manifest: {str(e)}"}), 500
+
+@app.route('/api/sync/attachments/missing', methods=['POST'])
+def get_missing_attachments():
+    """Get which of the client's attachment names the server doesn't have."""
+    names = (request.json or {}).get('names', [])
+    attachments_dir = os.path.join(app.config['WORK_DIR'], 'attachments')
+    
+    missing = [name for name in names
+               if name != secure_filename(name) or not os.path.isfile(os.path.join(attachments_dir, name))]
+    return jsonify({'missing': missing})
+
+@app.route('/api/sync/documents', methods=['POST'])
+def get_sync_documents():
+    """Get the content, format options and hash of several documents at once."""
+    paths = (request.json or {}).get('paths', [])
+    documents = []
+    missing = []
+    
+    for file_path in paths:
+        if not is_valid_sync_path(file_path) or not file_path.endswith('.md') or not storage.is_file(file_path):
+            missing.append(file_path)
+            continue
+        
+        try:
+            content = storage.read(file_path)
+            options = storage.read_options(file_path)
+            format_options = json.loads(options) if options is not None else app.config['DEFAULT_FORMAT_OPTIONS']
+            
+            documents.append({
+                'path': file_path,
+                'hash': sync.get_document_hash(app.config['WORK_DIR'], storage, file_path),
+                'content': content,
+                'formatOptions': format_options
+            })
+        except Exception as e:
+            app.logger.error(f"Error reading file {file_path} for sync: {str(e)}")
+            missing.append(file_path)
+    
+    return jsonify({'documents': documents, 'missing': missing})
+
+def apply_sync_change(change, session_id):
+    """
+    Apply one pushed document change unless it conflicts.
+    The client sends the hash its edit was based on (None for a new file);
+    the change only applies while the server still has that version and
+    no other session holds the file lock.
+    Returns (result, conflict), one of which is None.
+    """
+    file_path = change.get('path', '')
+    base_hash = change.get('baseHash')
+    
+    if not is_valid_sync_path(file_path) or not file_path.endswith('.md'):
+        return None, {'path': file_path, 'reason': 'invalid'}
+    
+    if collab_hub.is_active(file_path):
+        return None, {
+            'path': file_path,
+            'reason': 'collaborative',
+            'serverHash': sync.get_document_hash(app.config['WORK_DIR'], storage, file_path)
+        }
+    
+    # Hold the file lock while comparing and writing, so concurrent pushes
+    # and browser saves can't interleave with this change
+    is_locked, lock_owner, lock_time, is_expired = check_lock_status(file_path)
+    held_before = is_locked and not is_expired and lock_owner == session_id
+    lock_success, lock_owner, _ = acquire_document_lock(file_path, session_id)
+    if not lock_success:
+        return None, {
+            'path': file_path,
+            'reason': 'locked',
+            'serverHash': sync.get_document_hash(app.config['WORK_DIR'], storage, file_path),
+            'lockStatus': {'isLocked': True, 'lockOwner': lock_owner, 'lockTime': lock_time}
+        }
+    
+    try:
+        server_hash = sync.get_document_hash(app.config['WORK_DIR'], storage, file_path)
+        if server_hash != base_hash:
+            reason = 'exists' if base_hash is None else ('deleted' if server_hash is None else 'modified')
+            return None, {'path': file_path, 'reason': reason, 'serverHash': server_hash}
+        
+        if change.get('deleted'):
+            if server_hash is not None:
+                trash_bin.move(file_path, 'file', session_id)
+            document_index.remove_document(app.config['WORK_DIR'], file_path)
+            usage.remove(app.config['WORK_DIR'], file_path)
+            record_activity('delete', file_path, session_id)
+            sync.remove_document_hash(app.config['WORK_DIR'], file_path)
+            sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+            invalidations.publish('render', file_path)
+            invalidations.publish('quick-open', file_path)
+            return {'path': file_path, 'hash': None}, None
+        
+        content = change.get('content', '')
+        options = json.dumps(change.get('formatOptions', app.config['DEFAULT_FORMAT_OPTIONS']), indent=2)
+        exceeded, _ = find_quotas(file_path, document_growth(file_path, len(content.encode('utf-8')), options))
+        if exceeded:
+            return None, {'path': file_path, 'reason': 'quota', 'serverHash': server_hash, 'quota': exceeded}
+        storage.write(file_path, content, options)
+        sync.invalidate_directory_hashes(app.config['WORK_DIR'], file_path)
+        record_document_usage(file_path)
+        record_activity('save', file_path, session_id)
+        
+        new_hash = sync.document_hash(storage, file_path)
+        sync.store_document_hash(app.config['WORK_DIR'], storage, file_path, new_hash)
+        document_index.update_document(
+            app.config['WORK_DIR'], storage, file_path, content,
+            words_per_minute=app.config['READING_WORDS_PER_MINUTE']
+        )
+        invalidations.publish('render', file_path)
+        invalidations.publish('quick-open', file_path)
+        return {'path': file_path, 'hash': new_hash}, None
+    finally:
+        if not held_before:
+            release_lock(file_path, session_id)
+
+@app.route('/api/sync/push', methods=['POST'])
+@requires_auth
+def push_sync_changes():
+    """Apply document changes made offline, reporting conflicts instead of overwriting."""
+    data = request.json or {}
+    changes = data.get('changes', [])
+    # Clients without an editor session still need a lock owner of their own
+    session_id = data.get('sessionId') or f"sync-{uuid.uuid4().hex}"
+    
+    applied = []
+    conflicts = []
+    for change in changes:
+        try:
+            result, conflict = apply_sync_change(change, session_id)
+        except Exception as e:
+            app.logger.error(f"Error applying sync change to {change.get('path')}: {str(e)}")
+            conflict = {'path': change.get('path'), 'reason': 'error', 'error': str(e)}
+            result = None
+        if result:
+            applied.append(result)
+        else:
+            conflicts.append(conflict)
+    
+    return jsonify({'success': not conflicts, 'applied': applied, 'conflicts': conflicts})
+
+def get_collab_request():
+    """
+    Get the JSON body of a collaboration request with its validated path.
+    Returns (data, file_path, error_response).
+    """
+    if not app.config['COLLABORATION_ENABLED']:
+        return None, None, (jsonify({'error': 'Collaborative editing is disabled'}), 404)
+    
+    data = request.json if request.method == 'POST' else request.args
+    file_path = (data or {}).get('path', '')
+    if not is_valid_sync_path(file_path) or not file_path.endswith('.md'):
+        return None, None, (jsonify({'error': 'Invalid file path'}), 400)
+    if not data.get('clientId'):
+        return None, None, (jsonify({'error': 'A client ID must be provided'}), 400)
+    return data, file_path, None
+
+@app.route('/api/collab/join', methods=['POST'])
+@requires_auth
+def join_collab():
+    """Start editing a document collaboratively."""
+    data, file_path, error = get_collab_request()
+    if error:
+        return error
+    
+    if not storage.is_file(file_path) and not collab_hub.is_active(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    # Someone editing the file the exclusive way must finish first
+    is_locked, lock_owner, lock_time, is_expired = check_lock_status(file_path)
+    if is_locked and not is_expired and lock_owner != data.get('session_id'):
+        return jsonify({
+            'error': 'File is locked by another session',
+            'lockStatus': {'isLocked': True, 'lockOwner': lock_owner, 'lockTime': lock_time, 'isExpired': is_expired}
+        }), 423
+    
+    try:
+        return jsonify(collab_hub.join(file_path, data['clientId']))
+    except Exception as e:
+        app.logger.error(f"Error joining collaboration on {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to join collaboration: {str(e)}"}), 500
+
+@app.route('/api/collab/ops', methods=['POST'])
+@requires_auth
+def submit_collab_op():
+    """Commit an edit operation made against a revision."""
+    data, file_path, error = get_collab_request()
+    if error:
+        return error
+    
+    try:
+        return jsonify(collab_hub.submit(
+            file_path, data.get('hubId'), data['clientId'], int(data.get('rev', -1)), data.get('op')
+        ))
+    except collab.CollabError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        app.logger.error(f"Error applying collaborative edit to {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to apply edit: {str(e)}"}), 500
+
+@app.route('/api/collab/ops', methods=['GET'])
+@requires_auth
+def poll_collab_ops():
+    """Get the edit operations committed after a revision."""
+    data, file_path, error = get_collab_request()
+    if error:
+        return error
+    
+    try:
+        since = int(data.get('since', 0))
+        return jsonify(collab_hub.poll(file_path, data.get('hubId'), data['clientId'], since))
+    except ValueError:
+        return jsonify({'error': 'Revision must be a number'}), 400
+    except Exception as e:
+        app.logger.error(f"Error polling collaborative edits of {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to get edits: {str(e)}"}), 500
+
+@app.route('/api/collab/leave', methods=['POST'])
+@requires_auth
+def leave_collab():
+    """Stop editing a document collaboratively."""
+    data, file_path, error = get_collab_request()
+    if error:
+        return error
+    
+    collab_hub.leave(file_path, data['clientId'])
+    return jsonify({'success': True})
+
+@app.route('/api/collab/snapshot', methods=['POST'])
+@requires_auth
+def snapshot_collab():
+    """Write the merged edits of a document now instead of at the next snapshot."""
+    data, file_path, error = get_collab_request()
+    if error:
+        return error
+    
+    try:
+        written = collab_hub.persist(file_path)
+        return jsonify({'success': True, 'written': written})
+    except usage.QuotaExceeded as e:
+        return quota_error(e.quota)
+    except Exception as e:
+        app.logger.error(f"Error saving collaborative snapshot of {file_path}: {str(e)}")
+        return jsonify({'error': f"Failed to save snapshot: {str(e)}"}), 500
+
+@app.route('/api/publish', methods=['POST'])
+@requires_auth
+def publish_site():
+    """Publish a directory of documents as a static site."""
+    data = request.json or {}
+    subtree = data.get('path', '').strip('/')
+    
+    if '..' in subtree:
+        return jsonify({'error': 'Invalid path'}), 400
+    
+    if subtree and not storage.is_dir(subtree):
+        return jsonify({'error': 'Directory not found'}), 404
+    
+    try:
+        # Run the publisher as its own process, its render pool must not re-import the server
+        output_dir = os.path.join(app.config['PUBLISH_DIR'], publisher.publish_name(subtree))
+        command = [sys.executable, publisher.__file__, subtree, output_dir, '--json']
+        if app.config['PUBLISH_WORKERS']:
+            command += ['--workers', str(app.config['PUBLISH_WORKERS'])]
+        
+        # The publisher locks the output directory, so publishes from other workers are refused too
+        result = subprocess.run(command, capture_output=True, text=True, cwd=app.config['BASE_DIR'])
+        if result.returncode == publisher.BUSY_EXIT_CODE:
+            return jsonify({'error': 'A publish is already in progress'}), 409
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'publisher failed')
+        
+        summary = json.loads(result.stdout.strip().splitlines()[-1])
+        return jsonify({'success': True, 'outputDir': output_dir, **summary})
+    except Exception as e:
+        app.logger.error(f"Error publishing {subtree or 'workspace'}: {str(e)}")
+        return jsonify({'error': f"Failed to publish: {str(e)}"}), 500
+
+# ===== Profiling API Routes =====
+
+@app.route('/api/admin/profile', methods=['GET'])
+@requires_auth
+def get_profile():
+    """
+    Get the stack samples of this worker process as collapsed stacks,
+    ready for flamegraph tools. Pass reset=1 to start a new profile.
+    """
+    if not app.config['PROFILING_ENABLED']:
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    
+    collapsed = sampler.collapsed()
+    summary = sampler.summary()
+    if request.args.get('reset') == '1':
+        sampler.reset()
+    
+    response = app.response_class(collapsed + '\n', mimetype='text/plain')
+    response.headers['X-Profile-Pid'] = str(summary['pid'])
+    response.headers['X-Profile-Samples'] = str(summary['samples'])
+    return response
+
+@app.route('/api/admin/slow-requests', methods=['GET'])
+@requires_auth
+def get_slow_requests():
+    """Get the timing breakdowns of recent slow requests served by this worker process."""
+    if not app.config['PROFILING_ENABLED']:
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'thresholdMs': app.config['SLOW_REQUEST_THRESHOLD'] * 1000,
+        'sampler': sampler.summary(),
+        'requests': profiling.tracer.get_slow_requests()
+    })
+
+@app.route('/api/admin/admission', methods=['GET'])
+@requires_auth
+def get_admission():
+    """Get the admission limits of this worker process and how many requests it shed."""
+    return jsonify({
+        'pid': os.getpid(),
+        'threads': app.config['SERVER_THREADS'],
+        'limits': app.config['ADMISSION_LIMITS'],
+        'shed': admission_controller.get_shed_counts()
+    })
+
+@app.route('/api/admin/scrub', methods=['GET'])
+@requires_auth
+def get_scrub_report():
+    """Get the progress of the integrity scrubber and the problems it found."""
+    try:
+        limit = int(request.args.get('limit', app.config['SCRUB_REPORT_LIMIT']))
+    except ValueError:
+        return jsonify({'error': 'Limit must be a number'}), 400
+    limit = max(1, min(limit, app.config['SCRUB_REPORT_LIMIT']))
+    
+    try:
+        findings, total = scrubber.get_findings(limit)
+        return jsonify({
+            'enabled': app.config['SCRUB_ENABLED'],
+            'state': scrubber.get_state(),
+            'findings': findings,
+            'totalFindings': total
+        })
+    except Exception as e:
+        app.logger.error(f"Error getting scrub report: {str(e)}")
+        return jsonify({'error': f"Failed to get scrub report: {str(e)}"}), 500
+
 # ===== User Authentication API Routes =====
 
 @app.route('/api/auth/check', methods=['GET'])
@@ -818,7 +1931,7 @@ def manage_file_lock():
         return jsonify({'error': 'File path and session ID are required'}), 400
     
     if action == 'acquire':
-        success, owner, message = acquire_lock(file_path, session_id)
+        success, owner, message = acquire_document_lock(file_path, session_id)
         return jsonify({
             'success': success,
             'lockOwner': owner,
@@ -862,9 +1975,21 @@ def check_file_lock():
 
 if __name__ == '__main__':
     # app.run(debug=True)
-    serve(
-        app,
-        host='0.0.0.0',
-        port='5000',
-        ident='WriteSimplr',      # Server identification
-    )
\ No newline at end of file
+    if app.config['SERVER_WORKERS'] > 1:
+        # Several processes share one port, the parent runs the cleanup task
+        prefork.run(
+            app,
+            app.config['SERVER_HOST'],
+            app.config['SERVER_PORT'],
+            app.config['SERVER_WORKERS'],
+            serve_options={'ident': 'WriteSimplr', 'threads': app.config['SERVER_THREADS']},
+            on_parent_ready=start_background_tasks
+        )
+    else:
+        serve(
+            app,
+            host=app.config['SERVER_HOST'],
+            port=str(app.config['SERVER_PORT']),
+            ident='WriteSimplr',      # Server identification
+            threads=app.config['SERVER_THREADS'],
+        )
\ No newline at end of file
@@ -3,6 +3,7 @@ import json
 import os
 from functools import wraps
 from flask import request, jsonify
+from profiling import track
 
 # Path to the users file
 USERS_FILE = 'users.json'
@@ -90,31 +91,40 @@ def requires_auth(f):
     """Decorator for routes that require authentication."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        # Get auth from request
-        auth = request.headers.get('Authorization')
-        
-        # If no users are configured, auth is not required
-        users = load_users()
-        if not users:
-            return f(*args, **kwargs)
-        
-        # Check if auth header exists and is in correct format
-        if not auth or not auth.startswith('Basic '):
-            return jsonify({'error': 'Authentication required'}), 401
-        
-        # Extract credentials
-        try:
-            import base64
-            credentials = base64.b64decode(auth[6:]).decode('utf-8')
-            username, password = credentials.split(':', 1)
-        except Exception:
-            return jsonify({'error': 'Invalid authentication format'}), 401
-        
-        # Check credentials
-        if not authenticate(username, password):
-            return jsonify({'error': 'Invalid username or password'}), 401
+        with track('auth'):
+            error = check_request_auth()
+        if error:
+            return jsonify({'error': error}), 401
         
         # Authentication successful
         return f(*args, **kwargs)
     
-    return decorated
\ No newline at end of file
+    return decorated
+
+def check_request_auth():
+    """Check the credentials of the current request. Returns an error message or None."""
+    # Get auth from request
+    auth = request.headers.get('Authorization')
+    
+    # If no users are configured, auth is not required
+    users = load_users()
+    if not users:
+        return None
+    
+    # Check if auth header exists and is in correct format
+    if not auth or not auth.startswith('Basic '):
+        return 'Authentication required'
+    
+    # Extract credentials
+    try:
+        import base64
+        credentials = base64.b64decode(auth[6:]).decode('utf-8')
+        username, password = credentials.split(':', 1)
+    except Exception:
+        return 'Invalid authentication format'
+    
+    # Check credentials
+    if not authenticate(username, password):
+        return 'Invalid username or password'
+    
+    return None
\ No newline at end of file
@@ -0,0 +1,484 @@
+# collab.py - Operational transformation hub for collaborative editing
+import json
+import time
+import uuid
+import threading
+from coordination import get_coordination_db
+
+class CollabError(Exception):
+    """Raised for operations that can't be applied to a document."""
+
+# Seconds after which a snapshot claim is treated as left behind by a crashed process
+PERSIST_CLAIM_TIMEOUT = 30.0
+
+# Text operations are lists of components applied left to right:
+# a positive int retains characters, a negative int deletes them and a
+# string inserts it. Lengths count Unicode code points on both ends.
+
+def _is_retain(component):
+    return isinstance(component, int) and not isinstance(component, bool) and component > 0
+
+def _is_delete(component):
+    return isinstance(component, int) and not isinstance(component, bool) and component < 0
+
+def _is_insert(component):
+    return isinstance(component, str)
+
+def _push(op, component):
+    """Append a component, merging it into the last one when they are alike."""
+    if component == 0 or component == '':
+        return
+    if op:
+        last = op[-1]
+        if (_is_retain(last) and _is_retain(component)) or (_is_delete(last) and _is_delete(component)):
+            op[-1] = last + component
+            return
+        if _is_insert(last) and _is_insert(component):
+            op[-1] = last + component
+            return
+    op.append(component)
+
+def validate_operation(op):
+    """Check that an operation only holds retain, delete and insert components."""
+    if not isinstance(op, list):
+        raise CollabError('Operation must be a list')
+    for component in op:
+        if not (_is_retain(component) or _is_delete(component) or _is_insert(component)):
+            raise CollabError(f"Invalid operation component: {component!r}")
+
+def base_length(op):
+    """Get the length of text an operation applies to."""
+    return sum(abs(c) for c in op if not _is_insert(c))
+
+def apply_operation(text, op):
+    """Apply an operation to a text."""
+    if base_length(op) != len(text):
+        raise CollabError('Operation does not match the document length')
+
+    parts = []
+    index = 0
+    for component in op:
+        if _is_retain(component):
+            parts.append(text[index:index + component])
+            index += component
+        elif _is_delete(component):
+            index -= component
+        else:
+            parts.append(component)
+    return ''.join(parts)
+
+def transform(a, b):
+    """
+    Transform two concurrent operations on the same text.
+    Returns (a2, b2) so applying a then b2 gives the same text as b then a2.
+    Inserts of a are placed before inserts of b at the same position.
+    """
+    if base_length(a) != base_length(b):
+        raise CollabError('Concurrent operations apply to different document lengths')
+
+    a_prime, b_prime = [], []
+    ops_a, ops_b = list(a), list(b)
+    i = j = 0
+    op1 = ops_a[0] if ops_a else None
+    op2 = ops_b[0] if ops_b else None
+
+    def next_a():
+        nonlocal i
+        i += 1
+        return ops_a[i] if i < len(ops_a) else None
+
+    def next_b():
+        nonlocal j
+        j += 1
+        return ops_b[j] if j < len(ops_b) else None
+
+    while op1 is not None or op2 is not None:
+        if op1 is not None and _is_insert(op1):
+            _push(a_prime, op1)
+            _push(b_prime, len(op1))
+            op1 = next_a()
+            continue
+        if op2 is not None and _is_insert(op2):
+            _push(a_prime, len(op2))
+            _push(b_prime, op2)
+            op2 = next_b()
+            continue
+
+        if _is_retain(op1) and _is_retain(op2):
+            length = min(op1, op2)
+            _push(a_prime, length)
+            _push(b_prime, length)
+        elif _is_delete(op1) and _is_delete(op2):
+            # Both deleted the same text, nothing is left to transform
+            length = min(-op1, -op2)
+        elif _is_delete(op1) and _is_retain(op2):
+            length = min(-op1, op2)
+            _push(a_prime, -length)
+        else:
+            length = min(op1, -op2)
+            _push(b_prime, -length)
+
+        op1 = op1 - length if op1 > 0 else op1 + length
+        op2 = op2 - length if op2 > 0 else op2 + length
+        if op1 == 0:
+            op1 = next_a()
+        if op2 == 0:
+            op2 = next_b()
+
+    return a_prime, b_prime
+
+def init_collab_db(work_dir):
+    """Initialize the collaborative editing tables in the coordination database."""
+    with get_coordination_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS collab_documents (
+            file_path TEXT PRIMARY KEY,
+            hub_id TEXT NOT NULL,
+            base_rev INTEGER NOT NULL,
+            base_text TEXT NOT NULL,
+            persisted_rev INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS collab_ops (
+            file_path TEXT NOT NULL,
+            rev INTEGER NOT NULL,
+            client_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (file_path, rev)
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS collab_clients (
+            file_path TEXT NOT NULL,
+            client_id TEXT NOT NULL,
+            last_seen REAL NOT NULL,
+            PRIMARY KEY (file_path, client_id)
+        )
+        ''')
+        # Documents whose snapshot is being written, so only one process writes each at a time
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS collab_persists (
+            file_path TEXT PRIMARY KEY,
+            claimed_at REAL NOT NULL
+        )
+        ''')
+        conn.commit()
+
+class CollabHub:
+    """
+    Per-document editing hubs shared by every server process.
+    Clients send operations against the revision they last saw; the hub
+    transforms them over the operations committed since and appends them
+    to the log. The merged text is kept in memory per process and only
+    written to the document by persist(), as a compacted snapshot.
+    """
+
+    def __init__(self, work_dir, load_document, save_document, op_retention=60.0, client_timeout=60.0):
+        self.work_dir = work_dir
+        self.load_document = load_document
+        self.save_document = save_document
+        self.op_retention = op_retention
+        self.client_timeout = client_timeout
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def _current_text(self, conn, file_path):
+        """Get (hub_id, rev, text) of a hub, replaying the log from the cached or base revision."""
+        row = conn.execute(
+            "SELECT hub_id, base_rev, base_text FROM collab_documents WHERE file_path = ?",
+            (file_path,)
+        ).fetchone()
+        if row is None:
+            return None
+        hub_id, rev, text = row
+
+        with self._lock:
+            cached = self._texts.get(file_path)
+        if cached and cached[0] == hub_id and cached[1] >= rev:
+            rev, text = cached[1], cached[2]
+
+        for op_rev, op in conn.execute(
+            "SELECT rev, op FROM collab_ops WHERE file_path = ? AND rev > ? ORDER BY rev",
+            (file_path, rev)
+        ):
+            text = apply_operation(text, json.loads(op))
+            rev = op_rev
+
+        with self._lock:
+            self._texts[file_path] = (hub_id, rev, text)
+        return hub_id, rev, text
+
+    def _touch_client(self, conn, file_path, client_id):
+        conn.execute(
+            "INSERT OR REPLACE INTO collab_clients (file_path, client_id, last_seen) VALUES (?, ?, ?)",
+            (file_path, client_id, time.time())
+        )
+
+    def _clients(self, conn, file_path):
+        rows = conn.execute(
+            "SELECT client_id FROM collab_clients WHERE file_path = ? AND last_seen >= ?",
+            (file_path, time.time() - self.client_timeout)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _ops_since(self, conn, file_path, since):
+        rows = conn.execute(
+            "SELECT rev, client_id, op FROM collab_ops WHERE file_path = ? AND rev > ? ORDER BY rev",
+            (file_path, since)
+        ).fetchall()
+        return [{'rev': rev, 'clientId': client_id, 'op': json.loads(op)} for rev, client_id, op in rows]
+
+    def is_active(self, file_path, prefix=False):
+        """Check if a document, or with prefix any document below a directory, is open in a hub."""
+        with get_coordination_db(self.work_dir) as conn:
+            if prefix:
+                key = file_path.rstrip('/') + '/'
+                row = conn.execute(
+                    "SELECT 1 FROM collab_documents WHERE substr(file_path, 1, ?) = ? LIMIT 1",
+                    (len(key), key)
+                ).fetchone()
+            else:
+                row = conn.execute("SELECT 1 FROM collab_documents WHERE file_path = ?", (file_path,)).fetchone()
+        return row is not None
+
+    def join(self, file_path, client_id):
+        """Open the hub of a document, creating it from the stored file if needed."""
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            state = self._current_text(conn, file_path)
+            if state is None:
+                text = self.load_document(file_path)
+                hub_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO collab_documents (file_path, hub_id, base_rev, base_text, persisted_rev, created_at) "
+                    "VALUES (?, ?, 0, ?, 0, ?)",
+                    (file_path, hub_id, text, time.time())
+                )
+                state = (hub_id, 0, text)
+            self._touch_client(conn, file_path, client_id)
+            conn.commit()
+            clients = self._clients(conn, file_path)
+
+        hub_id, rev, text = state
+        return {'hubId': hub_id, 'rev': rev, 'content': text, 'clients': clients}
+
+    def submit(self, file_path, hub_id, client_id, rev, op):
+        """
+        Commit an operation made against a revision.
+        Returns the new revision and every operation after the client's
+        revision, ending with the transformed one the client sent.
+        """
+        validate_operation(op)
+
+        with get_coordination_db(self.work_dir) as conn:
+            # One writer at a time so revisions stay consecutive across processes
+            conn.execute("BEGIN IMMEDIATE")
+            state = self._current_text(conn, file_path)
+            if state is None or state[0] != hub_id:
+                raise CollabError('The collaborative session was closed')
+            _, current_rev, text = state
+
+            base_rev = conn.execute(
+                "SELECT base_rev FROM collab_documents WHERE file_path = ?", (file_path,)
+            ).fetchone()[0]
+            if rev < base_rev or rev > current_rev:
+                raise CollabError('Revision is no longer available, reload the document')
+
+            concurrent = self._ops_since(conn, file_path, rev)
+            for entry in concurrent:
+                op, _ = transform(op, entry['op'])
+
+            new_text = apply_operation(text, op)
+            new_rev = current_rev + 1
+            conn.execute(
+                "INSERT INTO collab_ops (file_path, rev, client_id, op, created_at) VALUES (?, ?, ?, ?, ?)",
+                (file_path, new_rev, client_id, json.dumps(op), time.time())
+            )
+            self._touch_client(conn, file_path, client_id)
+            conn.commit()
+
+        with self._lock:
+            self._texts[file_path] = (hub_id, new_rev, new_text)
+
+        concurrent.append({'rev': new_rev, 'clientId': client_id, 'op': op})
+        return {'rev': new_rev, 'ops': concurrent}
+
+    def poll(self, file_path, hub_id, client_id, since):
+        """
+        Get the operations after a revision. Clients that fell behind the
+        compacted log get the full text instead.
+        """
+        with get_coordination_db(self.work_dir) as conn:
+            row = conn.execute(
+                "SELECT hub_id, base_rev FROM collab_documents WHERE file_path = ?",
+                (file_path,)
+            ).fetchone()
+            if row is None or row[0] != hub_id:
+                return {'closed': True}
+
+            self._touch_client(conn, file_path, client_id)
+            conn.commit()
+            clients = self._clients(conn, file_path)
+
+            if since < row[1]:
+                _, rev, text = self._current_text(conn, file_path)
+                return {'resync': True, 'rev': rev, 'content': text, 'clients': clients}
+
+            ops = self._ops_since(conn, file_path, since)
+        return {'rev': ops[-1]['rev'] if ops else since, 'ops': ops, 'clients': clients}
+
+    def leave(self, file_path, client_id):
+        """Remove a client from a hub."""
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute(
+                "DELETE FROM collab_clients WHERE file_path = ? AND client_id = ?",
+                (file_path, client_id)
+            )
+            conn.commit()
+
+    def close(self, file_path, prefix=False):
+        """Drop hubs without saving them, e.g. when their document is deleted or moved."""
+        with get_coordination_db(self.work_dir) as conn:
+            if prefix:
+                match, key = "substr(file_path, 1, ?) = ?", file_path.rstrip('/') + '/'
+                params = (len(key), key)
+            else:
+                match, params = "file_path = ?", (file_path,)
+            for table in ('collab_documents', 'collab_ops', 'collab_clients'):
+                conn.execute(f"DELETE FROM {table} WHERE {match}", params)
+            conn.commit()
+
+    def _claim_persist(self, file_path):
+        """Claim the writing of a document's snapshot. Returns False while another persist holds it."""
+        now = time.time()
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT claimed_at FROM collab_persists WHERE file_path = ?", (file_path,)).fetchone()
+            if row and row[0] > now - PERSIST_CLAIM_TIMEOUT:
+                conn.rollback()
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO collab_persists (file_path, claimed_at) VALUES (?, ?)",
+                (file_path, now)
+            )
+            conn.commit()
+        return True
+
+    def _release_persist(self, file_path):
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute("DELETE FROM collab_persists WHERE file_path = ?", (file_path,))
+            conn.commit()
+
+    def persist(self, file_path):
+        """
+        Write the merged text of a hub to its document if it changed since
+        the last snapshot, then compact the log. Operations newer than the
+        retention period are kept so slow clients can still catch up.
+        Persists of a document take turns, so an older text can never be
+        written after a newer one. Returns True if the document was written.
+        """
+        deadline = time.monotonic() + PERSIST_CLAIM_TIMEOUT
+        while not self._claim_persist(file_path):
+            if time.monotonic() > deadline:
+                raise CollabError('Another snapshot of the document is still being written')
+            time.sleep(0.05)
+        try:
+            return self._persist(file_path)
+        finally:
+            self._release_persist(file_path)
+
+    def _persist(self, file_path):
+        """Persist with the document's snapshot claimed."""
+        with get_coordination_db(self.work_dir) as conn:
+            state = self._current_text(conn, file_path)
+            if state is None:
+                return False
+            hub_id, rev, text = state
+            persisted_rev = conn.execute(
+                "SELECT persisted_rev FROM collab_documents WHERE file_path = ?", (file_path,)
+            ).fetchone()[0]
+
+        written = False
+        if rev > persisted_rev:
+            self.save_document(file_path, text)
+            written = True
+
+        cutoff = time.time() - self.op_retention
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT hub_id, base_rev, base_text FROM collab_documents WHERE file_path = ?",
+                (file_path,)
+            ).fetchone()
+            if row is None or row[0] != hub_id:
+                conn.rollback()
+                return written
+
+            # Fold the operations older than the retention period into the base text
+            base_rev, base_text = row[1], row[2]
+            for op_rev, op in conn.execute(
+                "SELECT rev, op FROM collab_ops WHERE file_path = ? AND rev > ? AND created_at < ? ORDER BY rev",
+                (file_path, base_rev, cutoff)
+            ).fetchall():
+                if op_rev != base_rev + 1:
+                    break
+                base_text = apply_operation(base_text, json.loads(op))
+                base_rev = op_rev
+
+            conn.execute(
+                "UPDATE collab_documents SET base_rev = ?, base_text = ?, persisted_rev = MAX(persisted_rev, ?) "
+                "WHERE file_path = ?",
+                (base_rev, base_text, rev, file_path)
+            )
+            conn.execute("DELETE FROM collab_ops WHERE file_path = ? AND rev <= ?", (file_path, base_rev))
+            conn.commit()
+        return written
+
+    def run_maintenance(self):
+        """
+        Snapshot every hub, expire idle clients and close hubs nobody uses
+        any more, so their documents return to normal locked editing.
+        Returns the number of documents written, or raises the first
+        snapshot error once every hub was tried.
+        """
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute(
+                "DELETE FROM collab_clients WHERE last_seen < ?",
+                (time.time() - self.client_timeout,)
+            )
+            conn.commit()
+            paths = [row[0] for row in conn.execute("SELECT file_path FROM collab_documents").fetchall()]
+
+        written = 0
+        failure = None
+        for file_path in paths:
+            try:
+                if self.persist(file_path):
+                    written += 1
+            except Exception as e:
+                # A document that can't be written, such as one over its quota,
+                # keeps its hub open without holding up the others
+                failure = failure or e
+
+            with get_coordination_db(self.work_dir) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                idle = conn.execute(
+                    "SELECT 1 FROM collab_documents d WHERE file_path = ? "
+                    "AND persisted_rev >= (SELECT IFNULL(MAX(rev), 0) FROM collab_ops WHERE file_path = d.file_path) "
+                    "AND NOT EXISTS (SELECT 1 FROM collab_clients WHERE file_path = d.file_path)",
+                    (file_path,)
+                ).fetchone()
+                if idle:
+                    conn.execute("DELETE FROM collab_documents WHERE file_path = ?", (file_path,))
+                    conn.execute("DELETE FROM collab_ops WHERE file_path = ?", (file_path,))
+                conn.commit()
+
+            if idle:
+                with self._lock:
+                    self._texts.pop(file_path, None)
+        if failure:
+            raise failure
+        return written
@@ -8,6 +8,11 @@ class Config:
     # Directory for user content
     WORK_DIR = os.path.join(BASE_DIR, 'work')
     
+    # Where documents are kept: 'filesystem' stores .md files with .json sidecars,
+    # 'sqlite' packs documents and their format options into one database
+    STORAGE_BACKEND = 'filesystem'
+    STORAGE_DB = os.path.join(WORK_DIR, 'documents.db')
+    
     # Default format options for new documents
     DEFAULT_FORMAT_OPTIONS = {
         'font': 'Arial, sans-serif',
@@ -15,5 +20,72 @@ class Config:
         'fontColor': '#333333'
     }
     
+    # Average reading speed used for the reading time estimate of documents
+    READING_WORDS_PER_MINUTE = 200
+    
+    # Number of rendered documents kept in memory for the read-only view
+    RENDER_CACHE_SIZE = 256
+    
+    # Output directory and render processes for static site publishing
+    PUBLISH_DIR = os.path.join(WORK_DIR, 'published')
+    PUBLISH_WORKERS = None  # None uses one process per CPU
+    
+    # Server address and number of worker processes (more than 1 needs os.fork)
+    SERVER_HOST = '0.0.0.0'
+    SERVER_PORT = 5000
+    SERVER_WORKERS = 1
+    SERVER_THREADS = 8  # Waitress threads per worker process
+    
+    # Concurrent requests per class in each worker process, None for no limit.
+    # Keep background + upload below SERVER_THREADS so saves always find a thread
+    ADMISSION_LIMITS = {'interactive': None, 'background': 2, 'upload': 2}
+    ADMISSION_WAIT = {'interactive': 10, 'background': 0, 'upload': 5}  # Seconds to wait for a slot before shedding
+    ADMISSION_RETRY_AFTER = 5  # Seconds shed clients wait before retrying
+    ADMISSION_RETRY_JITTER = 5  # Up to this many seconds added at random to spread retries
+    
+    # Seconds between checks for cache invalidations from other worker processes
+    INVALIDATION_POLL_INTERVAL = 1.0
+    
+    # Opt-in sampling profiler and slow request tracing, exposed under /api/admin/
+    PROFILING_ENABLED = False
+    PROFILING_SAMPLE_INTERVAL = 0.01  # Seconds between stack samples
+    SLOW_REQUEST_THRESHOLD = 1.0  # Seconds before a request is recorded as slow
+    SLOW_REQUEST_BUFFER_SIZE = 100
+    
+    # Largest number of quick-open suggestions returned per query
+    QUICK_OPEN_MAX_RESULTS = 50
+    
+    # Opt-in collaborative editing, documents are shared through an operation hub instead of locks
+    COLLABORATION_ENABLED = False
+    COLLAB_SNAPSHOT_INTERVAL = 10.0  # Seconds between writing merged edits to the documents
+    COLLAB_OP_RETENTION = 60.0  # Seconds operations are kept before they are compacted
+    COLLAB_CLIENT_TIMEOUT = 60.0  # Seconds without a poll before a client is dropped
+    
+    # Deleted files wait in the trash, then are purged in throttled batches
+    TRASH_RETENTION = 30 * 24 * 60 * 60  # Seconds before a deleted item is purged
+    TRASH_MAX_SIZE = 1024 * 1024 * 1024  # Bytes of trash kept before the oldest items are purged
+    TRASH_PURGE_INTERVAL = 5 * 60  # Seconds between purge runs
+    TRASH_PURGE_BATCH = 100  # Documents deleted per batch
+    TRASH_PURGE_PAUSE = 0.5  # Seconds between batches
+    
+    # Storage quotas in bytes, None for no limit. Soft limits only warn, hard limits refuse writes
+    QUOTA_SOFT_LIMIT = None  # Documents and attachments of the whole workspace
+    QUOTA_HARD_LIMIT = None
+    DIRECTORY_QUOTAS = {}  # e.g. {'projects/archive': {'soft': 50 * 1024 * 1024, 'hard': 100 * 1024 * 1024}}
+    
+    # Activity log of document changes, compacted by the cleanup task
+    ACTIVITY_RETENTION = 90 * 24 * 60 * 60  # Seconds entries are kept
+    ACTIVITY_MAX_ENTRIES = 100000
+    ACTIVITY_MERGE_WINDOW = 10 * 60  # Saves of a document by one user this close together are merged
+    ACTIVITY_PAGE_SIZE = 200  # Largest number of entries returned per query
+    
+    # Background verification of attachment hashes and document format options
+    SCRUB_ENABLED = True
+    SCRUB_INTERVAL = 24 * 60 * 60  # Seconds between the ends of full passes
+    SCRUB_BYTES_PER_SECOND = 2 * 1024 * 1024  # Read rate limit, so request threads keep the disk
+    SCRUB_PAUSE = 0.05  # Seconds between checked items
+    SCRUB_CHECKPOINT = 50  # Items checked between saves of the progress
+    SCRUB_REPORT_LIMIT = 500  # Largest number of findings returned per report
+    
     # Maximum file size for uploads (5MB)
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024
\ No newline at end of file
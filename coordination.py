@@ -0,0 +1,171 @@
+# coordination.py - Shared state between server processes
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from profiling import track
+
+# Name of the coordination database inside the work directory
+COORDINATION_DB = 'coordination.db'
+
+@contextmanager
+def get_coordination_db(work_dir):
+    """Context manager for coordination database connections."""
+    db_path = os.path.join(work_dir, COORDINATION_DB)
+    conn = None
+    with track('coordinationDb'):
+        try:
+            conn = sqlite3.connect(db_path, timeout=10.0)
+            yield conn
+        finally:
+            if conn:
+                conn.close()
+
+def enable_wal(conn):
+    """
+    Switch a database to write-ahead logging so readers in other processes
+    never block writers. The mode is stored in the database file.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+
+def init_coordination_db(work_dir, attachments_dir):
+    """Initialize the coordination database, importing the legacy hash map."""
+    with get_coordination_db(work_dir) as conn:
+        enable_wal(conn)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS attachment_hashes (
+            file_hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            key TEXT NOT NULL,
+            origin INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''')
+
+        # Import the hash map kept in image_hashes.json by earlier versions
+        has_hashes = conn.execute("SELECT 1 FROM attachment_hashes LIMIT 1").fetchone()
+        map_file = os.path.join(attachments_dir, 'image_hashes.json')
+        if not has_hashes and os.path.exists(map_file):
+            with open(map_file, 'r') as f:
+                hash_map = json.load(f)
+            conn.executemany(
+                "INSERT OR IGNORE INTO attachment_hashes (file_hash, filename) VALUES (?, ?)",
+                hash_map.items()
+            )
+
+        conn.commit()
+
+def get_attachment_filename(work_dir, file_hash):
+    """Get the stored filename of an attachment hash, or None."""
+    with get_coordination_db(work_dir) as conn:
+        row = conn.execute(
+            "SELECT filename FROM attachment_hashes WHERE file_hash = ?",
+            (file_hash,)
+        ).fetchone()
+    return row[0] if row else None
+
+def register_attachment(work_dir, file_hash, filename):
+    """
+    Record the filename of an attachment hash.
+    Returns (filename, created) where filename is the one already stored
+    if another upload registered the same hash first.
+    """
+    with get_coordination_db(work_dir) as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO attachment_hashes (file_hash, filename) VALUES (?, ?)",
+            (file_hash, filename)
+        )
+        conn.commit()
+        if cursor.rowcount:
+            return filename, True
+
+        row = conn.execute(
+            "SELECT filename FROM attachment_hashes WHERE file_hash = ?",
+            (file_hash,)
+        ).fetchone()
+    return row[0], False
+
+def get_all_attachments(work_dir):
+    """Get the full hash -> filename map of attachments."""
+    with get_coordination_db(work_dir) as conn:
+        return dict(conn.execute("SELECT file_hash, filename FROM attachment_hashes").fetchall())
+
+class InvalidationChannel:
+    """
+    Cross-process cache invalidation through the coordination database.
+    Each process subscribes callbacks to named channels; published keys
+    are applied locally right away and by other processes on their next poll.
+    """
+
+    def __init__(self, work_dir, poll_interval=1.0):
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+
+        with get_coordination_db(work_dir) as conn:
+            row = conn.execute("SELECT MAX(id) FROM invalidations").fetchone()
+        self._last_id = row[0] or 0
+
+    def subscribe(self, channel, callback):
+        """Register a callback taking the invalidated key of a channel."""
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def _dispatch(self, channel, key):
+        for callback in self._callbacks.get(channel, []):
+            callback(key)
+
+    def publish(self, channel, key):
+        """Invalidate a key in this process and every other one."""
+        self._dispatch(channel, key)
+
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute(
+                "INSERT INTO invalidations (channel, key, origin, created_at) VALUES (?, ?, ?, ?)",
+                (channel, key, os.getpid(), time.time())
+            )
+            conn.commit()
+
+    def poll(self, force=False):
+        """Apply invalidations published by other processes since the last poll."""
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return
+
+        # Only one thread per process needs to catch up
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_poll = now
+            with get_coordination_db(self.work_dir) as conn:
+                rows = conn.execute(
+                    "SELECT id, channel, key, origin FROM invalidations WHERE id > ? ORDER BY id",
+                    (self._last_id,)
+                ).fetchall()
+
+            pid = os.getpid()
+            for row_id, channel, key, origin in rows:
+                if origin != pid:
+                    self._dispatch(channel, key)
+                self._last_id = row_id
+        finally:
+            self._lock.release()
+
+    def prune(self, max_age=3600):
+        """Delete invalidations old enough that every process has seen them."""
+        with get_coordination_db(self.work_dir) as conn:
+            cursor = conn.execute(
+                "DELETE FROM invalidations WHERE created_at < ?",
+                (time.time() - max_age,)
+            )
+            conn.commit()
+            return cursor.rowcount
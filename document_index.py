@@ -0,0 +1,263 @@
+# document_index.py - Cached outline and statistics for documents
+import os
+import re
+import json
+import math
+import sqlite3
+from contextlib import contextmanager
+from profiling import track
+from storage import open_text
+
+# Name of the index database inside the work directory
+INDEX_DB = 'index.db'
+
+# Markdown patterns used when extracting headings and plain text
+FENCE_RE = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+ATX_HEADING_RE = re.compile(r'^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$')
+SETEXT_RE = re.compile(r'^\s{0,3}(=+|-+)\s*$')
+IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+LINK_RE = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+EMPHASIS_RE = re.compile(r'(\*\*|__|~~|\*|_|`)')
+BLOCK_PREFIX_RE = re.compile(r'^\s*(>\s*)+|^\s*([-*+]|\d+[.)])\s+(\[[ xX]\]\s+)?')
+RULE_RE = re.compile(r'^\s{0,3}([-*_]\s*){3,}$')
+TABLE_RULE_RE = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+
+def strip_inline_markdown(text):
+    """Remove inline markdown syntax, leaving the readable text."""
+    text = IMAGE_RE.sub(r'\1', text)
+    text = LINK_RE.sub(r'\1', text)
+    text = HTML_TAG_RE.sub('', text)
+    text = EMPHASIS_RE.sub('', text)
+    return text.replace('|', ' ').strip()
+
+def compute_document_stats(content, words_per_minute=200):
+    """
+    Compute the heading outline, word/character counts and reading time
+    of a markdown document, given as a string or an iterable of lines.
+    """
+    outline = []
+    words = 0
+    characters = 0
+    in_fence = None
+    previous_line = ''
+
+    def count(text):
+        # Equivalent to counting the non-empty lines joined by newlines
+        nonlocal words, characters
+        if text:
+            words += len(text.split())
+            characters += len(text) + (1 if characters else 0)
+
+    if isinstance(content, str):
+        lines = content.splitlines()
+    else:
+        lines = (part for line in content for part in line.splitlines())
+
+    for line_number, line in enumerate(lines, start=1):
+        fence = FENCE_RE.match(line)
+        if fence:
+            marker = fence.group(1)[0]
+            if in_fence is None:
+                in_fence = marker
+            elif in_fence == marker:
+                in_fence = None
+            previous_line = ''
+            continue
+
+        if in_fence is not None:
+            # Code is still read by the reader, so it counts towards the totals
+            count(line)
+            continue
+
+        heading = ATX_HEADING_RE.match(line)
+        if heading:
+            text = strip_inline_markdown(heading.group(2))
+            outline.append({'level': len(heading.group(1)), 'text': text, 'line': line_number})
+            count(text)
+            previous_line = ''
+            continue
+
+        setext = SETEXT_RE.match(line)
+        if setext and previous_line.strip():
+            # The previous line was already counted, only record the heading
+            level = 1 if setext.group(1)[0] == '=' else 2
+            outline.append({
+                'level': level,
+                'text': strip_inline_markdown(previous_line),
+                'line': line_number - 1
+            })
+            previous_line = ''
+            continue
+
+        if RULE_RE.match(line) or TABLE_RULE_RE.match(line):
+            previous_line = ''
+            continue
+
+        text = strip_inline_markdown(BLOCK_PREFIX_RE.sub('', line))
+        count(text)
+        previous_line = line
+
+    return {
+        'outline': outline,
+        'words': words,
+        'characters': characters,
+        'readingTime': math.ceil(words / words_per_minute) if words else 0
+    }
+
+@contextmanager
+def get_index_db(work_dir):
+    """Context manager for index database connections."""
+    db_path = os.path.join(work_dir, INDEX_DB)
+    conn = None
+    with track('indexDb'):
+        try:
+            conn = sqlite3.connect(db_path, timeout=10.0)
+            yield conn
+        finally:
+            if conn:
+                conn.close()
+
+def init_index_db(work_dir):
+    """Initialize the document index database."""
+    with get_index_db(work_dir) as conn:
+        # Write-ahead logging lets several server processes share the index
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS document_stats (
+            file_path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            words INTEGER NOT NULL,
+            characters INTEGER NOT NULL,
+            reading_time INTEGER NOT NULL,
+            outline TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+
+def _row_to_stats(row, include_outline=True):
+    """Convert a document_stats row into the API representation."""
+    _, mtime_ns, size, words, characters, reading_time, outline = row
+    stats = {
+        'size': size,
+        'modified': mtime_ns / 1e9,
+        'words': words,
+        'characters': characters,
+        'readingTime': reading_time
+    }
+    if include_outline:
+        stats['outline'] = json.loads(outline)
+    return stats
+
+def update_document(work_dir, storage, file_path, content=None, words_per_minute=200):
+    """
+    Recompute and store the statistics of a document.
+    Returns the stats dictionary including the outline.
+    """
+    stat = storage.stat(file_path)
+    if content is None:
+        # Stream the document so large ones aren't read into memory at once
+        with open_text(storage.open(file_path)) as lines:
+            stats = compute_document_stats(lines, words_per_minute)
+    else:
+        stats = compute_document_stats(content, words_per_minute)
+    row = (
+        file_path, stat.mtime_ns, stat.size,
+        stats['words'], stats['characters'], stats['readingTime'],
+        json.dumps(stats['outline'])
+    )
+
+    with get_index_db(work_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO document_stats "
+            "(file_path, mtime_ns, size, words, characters, reading_time, outline) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            row
+        )
+        conn.commit()
+
+    return _row_to_stats(row)
+
+def get_document_stats(work_dir, storage, file_path, content=None, words_per_minute=200, include_outline=True):
+    """
+    Get the cached statistics of a document, recomputing them if the
+    document changed in storage since they were stored.
+    """
+    stat = storage.stat(file_path)
+
+    with get_index_db(work_dir) as conn:
+        row = conn.execute(
+            "SELECT * FROM document_stats WHERE file_path = ?",
+            (file_path,)
+        ).fetchone()
+
+    if row and row[1] == stat.mtime_ns and row[2] == stat.size:
+        return _row_to_stats(row, include_outline)
+
+    stats = update_document(work_dir, storage, file_path, content, words_per_minute)
+    if not include_outline:
+        stats.pop('outline')
+    return stats
+
+def get_all_document_stats(work_dir):
+    """
+    Get all cached statistics without outlines.
+    Returns a dict of file path -> (mtime_ns, size, stats).
+    """
+    with get_index_db(work_dir) as conn:
+        rows = conn.execute(
+            "SELECT file_path, mtime_ns, size, words, characters, reading_time, '[]' FROM document_stats"
+        ).fetchall()
+
+    return {row[0]: (row[1], row[2], _row_to_stats(row, include_outline=False)) for row in rows}
+
+def get_all_titles(work_dir):
+    """Get the first heading of every indexed document as a dict of file path -> title."""
+    with get_index_db(work_dir) as conn:
+        rows = conn.execute("SELECT file_path, outline FROM document_stats").fetchall()
+
+    titles = {}
+    for file_path, outline in rows:
+        outline = json.loads(outline)
+        if outline:
+            titles[file_path] = outline[0]['text']
+    return titles
+
+def remove_document(work_dir, file_path):
+    """Remove a document from the index."""
+    with get_index_db(work_dir) as conn:
+        conn.execute("DELETE FROM document_stats WHERE file_path = ?", (file_path,))
+        conn.commit()
+
+def remove_directory(work_dir, dir_path):
+    """Remove every document below a directory from the index."""
+    prefix = dir_path.rstrip('/') + '/'
+    with get_index_db(work_dir) as conn:
+        conn.execute(
+            "DELETE FROM document_stats WHERE substr(file_path, 1, ?) = ?",
+            (len(prefix), prefix)
+        )
+        conn.commit()
+
+def rename_document(work_dir, old_path, new_path):
+    """Move the index entry of a renamed document."""
+    with get_index_db(work_dir) as conn:
+        conn.execute("DELETE FROM document_stats WHERE file_path = ?", (new_path,))
+        conn.execute(
+            "UPDATE document_stats SET file_path = ? WHERE file_path = ?",
+            (new_path, old_path)
+        )
+        conn.commit()
+
+def rename_directory(work_dir, old_path, new_path):
+    """Move the index entries of every document below a renamed directory."""
+    old_prefix = old_path.rstrip('/') + '/'
+    new_prefix = new_path.rstrip('/') + '/'
+    with get_index_db(work_dir) as conn:
+        conn.execute(
+            "UPDATE document_stats SET file_path = ? || substr(file_path, ?) "
+            "WHERE substr(file_path, 1, ?) = ?",
+            (new_prefix, len(old_prefix) + 1, len(old_prefix), old_prefix)
+        )
+        conn.commit()
@@ -0,0 +1,83 @@
+# prefork.py - Pre-fork launcher running several waitress processes on one port
+import os
+import sys
+import time
+import signal
+import socket
+from waitress import serve
+
+def create_listen_socket(host, port, backlog=1024):
+    """Create the listening socket shared by every worker process."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    return sock
+
+def _start_worker(app, sock, serve_options):
+    """Fork a worker process serving the app on the shared socket."""
+    pid = os.fork()
+    if pid == 0:
+        # Let the parent decide when workers stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            serve(app, sockets=[sock], **serve_options)
+        finally:
+            os._exit(0)
+    return pid
+
+def run(app, host, port, workers, serve_options=None, on_parent_ready=None):
+    """
+    Serve the app from several forked processes accepting on one socket.
+    Workers that exit are restarted. on_parent_ready runs in the parent
+    once the workers are started, for background tasks that must only
+    run once per server.
+    """
+    serve_options = serve_options or {}
+
+    if not hasattr(os, 'fork'):
+        print("Multiple workers need os.fork, falling back to a single process")
+        serve(app, host=host, port=port, **serve_options)
+        return
+
+    sock = create_listen_socket(host, port)
+    children = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        children.add(_start_worker(app, sock, serve_options))
+    print(f"Serving on http://{host}:{port} with {workers} worker processes")
+
+    if on_parent_ready:
+        on_parent_ready()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            # Avoid a tight restart loop if workers fail on startup
+            time.sleep(1)
+            children.add(_start_worker(app, sock, serve_options))
+
+    sock.close()
+    sys.exit(0)
@@ -0,0 +1,205 @@
+# profiling.py - Sampling profiler and slow request tracing
+import os
+import sys
+import time
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Prefix of the names waitress gives its worker threads
+WORKER_THREAD_PREFIX = 'waitress-'
+
+# Stacks beyond this many distinct entries are counted under one bucket
+MAX_DISTINCT_STACKS = 10000
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def collapse_stack(frame):
+    """Collapse a frame and its callers into a root-first 'a;b;c' string."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+def is_idle_worker(frame):
+    """Check if a waitress worker is waiting for a task rather than serving one."""
+    while frame is not None and os.path.basename(frame.f_code.co_filename) == 'threading.py':
+        frame = frame.f_back
+    return frame is not None and frame.f_code.co_name == 'handler_thread'
+
+class StackSampler:
+    """
+    Statistical profiler taking periodic stack samples of the waitress
+    worker threads. Samples are kept as collapsed stacks with counts,
+    the input format of flamegraph tools.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started_at = None
+
+    def ensure_started(self):
+        """Start sampling in this process, threads do not survive a fork."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.samples = Counter()
+            self.sample_count = 0
+            self._started_at = time.time()
+            threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def _run(self):
+        pid = self._pid
+        while self._pid == pid:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        """Record one stack sample of every busy worker thread."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+
+        with self._lock:
+            self.sample_count += 1
+            for ident, frame in frames.items():
+                if not names.get(ident, '').startswith(WORKER_THREAD_PREFIX):
+                    continue
+                if is_idle_worker(frame):
+                    continue
+                stack = collapse_stack(frame)
+                if stack not in self.samples and len(self.samples) >= MAX_DISTINCT_STACKS:
+                    stack = '[truncated]'
+                self.samples[stack] += 1
+
+    def collapsed(self):
+        """Get the samples as collapsed stack lines, most frequent first."""
+        with self._lock:
+            return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def summary(self):
+        """Describe the sampler state."""
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'interval': self.interval,
+                'startedAt': self._started_at,
+                'samples': self.sample_count,
+                'distinctStacks': len(self.samples)
+            }
+
+    def reset(self):
+        """Discard the collected samples."""
+        with self._lock:
+            self.samples = Counter()
+            self.sample_count = 0
+            self._started_at = time.time()
+
+class RequestTracer:
+    """
+    Per-request timing breakdown by category, such as auth, lock DB,
+    filesystem and JSON. Categories are timed exclusively: entering a
+    nested category pauses the outer one. Requests slower than the
+    threshold are kept in a bounded ring buffer.
+    """
+
+    def __init__(self, threshold=1.0, max_entries=100):
+        self.threshold = threshold
+        self.slow_requests = deque(maxlen=max_entries)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self, threshold, max_entries):
+        """Set the slow request threshold in seconds and the ring buffer size."""
+        with self._lock:
+            self.threshold = threshold
+            self.slow_requests = deque(self.slow_requests, maxlen=max_entries)
+
+    def start_request(self):
+        """Begin timing the request served by this thread."""
+        self._local.start = time.perf_counter()
+        self._local.timings = Counter()
+        self._local.stack = []
+
+    @contextmanager
+    def track(self, category):
+        """Attribute the time spent in the block to a category."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            # Not inside a traced request, e.g. a background thread
+            yield
+            return
+
+        now = time.perf_counter()
+        if stack:
+            outer = stack[-1]
+            self._local.timings[outer[0]] += now - outer[1]
+        entry = [category, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._local.timings[category] += now - entry[1]
+            stack.pop()
+            if stack:
+                stack[-1][1] = now
+
+    def finish_request(self, method, path, status):
+        """Stop timing the request and keep it if it was slow."""
+        start = getattr(self._local, 'start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        timings = self._local.timings
+        self._local.start = None
+        self._local.stack = None
+
+        if duration < self.threshold:
+            return
+
+        breakdown = {category: round(seconds * 1000, 3) for category, seconds in timings.items()}
+        breakdown['other'] = round(max(duration - sum(timings.values()), 0) * 1000, 3)
+        with self._lock:
+            self.slow_requests.append({
+                'timestamp': time.time(),
+                'pid': os.getpid(),
+                'thread': threading.current_thread().name,
+                'method': method,
+                'path': path,
+                'status': status,
+                'durationMs': round(duration * 1000, 3),
+                'breakdownMs': breakdown
+            })
+
+    def get_slow_requests(self):
+        """Get the recorded slow requests, newest first."""
+        with self._lock:
+            return list(reversed(self.slow_requests))
+
+# Shared tracer so modules can time their work without importing the app
+tracer = RequestTracer()
+
+def track(category):
+    """Attribute the time spent in a block to a category of the current request."""
+    return tracer.track(category)
+
+def traced_walk(top, topdown=True):
+    """os.walk attributing the directory scanning to the filesystem category."""
+    walker = os.walk(top, topdown=topdown)
+    while True:
+        with track('filesystem'):
+            entry = next(walker, None)
+        if entry is None:
+            return
+        yield entry
@@ -0,0 +1,415 @@
+# publisher.py - Static site publishing with incremental rebuilds
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote, unquote, urlsplit
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import renderer
+from document_index import compute_document_stats
+
+# Bump when the page templates or rendering change, forcing a full rebuild
+BUILD_VERSION = 3
+
+# Name of the build manifest inside the output directory
+MANIFEST_FILE = '.manifest.json'
+
+# Directory of the attachments inside the output directory
+ATTACHMENTS_DIR = '_attachments'
+
+# Exit code of the command line when another publish holds the output directory (EX_TEMPFAIL)
+BUSY_EXIT_CODE = 75
+
+# Only start a process pool when there is enough work to pay for it
+MIN_POOL_PAGES = 8
+
+LINK_TARGET_RE = re.compile(r'!?\[[^\]]*\]\(\s*<?([^)\s>]+)')
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'publish')
+STYLESHEET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'css', 'view.css')
+
+def publish_name(subtree):
+    """
+    Get the output directory name used for a published subtree. Slashes
+    become dashes, so dashes and the escape character itself are escaped
+    first, keeping a/b and a-b apart.
+    """
+    name = subtree.strip('/').replace('%', '%25').replace('-', '%2D').replace('/', '-')
+    if not name:
+        return 'workspace'
+    # A directory called workspace must not share the whole workspace's site
+    return '%77orkspace' if name == 'workspace' else name
+
+def get_template_env():
+    """Create the Jinja environment for the site templates."""
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html'])
+    )
+
+def parse_reference(url):
+    """
+    Classify a link target found in a document.
+    Returns ('document', path), ('attachment', filename) or (None, None).
+    The filename is None for attachment links that don't name an attachment.
+    """
+    if not url or renderer.is_external_url(url):
+        return None, None
+
+    path = unquote(urlsplit(url).path).lstrip('/')
+    if path.startswith('attachment/') or path.startswith('attachments/'):
+        # Attachments are flat, a name with a path in it can only point outside of them
+        name = path.split('/', 1)[1]
+        if not name or name != secure_filename(name):
+            return 'attachment', None
+        return 'attachment', name
+    if path.endswith('.md'):
+        return 'document', path
+
+    return None, None
+
+def is_inside(path, directory):
+    """Check that a path resolves to somewhere inside a directory."""
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([os.path.realpath(path), directory]) == directory
+
+def extract_references(content):
+    """Get the sorted document links and attachments referenced by a document."""
+    documents = set()
+    attachments = set()
+    for target in LINK_TARGET_RE.findall(content):
+        kind, value = parse_reference(target)
+        if kind == 'document':
+            documents.add(value)
+        elif kind == 'attachment' and value:
+            attachments.add(value)
+    return sorted(documents), sorted(attachments)
+
+def output_path_for(doc_path, subtree):
+    """Get the output path of a document, relative to the site root."""
+    rel_path = doc_path[len(subtree) + 1:] if subtree else doc_path
+    return rel_path[:-3] + '.html'
+
+def relative_url(from_page, target):
+    """Get a URL to a site-relative target from a site-relative page."""
+    depth = from_page.count('/')
+    return '../' * depth + quote(target)
+
+def breadcrumbs_for(page):
+    """Get the (name, url) directory trail leading to a page."""
+    parts = page.split('/')[:-1]
+    crumbs = [('Home', relative_url(page, 'index.html'))]
+    for i in range(len(parts)):
+        target = '/'.join(parts[:i + 1]) + '/index.html'
+        crumbs.append((parts[i], relative_url(page, target)))
+    return crumbs
+
+def render_page(job):
+    """
+    Render one document to a static HTML page.
+    Runs inside the process pool, so it only takes plain data.
+    """
+    page = job['page']
+    published = job['published']
+    subtree = job['subtree']
+
+    def resolve_link(url):
+        parts = urlsplit(url)
+        fragment = f'#{parts.fragment}' if parts.fragment else ''
+        kind, value = parse_reference(url)
+        if kind == 'document':
+            if value not in published:
+                return None
+            return relative_url(page, output_path_for(value, subtree)) + fragment
+        if kind == 'attachment':
+            return relative_url(page, f'{ATTACHMENTS_DIR}/{value}') if value else None
+        return url
+
+    html = renderer.render_markdown(job['content'], resolve_link)
+    backlinks = [
+        (title, relative_url(page, output_path_for(source, subtree)))
+        for source, title in job['backlinks']
+    ]
+
+    template = get_template_env().get_template('page.html')
+    output = template.render(
+        title=job['title'],
+        content=html,
+        backlinks=backlinks,
+        breadcrumbs=breadcrumbs_for(page),
+        stylesheet=relative_url(page, 'style.css')
+    )
+
+    full_path = os.path.join(job['output_dir'], page)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w', encoding='utf-8') as f:
+        f.write(output)
+
+    return page
+
+def render_directory_index(output_dir, directory, listing):
+    """Render the index page of a published directory."""
+    page = f'{directory}/index.html' if directory else 'index.html'
+    entries = [
+        (title, relative_url(page, target), kind)
+        for kind, target, title in listing
+    ]
+
+    template = get_template_env().get_template('index.html')
+    output = template.render(
+        title=directory.split('/')[-1] if directory else 'Home',
+        entries=entries,
+        breadcrumbs=breadcrumbs_for(page)[:-1] if directory else [],
+        stylesheet=relative_url(page, 'style.css')
+    )
+
+    full_path = os.path.join(output_dir, page)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w', encoding='utf-8') as f:
+        f.write(output)
+
+def load_manifest(output_dir):
+    """Load the build manifest of a previous publish, if any."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == BUILD_VERSION:
+                return manifest
+        except Exception as e:
+            print(f"Error loading publish manifest: {e}")
+
+    return {'version': BUILD_VERSION, 'pages': {}, 'directories': {}, 'attachments': []}
+
+def save_manifest(output_dir, manifest):
+    """Save the build manifest, replacing the previous one atomically."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def scan_documents(storage, subtree):
+    """Read every document of a subtree and describe it for the manifest."""
+    documents = {}
+
+    for entry in storage.walk(subtree):
+        if entry.type != 'file':
+            continue
+        doc_path = entry.path
+        content = storage.read(doc_path)
+
+        outline = compute_document_stats(content)['outline']
+        links, attachments = extract_references(content)
+        documents[doc_path] = {
+            'content': content,
+            'hash': renderer.content_hash(content),
+            'title': outline[0]['text'] if outline else doc_path.rsplit('/', 1)[-1][:-3],
+            'links': links,
+            'attachments': attachments
+        }
+
+    return documents
+
+def build_directory_listings(pages):
+    """Get the sorted (kind, target, title) listing of every published directory."""
+    listings = {'': []}
+    for page, title in pages.items():
+        parts = page.split('/')
+        for i in range(len(parts) - 1):
+            parent = '/'.join(parts[:i])
+            directory = '/'.join(parts[:i + 1])
+            if directory not in listings:
+                listings[directory] = []
+                listings[parent].append(['directory', f'{directory}/index.html', parts[i]])
+        listings.setdefault('/'.join(parts[:-1]), []).append(['page', page, title])
+
+    for listing in listings.values():
+        listing.sort(key=lambda entry: (entry[0] != 'directory', entry[2].lower()))
+    return listings
+
+class PublishInProgress(Exception):
+    """Raised when another process is already publishing to the output directory."""
+
+@contextlib.contextmanager
+def output_lock(output_dir):
+    """
+    Hold an exclusive lock on an output directory, shared by every process
+    on the machine. The lock file sits next to the directory, so it is
+    never part of the site.
+    """
+    lock_path = os.path.abspath(output_dir).rstrip(os.sep) + '.lock'
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a+b') as lock_file:
+        try:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            raise PublishInProgress(f"{output_dir} is being published by another process")
+        # The lock goes away with the file descriptor, also when the process dies
+        yield
+
+def publish(storage, attachments_dir, output_dir, subtree='', workers=None):
+    """
+    Publish a subtree of the documents store as a static site.
+    Only documents whose content changed, and pages whose backlinks or
+    link targets changed, are rendered again.
+    Returns a summary of the build.
+
+    The process pool uses spawn, which re-imports the main module in every
+    worker, so this must run from a process whose main module is safe to
+    import (the command line below), never from inside the server.
+    Raises PublishInProgress if the output directory is already being published.
+    """
+    with output_lock(output_dir):
+        return _publish(storage, attachments_dir, output_dir, subtree.strip('/'), workers)
+
+def _publish(storage, attachments_dir, output_dir, subtree, workers):
+    """Publish with the output directory locked."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    previous = load_manifest(output_dir)
+    documents = scan_documents(storage, subtree)
+
+    # Work out the backlinks of every published document
+    backlinks = {doc_path: [] for doc_path in documents}
+    for doc_path in sorted(documents):
+        for target in documents[doc_path]['links']:
+            if target in backlinks and target != doc_path:
+                backlinks[target].append([doc_path, documents[doc_path]['title']])
+
+    manifest = {'version': BUILD_VERSION, 'pages': {}, 'directories': {}, 'attachments': []}
+    jobs = []
+    for doc_path, document in documents.items():
+        page = output_path_for(doc_path, subtree)
+        entry = {
+            'page': page,
+            'hash': document['hash'],
+            'title': document['title'],
+            'resolved': [target for target in document['links'] if target in documents],
+            'backlinks': backlinks[doc_path]
+        }
+        manifest['pages'][doc_path] = entry
+
+        # Unchanged content, backlinks and link targets mean an unchanged page
+        if previous['pages'].get(doc_path) == entry and os.path.exists(os.path.join(output_dir, page)):
+            continue
+
+        jobs.append({
+            'page': page,
+            'content': document['content'],
+            'title': document['title'],
+            'backlinks': entry['backlinks'],
+            'published': set(entry['resolved']),
+            'subtree': subtree,
+            'output_dir': output_dir
+        })
+
+    # Render the changed pages, in parallel when there are enough of them
+    if len(jobs) >= MIN_POOL_PAGES and workers != 1:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            rendered = list(executor.map(render_page, jobs, chunksize=4))
+    else:
+        rendered = [render_page(job) for job in jobs]
+
+    # Remove pages of documents that no longer exist
+    removed = []
+    for doc_path, entry in previous['pages'].items():
+        if doc_path not in documents:
+            full_path = os.path.join(output_dir, entry['page'])
+            if is_inside(full_path, output_dir) and os.path.exists(full_path):
+                os.remove(full_path)
+            removed.append(entry['page'])
+
+    # Regenerate directory index pages whose listing changed
+    listings = build_directory_listings({
+        entry['page']: entry['title'] for entry in manifest['pages'].values()
+    })
+    published_pages = {entry['page'] for entry in manifest['pages'].values()}
+    for directory, listing in listings.items():
+        manifest['directories'][directory] = listing
+        index_page = f'{directory}/index.html' if directory else 'index.html'
+        if index_page in published_pages:
+            # An index.md document serves as the directory page
+            continue
+        if previous['directories'].get(directory) != listing or not os.path.exists(os.path.join(output_dir, index_page)):
+            render_directory_index(output_dir, directory, listing)
+    for directory in previous['directories']:
+        if directory and directory not in listings and is_inside(os.path.join(output_dir, directory), output_dir):
+            shutil.rmtree(os.path.join(output_dir, directory), ignore_errors=True)
+
+    # Copy referenced attachments, which are content addressed so existing names are current
+    referenced = sorted({name for document in documents.values() for name in document['attachments']})
+    copied = 0
+    site_attachments_dir = os.path.join(output_dir, ATTACHMENTS_DIR)
+    os.makedirs(site_attachments_dir, exist_ok=True)
+    for name in referenced:
+        source = os.path.join(attachments_dir, name)
+        target = os.path.join(site_attachments_dir, name)
+        if not is_inside(source, attachments_dir) or not is_inside(target, site_attachments_dir):
+            continue
+        if os.path.isfile(source) and not os.path.exists(target):
+            shutil.copy2(source, target)
+            copied += 1
+    for name in previous['attachments']:
+        if name not in referenced:
+            stale = os.path.join(site_attachments_dir, name)
+            if is_inside(stale, site_attachments_dir) and os.path.exists(stale):
+                os.remove(stale)
+    manifest['attachments'] = referenced
+
+    shutil.copyfile(STYLESHEET, os.path.join(output_dir, 'style.css'))
+    save_manifest(output_dir, manifest)
+
+    return {
+        'rendered': sorted(rendered),
+        'removed': sorted(removed),
+        'unchanged': len(documents) - len(rendered),
+        'attachmentsCopied': copied
+    }
+
+if __name__ == '__main__':
+    from config import Config
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description='Publish documents as a static site.')
+    parser.add_argument('subtree', nargs='?', default='', help='Directory inside documents to publish')
+    parser.add_argument('output', nargs='?', help='Output directory of the site')
+    parser.add_argument('--workers', type=int, default=Config.PUBLISH_WORKERS, help='Number of render processes')
+    parser.add_argument('--json', action='store_true', help='Print the build summary as JSON')
+    args = parser.parse_args()
+
+    try:
+        summary = publish(
+            create_storage({key: getattr(Config, key) for key in dir(Config) if key.isupper()}),
+            os.path.join(Config.WORK_DIR, 'attachments'),
+            args.output or os.path.join(Config.PUBLISH_DIR, publish_name(args.subtree)),
+            args.subtree,
+            args.workers
+        )
+    except PublishInProgress as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(BUSY_EXIT_CODE)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"Rendered {len(summary['rendered'])} pages, removed {len(summary['removed'])}, "
+              f"{summary['unchanged']} unchanged, copied {summary['attachmentsCopied']} attachments")
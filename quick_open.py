@@ -0,0 +1,148 @@
+# quick_open.py - In-memory trigram index for fuzzy file and title lookup
+import re
+import heapq
+import threading
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+def trigrams(text):
+    """
+    Get the trigrams of the words of a string. Words are padded so short
+    queries still match the start of a word.
+    """
+    grams = set()
+    for token in TOKEN_RE.findall(text.lower()):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class TrigramIndex:
+    """
+    Fuzzy lookup of documents and directories by path and first heading.
+    Each entry is indexed by the trigrams of its path and title, so a
+    query only scores entries sharing at least one trigram with it.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, path, kind, title):
+        self._remove(path)
+        name = path.rsplit('/', 1)[-1]
+        grams = trigrams(path) | trigrams(title or '')
+        self._entries[path] = {
+            'kind': kind,
+            'name': name,
+            'title': title,
+            'search': f"{path} {title or ''}".lower(),
+            'name_lower': name.lower(),
+            'grams': grams
+        }
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(path)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        for gram in entry['grams']:
+            paths = self._postings.get(gram)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[gram]
+
+    def add(self, path, kind='file', title=None):
+        """Add or update a file or directory."""
+        with self._lock:
+            self._add(path, kind, title)
+
+    def remove(self, path):
+        """Remove a file or directory entry."""
+        with self._lock:
+            self._remove(path)
+
+    def remove_prefix(self, dir_path):
+        """Remove a directory and every entry below it."""
+        prefix = dir_path.rstrip('/') + '/'
+        with self._lock:
+            for path in [path for path in self._entries if path.startswith(prefix) or path == dir_path]:
+                self._remove(path)
+
+    def replace_all(self, entries):
+        """Rebuild the index from (path, kind, title) tuples."""
+        with self._lock:
+            self._entries = {}
+            self._postings = {}
+            for path, kind, title in entries:
+                self._add(path, kind, title)
+
+    def _score(self, entry, query, query_grams):
+        shared = len(query_grams & entry['grams'])
+        score = shared / len(query_grams)
+
+        # Exact substrings beat fuzzy matches, names beat directories in the path
+        if query in entry['name_lower']:
+            score += 2.0 if entry['name_lower'].startswith(query) else 1.5
+        elif query in entry['search']:
+            score += 1.0
+
+        # Prefer shallow, short paths among equal matches
+        return score - 0.01 * entry['search'].count('/') - 0.001 * len(entry['search'])
+
+    def search(self, query, limit=20, kind=None):
+        """
+        Get the best matches for a query as dicts, best first.
+        An empty query lists the shallowest entries.
+        """
+        query = query.strip().lower()
+        with self._lock:
+            if not query:
+                candidates = (path for path, entry in self._entries.items()
+                              if kind is None or entry['kind'] == kind)
+                best = heapq.nsmallest(limit, candidates, key=lambda path: (path.count('/'), path.lower()))
+                return [self._result(path, None) for path in best]
+
+            query_grams = trigrams(query)
+            if not query_grams:
+                # Punctuation only, fall back to a plain substring scan
+                matches = [(self._score(entry, query, {None}), path)
+                           for path, entry in self._entries.items()
+                           if query in entry['search'] and (kind is None or entry['kind'] == kind)]
+                return [self._result(path, score) for score, path in heapq.nlargest(limit, matches)]
+
+            # Fuzzy matches must share at least half of the query's trigrams.
+            # Such an entry appears in at least one of the rarest
+            # len - minimum + 1 posting lists, so only those are scanned.
+            minimum = (len(query_grams) + 1) // 2
+            postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+            candidates = set()
+            for paths in postings[:len(query_grams) - minimum + 1]:
+                candidates.update(paths)
+
+            scored = []
+            for path in candidates:
+                entry = self._entries[path]
+                if kind is not None and entry['kind'] != kind:
+                    continue
+                if len(query_grams & entry['grams']) < minimum:
+                    continue
+                scored.append((self._score(entry, query, query_grams), path))
+
+            best = heapq.nlargest(limit, scored)
+            return [self._result(path, score) for score, path in best]
+
+    def _result(self, path, score):
+        entry = self._entries[path]
+        return {
+            'type': entry['kind'],
+            'path': path,
+            'name': entry['name'],
+            'title': entry['title'],
+            'score': round(score, 4) if score is not None else None
+        }
@@ -0,0 +1,186 @@
+# renderer.py - Server-side markdown rendering with a content hash cache
+import re
+from html import unescape
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit
+
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+# Markdown extensions matching what the editor supports
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists', 'toc']
+
+# Link schemes kept in rendered documents, others such as javascript: are dropped
+SAFE_URL_SCHEMES = ('http', 'https', 'mailto')
+
+URL_SCHEME_RE = re.compile(r'^([a-z][a-z0-9+.-]*):', re.IGNORECASE)
+
+# Attributes kept on rendered elements, attr_list could otherwise add event
+# handlers, or styles laying fake content over the unauthenticated /view pages
+SAFE_ATTRIBUTES = {
+    'id', 'class', 'title', 'alt', 'href', 'src', 'width', 'height', 'align',
+    'colspan', 'rowspan', 'start', 'rel', 'rev', 'lang', 'dir'
+}
+
+def content_hash(content):
+    """Calculate the hash used to key rendered output."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+def url_scheme(url):
+    """Get the lowercased scheme of a URL the way a browser reads it, '' if it has none."""
+    # Browsers decode entities in attributes and skip whitespace and control characters
+    match = URL_SCHEME_RE.match(re.sub(r'[\x00-\x20]', '', unescape(url)))
+    return match.group(1).lower() if match else ''
+
+def is_safe_url(url):
+    """Check if a URL may be linked to from a rendered document."""
+    scheme = url_scheme(url)
+    return not scheme or scheme in SAFE_URL_SCHEMES
+
+def is_external_url(url):
+    """Check if a URL points outside of the workspace."""
+    return bool(url_scheme(url) or urlsplit(url).netloc) or url.startswith('#')
+
+def resolve_view_link(url):
+    """
+    Resolve document and attachment references for the read-only view.
+    Document links are relative to the documents directory, so they are
+    rewritten to absolute /view/ URLs.
+    """
+    if not url or is_external_url(url):
+        return url
+
+    parts = urlsplit(url)
+    path = parts.path.lstrip('/')
+    fragment = f'#{parts.fragment}' if parts.fragment else ''
+
+    if path.startswith('attachment/') or path.startswith('attachments/'):
+        return '/attachment/' + path.split('/', 1)[1] + fragment
+    if path.endswith('.md'):
+        return '/view/' + quote(path) + fragment
+
+    return url
+
+class LinkResolverProcessor(Treeprocessor):
+    """
+    Rewrite link and image targets with a resolver function, dropping
+    unsafe targets and attributes outside SAFE_ATTRIBUTES.
+    """
+
+    def __init__(self, md, resolve_link):
+        super().__init__(md)
+        self.resolve_link = resolve_link
+
+    def run(self, root):
+        for element in root.iter():
+            for attribute in [name for name in element.attrib if name not in SAFE_ATTRIBUTES]:
+                del element.attrib[attribute]
+            for attribute in ('href', 'src'):
+                if element.get(attribute) is not None:
+                    self._resolve(element, attribute)
+
+    def _resolve(self, element, attribute):
+        url = element.get(attribute)
+        if not is_safe_url(url):
+            del element.attrib[attribute]
+            return
+        if element.tag not in ('a', 'img') or not self.resolve_link:
+            return
+        # A resolver returns None for targets that cannot be linked to
+        url = self.resolve_link(url)
+        if url is None:
+            del element.attrib[attribute]
+        else:
+            element.set(attribute, url)
+
+class LinkResolverExtension(Extension):
+    """Markdown extension registering the link resolver."""
+
+    def __init__(self, resolve_link):
+        super().__init__()
+        self.resolve_link = resolve_link
+
+    def extendMarkdown(self, md):
+        # After unescape, so backslash escapes can't hide a scheme from the check
+        md.treeprocessors.register(LinkResolverProcessor(md, self.resolve_link), 'link_resolver', -10)
+
+class EscapeHtmlExtension(Extension):
+    """
+    Markdown extension showing raw HTML as text instead of passing it
+    through. Rendered pages are served from the app's origin without a
+    login, so documents must not be able to add scripts to them.
+    """
+
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+
+def render_markdown(content, resolve_link=resolve_view_link):
+    """Render markdown content to safe HTML, resolving internal links."""
+    # Registered last so they apply to what the other extensions set up
+    extensions = list(MARKDOWN_EXTENSIONS) + [LinkResolverExtension(resolve_link), EscapeHtmlExtension()]
+    return markdown.markdown(content, extensions=extensions)
+
+class RenderCache:
+    """
+    Bounded cache of rendered HTML keyed by content hash.
+    Also remembers which hash each document path rendered last,
+    so saves, renames and deletes can invalidate their entry.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path, digest):
+        """Get the cached HTML for a content hash, or None."""
+        with self._lock:
+            html = self._entries.get(digest)
+            if html is not None:
+                self._entries.move_to_end(digest)
+                self._paths[file_path] = digest
+            return html
+
+    def put(self, file_path, digest, html):
+        """Store rendered HTML for a document."""
+        with self._lock:
+            self._entries[digest] = html
+            self._entries.move_to_end(digest)
+            self._paths[file_path] = digest
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_path):
+        """Drop the cached output of a document."""
+        with self._lock:
+            digest = self._paths.pop(file_path, None)
+            if digest is not None and digest not in self._paths.values():
+                self._entries.pop(digest, None)
+
+    def invalidate_prefix(self, dir_path):
+        """Drop the cached output of every document below a directory."""
+        prefix = dir_path.rstrip('/') + '/'
+        with self._lock:
+            paths = [path for path in self._paths if path.startswith(prefix)]
+        for path in paths:
+            self.invalidate(path)
+
+    def render(self, file_path, content, digest=None, resolve_link=resolve_view_link):
+        """
+        Render a document through the cache.
+        Returns (html, digest) where digest is the content hash.
+        """
+        if digest is None:
+            digest = content_hash(content)
+        html = self.get(file_path, digest)
+        if html is None:
+            html = render_markdown(content, resolve_link)
+            self.put(file_path, digest, html)
+        return html, digest
@@ -0,0 +1,237 @@
+# scrub.py - Throttled background verification of attachments and documents
+import os
+import re
+import json
+import time
+import codecs
+import hashlib
+from coordination import get_coordination_db
+from storage import CHUNK_SIZE
+from sync import list_attachments
+
+# The parts of a pass, in order. Progress is saved as a phase and the last name checked in it
+PHASES = ('attachments', 'documents', 'options')
+
+# Attachments named by the MD5 of their content, the names uploads get
+HASH_NAME = re.compile(r'^[0-9a-f]{32}$')
+
+def init_scrub_db(work_dir):
+    """Initialize the scrubber progress and findings tables in the coordination database."""
+    with get_coordination_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS scrub_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS scrub_findings (
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            problem TEXT NOT NULL,
+            detail TEXT,
+            found_at REAL NOT NULL,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (kind, path)
+        )
+        ''')
+        conn.commit()
+
+class Throttle:
+    """
+    Token bucket keeping reads under a number of bytes per second. Credit
+    saved while idle, such as during pauses between items, is capped at
+    burst bytes, so a large file after a quiet spell is still read at the
+    rate limit.
+    """
+
+    def __init__(self, bytes_per_second, burst=CHUNK_SIZE):
+        self.bytes_per_second = bytes_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, size):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.bytes_per_second, self.burst)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens < 0:
+            # Wait for the debt to refill, the tokens are credited on the next call
+            time.sleep(-self.tokens / self.bytes_per_second)
+
+class Scrubber:
+    """
+    Re-verifies stored data in passes: attachment contents against the
+    hash in their names, documents as UTF-8 with parsable format options,
+    and sidecars without a document. Progress is saved in the coordination
+    database, so a pass interrupted by a restart resumes where it stopped.
+    """
+
+    def __init__(self, work_dir, storage, attachments_dir):
+        self.work_dir = work_dir
+        self.storage = storage
+        self.attachments_dir = attachments_dir
+
+    def _load_state(self, conn):
+        return dict(conn.execute("SELECT key, value FROM scrub_state").fetchall())
+
+    def _save_state(self, **values):
+        with get_coordination_db(self.work_dir) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scrub_state (key, value) VALUES (?, ?)",
+                [(key, None if value is None else str(value)) for key, value in values.items()]
+            )
+            conn.commit()
+
+    def get_state(self):
+        """Get the progress of the current pass and when the last one finished."""
+        with get_coordination_db(self.work_dir) as conn:
+            state = self._load_state(conn)
+        return {
+            'phase': state.get('phase'),
+            'cursor': state.get('cursor'),
+            'checked': int(state.get('checked') or 0),
+            'passStartedAt': float(state['started_at']) if state.get('started_at') else None,
+            'lastCompletedAt': float(state['completed_at']) if state.get('completed_at') else None
+        }
+
+    def seconds_until_due(self, interval):
+        """Get the seconds until the next pass should start, 0 to resume an unfinished one."""
+        state = self.get_state()
+        if state['phase'] or state['lastCompletedAt'] is None:
+            return 0
+        return max(state['lastCompletedAt'] + interval - time.time(), 0)
+
+    def check_attachment(self, name, throttle):
+        """Get (problem, detail) for an attachment, or None if it's intact."""
+        stem = os.path.splitext(name)[0]
+        if not HASH_NAME.match(stem):
+            return None
+
+        digest = hashlib.md5()
+        with open(os.path.join(self.attachments_dir, name), 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                throttle.consume(len(chunk))
+        if digest.hexdigest() != stem:
+            return 'hash-mismatch', f"Content hashes to {digest.hexdigest()}"
+        return None
+
+    def check_document(self, path, throttle):
+        """Get (problem, detail) for a document, or None if it's intact."""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        offset = 0
+        try:
+            with self.storage.open(path) as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    decoder.decode(chunk)
+                    throttle.consume(len(chunk))
+                    offset += len(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            return 'invalid-utf8', f"Invalid UTF-8 at byte {offset + e.start}: {e.reason}"
+
+        # Documents without format options are normal, they use the defaults
+        try:
+            options = self.storage.read_options(path)
+        except (OSError, UnicodeDecodeError) as e:
+            return 'unreadable-options', f"Format options can't be read: {e}"
+        if options is None:
+            return None
+        try:
+            json.loads(options)
+        except ValueError as e:
+            return 'invalid-options', f"Format options aren't valid JSON: {e}"
+        return None
+
+    def _items(self, phase):
+        if phase == 'attachments':
+            names = list_attachments(self.attachments_dir)
+        elif phase == 'documents':
+            names = [entry.path for entry in self.storage.walk() if entry.type == 'file']
+        else:
+            names = list(self.storage.orphaned_options())
+        return sorted(names)
+
+    def _check(self, phase, item, throttle):
+        if phase == 'attachments':
+            return self.check_attachment(item, throttle)
+        if phase == 'documents':
+            return self.check_document(item, throttle)
+        return 'orphaned', 'Format options without a document'
+
+    def _record(self, phase, item, finding, now):
+        with get_coordination_db(self.work_dir) as conn:
+            if finding is None:
+                conn.execute("DELETE FROM scrub_findings WHERE kind = ? AND path = ?", (phase, item))
+            else:
+                problem, detail = finding
+                # Keep when a problem was first found while it persists
+                conn.execute(
+                    "INSERT INTO scrub_findings (kind, path, problem, detail, found_at, checked_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(kind, path) DO UPDATE SET "
+                    "problem = excluded.problem, detail = excluded.detail, checked_at = excluded.checked_at, "
+                    "found_at = CASE WHEN problem = excluded.problem THEN found_at ELSE excluded.found_at END",
+                    (phase, item, problem, detail, now, now)
+                )
+            conn.commit()
+
+    def run_pass(self, bytes_per_second, pause=0.05, checkpoint=50):
+        """
+        Run a full pass, or finish the interrupted one, reading at most
+        bytes_per_second and pausing between items. Progress is saved every
+        checkpoint items. Returns the number of findings.
+        """
+        state = self.get_state()
+        if state['phase'] in PHASES:
+            phase, cursor = state['phase'], state['cursor'] or ''
+            checked, started = state['checked'], state['passStartedAt']
+        else:
+            phase, cursor, checked, started = PHASES[0], '', 0, time.time()
+            self._save_state(phase=phase, cursor=cursor, checked=0, started_at=started)
+
+        throttle = Throttle(bytes_per_second)
+        for phase in PHASES[PHASES.index(phase):]:
+            for item in self._items(phase):
+                if item <= cursor:
+                    continue
+                try:
+                    finding = self._check(phase, item, throttle)
+                except FileNotFoundError:
+                    finding = None  # Removed since the listing
+                except OSError as e:
+                    finding = ('unreadable', str(e))
+                self._record(phase, item, finding, time.time())
+
+                checked += 1
+                if checked % checkpoint == 0:
+                    self._save_state(phase=phase, cursor=item, checked=checked)
+                time.sleep(pause)
+            cursor = ''
+
+        # Findings not confirmed by this pass are about data that is gone
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute("DELETE FROM scrub_findings WHERE checked_at < ?", (started,))
+            conn.commit()
+            count = conn.execute("SELECT COUNT(*) FROM scrub_findings").fetchone()[0]
+        self._save_state(phase=None, cursor=None, checked=checked, completed_at=time.time())
+        return count
+
+    def get_findings(self, limit=500):
+        """Get the problems found, newest first."""
+        with get_coordination_db(self.work_dir) as conn:
+            rows = conn.execute(
+                "SELECT kind, path, problem, detail, found_at, checked_at FROM scrub_findings "
+                "ORDER BY found_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM scrub_findings").fetchone()[0]
+        return [{
+            'kind': kind,
+            'path': path,
+            'problem': problem,
+            'detail': detail,
+            'foundAt': found_at,
+            'checkedAt': checked_at
+        } for kind, path, problem, detail, found_at, checked_at in rows], total
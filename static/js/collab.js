@@ -0,0 +1,356 @@
+/**
+ * Collaborative editing through the server-side operation hub
+ *
+ * Operations are arrays of components: a positive number retains
+ * characters, a negative number deletes them and a string inserts it.
+ * Lengths count code points so they agree with the server.
+ */
+const TextOperation = {
+    isRetain(c) { return typeof c === 'number' && c > 0; },
+    isDelete(c) { return typeof c === 'number' && c < 0; },
+    isInsert(c) { return typeof c === 'string'; },
+    length(str) { return Array.from(str).length; },
+
+    push(op, c) {
+        if (c === 0 || c === '') return;
+        const last = op[op.length - 1];
+        if (op.length && ((this.isRetain(last) && this.isRetain(c)) ||
+                          (this.isDelete(last) && this.isDelete(c)) ||
+                          (this.isInsert(last) && this.isInsert(c)))) {
+            op[op.length - 1] = last + c;
+        } else {
+            op.push(c);
+        }
+    },
+
+    apply(text, op) {
+        const chars = Array.from(text);
+        const parts = [];
+        let index = 0;
+        op.forEach(c => {
+            if (this.isRetain(c)) {
+                parts.push(chars.slice(index, index + c).join(''));
+                index += c;
+            } else if (this.isDelete(c)) {
+                index -= c;
+            } else {
+                parts.push(c);
+            }
+        });
+        if (index !== chars.length) {
+            throw new Error('Operation does not match the document length');
+        }
+        return parts.join('');
+    },
+
+    // Same algorithm as collab.transform on the server, inserts of a go first
+    transform(a, b) {
+        const aPrime = [], bPrime = [];
+        let i = 0, j = 0;
+        let op1 = a[0], op2 = b[0];
+
+        while (op1 !== undefined || op2 !== undefined) {
+            if (op1 !== undefined && this.isInsert(op1)) {
+                this.push(aPrime, op1);
+                this.push(bPrime, this.length(op1));
+                op1 = a[++i];
+                continue;
+            }
+            if (op2 !== undefined && this.isInsert(op2)) {
+                this.push(aPrime, this.length(op2));
+                this.push(bPrime, op2);
+                op2 = b[++j];
+                continue;
+            }
+            if (op1 === undefined || op2 === undefined) {
+                throw new Error('Concurrent operations apply to different document lengths');
+            }
+
+            let length;
+            if (this.isRetain(op1) && this.isRetain(op2)) {
+                length = Math.min(op1, op2);
+                this.push(aPrime, length);
+                this.push(bPrime, length);
+            } else if (this.isDelete(op1) && this.isDelete(op2)) {
+                length = Math.min(-op1, -op2);
+            } else if (this.isDelete(op1)) {
+                length = Math.min(-op1, op2);
+                this.push(aPrime, -length);
+            } else {
+                length = Math.min(op1, -op2);
+                this.push(bPrime, -length);
+            }
+
+            op1 = op1 > 0 ? op1 - length : op1 + length;
+            op2 = op2 > 0 ? op2 - length : op2 + length;
+            if (op1 === 0) op1 = a[++i];
+            if (op2 === 0) op2 = b[++j];
+        }
+        return [aPrime, bPrime];
+    },
+
+    // Single edit turning one text into another, found from the common prefix and suffix
+    diff(before, after) {
+        const a = Array.from(before);
+        const b = Array.from(after);
+        let start = 0;
+        while (start < a.length && start < b.length && a[start] === b[start]) start++;
+        let end = 0;
+        while (end < a.length - start && end < b.length - start &&
+               a[a.length - 1 - end] === b[b.length - 1 - end]) end++;
+
+        const op = [];
+        this.push(op, start);
+        this.push(op, -(a.length - start - end));
+        this.push(op, b.slice(start, b.length - end).join(''));
+        this.push(op, end);
+        return op;
+    },
+
+    // Move a character index past the changes of an operation
+    transformIndex(index, op) {
+        let position = 0;
+        let result = index;
+        for (const c of op) {
+            if (position > index) break;
+            if (this.isRetain(c)) {
+                position += c;
+            } else if (this.isInsert(c)) {
+                result += this.length(c);
+            } else {
+                result -= Math.min(-c, index - position);
+                position -= c;
+            }
+        }
+        return Math.max(result, 0);
+    }
+};
+
+class CollabSession {
+    constructor(path, onClosed) {
+        this.path = path;
+        this.onClosed = onClosed;
+        this.clientId = `${fileManager.sessionId}-${Math.random().toString(36).substring(2, 10)}`;
+        this.hubId = null;
+        this.rev = 0;
+        this.shadow = '';       // Server text at rev with the pending operation applied
+        this.pending = null;    // Operation sent but not yet seen in the log
+        this.clients = [];
+        this.sending = false;
+        this.unconfirmed = false;
+        this.polling = false;
+        this.stopped = false;
+    }
+
+    start() {
+        return this._post('/api/collab/join', { session_id: fileManager.sessionId })
+            .then(data => {
+                this._reset(data);
+                // Changes are picked up by diffing, so short flush intervals batch keystrokes
+                this.flushInterval = setInterval(() => this.flush(), 300);
+                this.pollInterval = setInterval(() => this.poll(), 1000);
+                return data;
+            });
+    }
+
+    stop() {
+        this.stopped = true;
+        clearInterval(this.flushInterval);
+        clearInterval(this.pollInterval);
+        this.flush();
+        return this._post('/api/collab/leave', {}).catch(error => {
+            console.error('Error leaving collaborative session:', error);
+        });
+    }
+
+    // Ask the server to write the merged text now
+    snapshot() {
+        this.flush();
+        return this._post('/api/collab/snapshot', {});
+    }
+
+    _post(url, body) {
+        return fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(Object.assign({ path: this.path, clientId: this.clientId, hubId: this.hubId }, body))
+        }).then(response => response.json().then(data => {
+            if (!response.ok) {
+                const error = new Error(data.error || `Request failed with status ${response.status}`);
+                error.status = response.status;
+                throw error;
+            }
+            return data;
+        }));
+    }
+
+    _getText() {
+        return window.editor.getContent();
+    }
+
+    _setText(text, op) {
+        const tuiEditor = window.editor.editor;
+        let selection = null;
+        try {
+            if (tuiEditor.isMarkdownMode()) {
+                selection = tuiEditor.getSelection();
+            }
+        } catch (e) {
+            selection = null;
+        }
+        const before = this._getText();
+
+        tuiEditor.setMarkdown(text, false);
+        window.editor._lastSavedContent = text;
+
+        // Keep the local cursor in place when other people's edits land before it
+        if (selection && op) {
+            try {
+                const [start, end] = selection.map(pos => {
+                    const offset = this._offsetOf(before, pos);
+                    return this._positionOf(text, TextOperation.transformIndex(offset, op));
+                });
+                tuiEditor.setSelection(start, end);
+            } catch (e) {
+                console.warn('Could not restore the cursor position:', e);
+            }
+        }
+    }
+
+    // Markdown mode positions are [line, column] pairs counted from 1
+    _offsetOf(text, pos) {
+        const lines = text.split('\n').slice(0, pos[0] - 1);
+        const prefix = lines.map(line => line + '\n').join('');
+        const column = text.split('\n')[pos[0] - 1] || '';
+        return TextOperation.length(prefix) + TextOperation.length(column.substring(0, pos[1] - 1));
+    }
+
+    _positionOf(text, offset) {
+        const prefix = Array.from(text).slice(0, offset).join('');
+        const lines = prefix.split('\n');
+        return [lines.length, lines[lines.length - 1].length + 1];
+    }
+
+    _reset(data) {
+        if (this._getText() !== this.shadow) {
+            console.warn('Discarding unsent edits to resynchronize with the server');
+        }
+        this.hubId = data.hubId || this.hubId;
+        this.rev = data.rev;
+        this.shadow = data.content;
+        this.pending = null;
+        this.unconfirmed = false;
+        this.clients = data.clients || [];
+        this._setText(data.content, null);
+        this._updateIndicator();
+    }
+
+    flush() {
+        if (this.sending || this.pending || !this.hubId) return;
+
+        const text = this._getText();
+        if (text === this.shadow) return;
+
+        this.pending = TextOperation.diff(this.shadow, text);
+        this.shadow = text;
+        window.editor._lastSavedContent = text;
+        this._send();
+    }
+
+    _send() {
+        this.sending = true;
+        this._post('/api/collab/ops', { rev: this.rev, op: this.pending })
+            .then(data => this._receive(data.ops))
+            .catch(error => {
+                console.error('Error sending collaborative edit:', error);
+                if (error.status === 409) {
+                    this.resync();
+                } else {
+                    // The next poll shows whether the server committed it before failing
+                    this.unconfirmed = true;
+                }
+            })
+            .finally(() => { this.sending = false; });
+    }
+
+    poll() {
+        if (this.polling || !this.hubId || this.stopped) return;
+        this.polling = true;
+
+        const params = new URLSearchParams({
+            path: this.path, clientId: this.clientId, hubId: this.hubId, since: this.rev
+        });
+        fetch(`/api/collab/ops?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.closed) {
+                    this.stopped = true;
+                    clearInterval(this.flushInterval);
+                    clearInterval(this.pollInterval);
+                    if (this.onClosed) this.onClosed();
+                } else if (data.resync) {
+                    this._reset(data);
+                } else if (data.ops) {
+                    this._receive(data.ops);
+                    this.clients = data.clients || this.clients;
+                    this._updateIndicator();
+
+                    // Our operation isn't in the log, so resend it rebased on the latest revision
+                    if (this.unconfirmed && this.pending && !this.sending) {
+                        this.unconfirmed = false;
+                        this._send();
+                    }
+                }
+            })
+            .catch(error => console.error('Error polling collaborative edits:', error))
+            .finally(() => { this.polling = false; });
+    }
+
+    resync() {
+        return this._post('/api/collab/join', { session_id: fileManager.sessionId })
+            .then(data => this._reset(data))
+            .catch(error => console.error('Error rejoining collaborative session:', error));
+    }
+
+    _receive(ops) {
+        for (const entry of ops) {
+            if (entry.rev <= this.rev) continue;
+            if (entry.rev !== this.rev + 1) {
+                // A gap means this copy can't be transformed any more
+                this.resync();
+                return;
+            }
+
+            if (entry.clientId === this.clientId && this.pending) {
+                // Our own operation, already part of the shadow
+                this.pending = null;
+                this.unconfirmed = false;
+                this.rev = entry.rev;
+                continue;
+            }
+
+            let remote = entry.op;
+            if (this.pending) {
+                [this.pending, remote] = TextOperation.transform(this.pending, remote);
+            }
+
+            // Rebase the edits typed since the last flush over the remote change
+            const current = this._getText();
+            const local = TextOperation.diff(this.shadow, current);
+            const [, remoteOnCurrent] = TextOperation.transform(local, remote);
+
+            this.shadow = TextOperation.apply(this.shadow, remote);
+            this._setText(TextOperation.apply(current, remoteOnCurrent), remoteOnCurrent);
+            this.rev = entry.rev;
+        }
+    }
+
+    _updateIndicator() {
+        const indicator = document.getElementById('lock-indicator');
+        if (!indicator) return;
+        indicator.className = 'editing';
+        const others = Math.max(this.clients.length - 1, 0);
+        indicator.textContent = `Collaborating${others ? ` with ${others} other${others === 1 ? '' : 's'}` : ''}`;
+        indicator.style.display = 'block';
+    }
+}
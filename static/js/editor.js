@@ -14,7 +14,6 @@
         }
 
         // Store a reference to available documents for link insertion
-        this.availableDocuments = [];
     
          // Load the document list when the editor is initialized
         this.loadAvailableDocuments();
@@ -24,6 +23,10 @@
 
         // Init footer
         this.footer = null;
+
+        // Server-computed outline and statistics for the loaded document
+        this.documentStats = null;
+        this._documentStatsContent = null;
     }
     
     initialize() {
@@ -635,16 +638,8 @@
         });
     }
 
-    // Add this method to load available documents
+    // Called after file changes, documents for links are looked up on demand
     loadAvailableDocuments() {
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                // Filter for markdown files only
-                this.availableDocuments = files.filter(file => file.type === 'file');
-                console.log("Available documents loaded:", this.availableDocuments.length);
-            })
-            .catch(error => console.error('Error loading documents:', error));
         fileManager.updateFileTreeLockStatus();
     }
     
@@ -685,11 +680,9 @@
                         <input type="radio" id="document-link" name="link-type" value="document">
                         <label for="document-link">Reference Document</label>
                     </div>
+                    <input type="text" id="document-filter" placeholder="Search documents by name or title" autocomplete="off" style="width: 100%; padding: 8px; box-sizing: border-box; margin-top: 5px;" disabled>
                     <select id="document-select" style="width: 100%; padding: 8px; box-sizing: border-box; margin-top: 5px;" disabled>
                         <option value="">-- Select a document --</option>
-                        ${this.availableDocuments.map(doc => 
-                            `<option value="${doc.path}">${doc.path}</option>`
-                        ).join('')}
                     </select>
                 </div>
                 
@@ -714,6 +707,7 @@
         const externalRadio = document.getElementById('external-link');
         const documentRadio = document.getElementById('document-link');
         const linkUrlField = document.getElementById('link-url');
+        const documentFilter = document.getElementById('document-filter');
         const documentSelect = document.getElementById('document-select');
         const cancelBtn = document.getElementById('cancel-link-btn');
         const insertBtn = document.getElementById('insert-link-btn');
@@ -739,10 +733,13 @@
         const handleRadioChange = () => {
             if (externalRadio.checked) {
                 linkUrlField.disabled = false;
+                documentFilter.disabled = true;
                 documentSelect.disabled = true;
             } else {
                 linkUrlField.disabled = true;
+                documentFilter.disabled = false;
                 documentSelect.disabled = false;
+                documentFilter.focus();
             }
         };
         
@@ -805,18 +802,20 @@
             }
         });
         
-        // Update document list if needed
-        if (!this.availableDocuments || this.availableDocuments.length === 0) {
-            this.refreshAvailableDocuments().then(() => {
-                // Update select options after documents are loaded
-                documentSelect.innerHTML = `
-                    <option value="">-- Select a document --</option>
-                    ${this.availableDocuments.map(doc => 
-                        `<option value="${doc.path}">${doc.path}</option>`
-                    ).join('')}
-                `;
-            });
-        }
+        documentFilter.addEventListener('keydown', (e) => {
+            if (e.key === 'Enter') {
+                insertLink();
+            }
+            else if (e.key === 'Escape') {
+                e.preventDefault();
+                closeModal();
+            }
+        });
+        
+        // Fill the document list from the server-side quick-open index
+        fileManager.bindSuggestionFilter(documentFilter, documentSelect, 'file', {
+            firstOption: ['', '-- Select a document --']
+        })().catch(error => console.error('Error loading documents:', error));
         
         // For debugging - log that all elements are properly found
         console.log("Modal elements:", {
@@ -989,20 +988,6 @@
         }
     }
 
-    refreshAvailableDocuments() {
-        return fetch('/api/files')
-        .then(response => response.json())
-        .then(files => {
-            // Filter for markdown files only
-            this.availableDocuments = files.filter(file => file.type === 'file');
-            console.log("Available documents loaded:", this.availableDocuments.length);
-            return this.availableDocuments;
-        })
-        .catch(error => {
-            console.error('Error loading documents:', error);
-            return [];
-        });
-    }
     
     createNewDocument() {
         // Confirm with user if there are unsaved changes
@@ -1016,6 +1001,7 @@
         if (this.editor) {
             // Reset _lastSavedContent for change detection
             this._lastSavedContent = '';
+            this.setDocumentStats(null, null);
 
             this.setContent('');
         }
@@ -1039,6 +1025,24 @@
         console.log("Created new unsaved document");
     }
 
+    /**
+     * Store the outline and statistics the server computed for the given content
+     */
+    setDocumentStats(stats, content) {
+        this.documentStats = stats || null;
+        this._documentStatsContent = stats ? content : null;
+    }
+
+    /**
+     * Get the server statistics if they still describe the current content
+     */
+    getCurrentDocumentStats() {
+        if (!this.documentStats || this._documentStatsContent === null) {
+            return null;
+        }
+        return this.getContent() === this._documentStatsContent ? this.documentStats : null;
+    }
+
     hasUnsavedChanges() {
         // If _lastSavedContent isn't initialized yet
         if (this._lastSavedContent === undefined) {
@@ -1218,6 +1222,17 @@ class EditorFooter {
         let wordCount = 0;
         const toastEditor = this.editor.editor;
         
+        // Use the server statistics while the document is unchanged since it was loaded or saved
+        const serverStats = this.editor.getCurrentDocumentStats();
+        if (serverStats) {
+            this.stats.wordCount = serverStats.words;
+            const wordCountEl = document.getElementById('word-count');
+            if (wordCountEl) {
+                wordCountEl.innerText = `Words: ${serverStats.words}`;
+            }
+            return;
+        }
+        
         try {
             if (toastEditor.isWysiwygMode()) {
                 // In WYSIWYG mode, we can directly access the rendered content
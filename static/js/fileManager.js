@@ -16,6 +16,9 @@ class FileManager {
         this.sessionId = this.generateSessionId();
         console.log("Session ID:", this.sessionId);
         
+        // Background polls pause until this time after the server sheds one
+        this.backgroundRetryAt = 0;
+        
         // Track lock status
         this.lockStatus = {
             isLocked: false,
@@ -31,6 +34,7 @@ class FileManager {
         
         // Explicitly load the file tree on initialization
         this.loadFileTree();
+        this.loadRecentFiles();
     
         // Set up periodic auto-save (every 30 seconds)
         this.autoSaveInterval = setInterval(() => {
@@ -62,6 +66,9 @@ class FileManager {
 
         // Handle beforeunload event to release lock when leaving
         window.addEventListener('beforeunload', () => {
+            if (this.collab) {
+                this.stopCollaboration();
+            }
             if (this.currentFilePath && this.lockStatus.hasLock) {
                 // Use synchronous AJAX to ensure it completes before page unload
                 this.releaseLockSync(this.currentFilePath);
@@ -398,6 +405,80 @@ class FileManager {
         };
     }
     
+    // The last changed documents come from the activity log, without listing the whole tree
+    loadRecentFiles(limit = 5) {
+        const container = document.getElementById('recent-files');
+        if (!container) {
+            return;
+        }
+        
+        fetch(`/api/recent?limit=${limit}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`API request failed with status ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                container.innerHTML = '';
+                if (!data.items.length) {
+                    return;
+                }
+                
+                const heading = document.createElement('div');
+                heading.className = 'recent-files-heading';
+                heading.textContent = 'Recent';
+                container.appendChild(heading);
+                
+                data.items.forEach(item => {
+                    const recentItem = document.createElement('div');
+                    recentItem.className = 'file-item recent-file';
+                    recentItem.title = `${item.path}\nChanged ${new Date(item.time * 1000).toLocaleString()}` +
+                                       (item.username ? ` by ${item.username}` : '');
+                    
+                    const icon = document.createElement('i');
+                    icon.className = 'fas fa-clock';
+                    const label = document.createElement('span');
+                    label.textContent = item.path.split('/').pop().replace(/\.md$/, '');
+                    recentItem.appendChild(icon);
+                    recentItem.appendChild(label);
+                    
+                    recentItem.addEventListener('click', () => {
+                        this.loadFile(item.path);
+                        this.highlightActiveFile(item.path);
+                    });
+                    container.appendChild(recentItem);
+                });
+            })
+            .catch(error => {
+                console.warn('Could not load recent files:', error);
+            });
+    }
+    
+    // Polls are marked as background requests, which the server sheds first under load
+    backgroundFetch(url) {
+        const deferred = () => {
+            const error = new Error('Server is busy, poll deferred');
+            error.deferred = true;
+            return error;
+        };
+        
+        if (Date.now() < this.backgroundRetryAt) {
+            return Promise.reject(deferred());
+        }
+        
+        return fetch(url, { headers: { 'X-Request-Class': 'background' } })
+            .then(response => {
+                if (response.status === 503 && response.headers.has('Retry-After')) {
+                    // The server jitters the delay so tabs don't all retry at once
+                    const seconds = parseInt(response.headers.get('Retry-After'), 10) || 5;
+                    this.backgroundRetryAt = Date.now() + seconds * 1000;
+                    throw deferred();
+                }
+                return response;
+            });
+    }
+    
     loadFileTree(isBackgroundRefresh = false) {
         console.log("Loading file tree...", isBackgroundRefresh ? "(background refresh)" : "");
         
@@ -419,7 +500,7 @@ class FileManager {
             }
         });
         
-        fetch('/api/files')
+        (isBackgroundRefresh ? this.backgroundFetch('/api/files') : fetch('/api/files'))
             .then(response => {
                 if (!response.ok) {
                     throw new Error(`API request failed with status ${response.status}`);
@@ -510,6 +591,7 @@ class FileManager {
                     }
                     current = current.children[part];
                 }
+                current.usage = item.usage;
             } 
             // For files, navigate to parent directory then add the file
             else {
@@ -524,13 +606,33 @@ class FileManager {
                 }
                 
                 // Add the file to its parent directory
-                current.children[fileName] = { type: 'file', path: item.path };
+                current.children[fileName] = { type: 'file', path: item.path, stats: item.stats };
             }
         });
         
         return tree;
     }
     
+    formatSize(bytes) {
+        if (bytes >= 1024 * 1024 * 1024) {
+            return `${(bytes / (1024 * 1024 * 1024)).toFixed(1)} GB`;
+        } else if (bytes >= 1024 * 1024) {
+            return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+        } else if (bytes >= 1024) {
+            return `${(bytes / 1024).toFixed(1)} KB`;
+        }
+        return `${bytes} B`;
+    }
+    
+    formatFileStats(stats) {
+        return `${stats.words} words, ${this.formatSize(stats.size)}, ${stats.readingTime} min read`;
+    }
+    
+    formatDirectoryUsage(usage) {
+        const files = usage.files === 1 ? '1 file' : `${usage.files} files`;
+        return `${files}, ${this.formatSize(usage.bytes)}`;
+    }
+    
     renderFileTree(tree, parentElement = null, path = '') {
         const container = parentElement || this.fileTree;
         
@@ -619,6 +721,10 @@ class FileManager {
                     fileItem.appendChild(folderHeader);
                 }
                 
+                if (item.usage) {
+                    folderHeader.title = this.formatDirectoryUsage(item.usage);
+                }
+                
                 // Add the click event to the header only
                 folderHeader.addEventListener('click', (e) => {
                     e.stopPropagation();
@@ -676,6 +782,11 @@ class FileManager {
                 // Set path data attribute for files
                 fileItem.setAttribute('data-path', item.path);
                 
+                // Show the cached document statistics as a tooltip
+                if (item.stats) {
+                    fileItem.title = this.formatFileStats(item.stats);
+                }
+                
                 // Add click handler to load file
                 fileItem.addEventListener('click', (e) => {
                     e.stopPropagation(); // Prevent bubbling to parent folders
@@ -701,6 +812,11 @@ class FileManager {
     }
     
     loadFile(path) {
+        // Leave the collaborative session, the hub keeps the edits made so far
+        if (this.collab) {
+            this.stopCollaboration();
+        }
+        
         // Important: Remove any existing change handlers BEFORE doing anything else
         // This prevents the change handler from firing due to content changes during file loading
         if (window.editor && window.editor.editor && this._lockOnChangeHandler) {
@@ -783,6 +899,11 @@ class FileManager {
                 
                 // Update the editor content and formatting
                 if (window.editor) {
+                    // Store the server statistics first so the footer and navigation can use them
+                    if (typeof window.editor.setDocumentStats === 'function') {
+                        window.editor.setDocumentStats(data.stats, data.content);
+                    }
+                    
                     if (typeof window.editor.setContent === 'function') {
                         window.editor.setContent(data.content);
                         
@@ -942,6 +1063,14 @@ class FileManager {
             return;
         }
         
+        // Collaborative edits are saved by the hub, saving only writes its snapshot sooner
+        if (this.collab) {
+            if (isAutoSave) return;
+            return this.collab.snapshot()
+                .then(() => this.showSaveIndicator(false))
+                .catch(error => alert(`Error saving file: ${error.message}`));
+        }
+        
         // When saving, we should ensure we have a lock
         if (!this.lockStatus.hasLock) {
             // Only for manual saves (not auto-save), acquire the lock first
@@ -1015,6 +1144,9 @@ class FileManager {
                 if (response.status === 423) {  // Locked status code
                     throw new Error("File is locked by another user");
                 }
+                if (response.status === 507) {  // Storage quota exceeded
+                    return response.json().then(data => { throw new Error(data.error); });
+                }
                 throw new Error(`Failed to save file: ${response.status} ${response.statusText}`);
             }
             return response.json();
@@ -1022,6 +1154,17 @@ class FileManager {
         .then(data => {
             if (data.success) {
                 console.log('File saved successfully:', this.currentFilePath);
+                
+                (data.quotaWarnings || []).forEach(quota => {
+                    console.warn(`Soft storage quota of ${quota.path || 'the workspace'} exceeded:`,
+                                 `${this.formatSize(quota.used)} of ${this.formatSize(quota.limit)}`);
+                });
+                
+                // Keep the server statistics in sync with the saved content
+                if (window.editor && typeof window.editor.setDocumentStats === 'function') {
+                    window.editor.setDocumentStats(data.stats, content);
+                }
+                
                 // Show save indicator
                 this.showSaveIndicator(isAutoSave);
             } else {
@@ -1191,8 +1334,8 @@ class FileManager {
     }
     
     deleteFile(path) {
-        if (confirm(`Are you sure you want to delete "${path}"?`)) {
-            fetch(`/api/file?path=${encodeURIComponent(path)}`, {
+        if (confirm(`Move "${path}" to the trash?`)) {
+            fetch(`/api/file?path=${encodeURIComponent(path)}&session_id=${encodeURIComponent(this.sessionId)}`, {
                 method: 'DELETE'
             })
             .then(response => response.json())
@@ -1214,8 +1357,8 @@ class FileManager {
     }
     
     deleteFolder(path) {
-        if (confirm(`Are you sure you want to delete the folder "${path}" and all its contents?`)) {
-            fetch(`/api/directory?path=${encodeURIComponent(path)}`, {
+        if (confirm(`Move the folder "${path}" and all its contents to the trash?`)) {
+            fetch(`/api/directory?path=${encodeURIComponent(path)}&session_id=${encodeURIComponent(this.sessionId)}`, {
                 method: 'DELETE'
             })
             .then(response => response.json())
@@ -1267,11 +1410,14 @@ class FileManager {
         modalTitle.textContent = 'Create New File';
         
         // First load the folder structure to populate the dropdown
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                // Filter to get only directories
-                const folders = files.filter(item => item.type === 'directory').map(dir => dir.path);
+        this.fetchSuggestions('', 'directory')
+            .then(results => {
+                // The shallowest folders, deeper ones are found through the filter
+                const folders = results.map(dir => dir.path);
+                
+                if (preSelectedFolder && !folders.includes(preSelectedFolder)) {
+                    folders.unshift(preSelectedFolder);
+                }
                 
                 // Always include root directory option
                 folders.unshift('(Root Directory)');
@@ -1294,6 +1440,8 @@ class FileManager {
                     
                     <div style="margin-bottom: 15px;">
                         <label for="folder-select">Location:</label>
+                        <input type="text" class="folder-filter" placeholder="Filter folders" autocomplete="off"
+                            style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                         <select id="folder-select" style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                             ${options}
                         </select>
@@ -1304,6 +1452,14 @@ class FileManager {
                         <button id="create-file-btn">Create</button>
                     </div>
                 `;
+
+                // Narrow the folder list through the quick-open index
+                this.bindSuggestionFilter(
+                    modalBody.querySelector('.folder-filter'),
+                    document.getElementById('folder-select'),
+                    'directory',
+                    { firstOption: ['', '(Root Directory)'], selected: preSelectedFolder }
+                );
                 
                 // Function to create the file
                 const createFileWithContent = () => {
@@ -1709,6 +1865,8 @@ class FileManager {
         
         contextMenu.innerHTML = `
             <div class="context-menu-item" data-action="open">Open</div>
+            ${document.body.dataset.collaborationEnabled ? '<div class="context-menu-item" data-action="collaborate">Edit Collaboratively</div>' : ''}
+            <div class="context-menu-item" data-action="view">Open Read-Only View</div>
             <div class="context-menu-item" data-action="duplicate">Duplicate</div>
             <div class="context-menu-item" data-action="rename">Rename</div>
             <div class="context-menu-item" data-action="move">Move to...</div>
@@ -1740,6 +1898,10 @@ class FileManager {
             
             if (action === 'open') {
                 this.loadFile(path);
+            } else if (action === 'collaborate') {
+                this.startCollaboration(path);
+            } else if (action === 'view') {
+                window.open(`/view/${encodeURI(path)}`, '_blank');
             } else if (action === 'duplicate') {
                 this.duplicateFile(path);
             } else if (action === 'rename') {
@@ -1897,11 +2059,10 @@ class FileManager {
         }
         
         // First load the folder structure to populate the dropdown
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                // Filter to get only directories
-                const folders = files.filter(item => item.type === 'directory').map(dir => dir.path);
+        this.fetchSuggestions('', 'directory')
+            .then(results => {
+                // The shallowest folders, deeper ones are found through the filter
+                const folders = results.map(dir => dir.path);
                 
                 // Always include root directory option
                 folders.unshift('(Root Directory)');
@@ -1924,6 +2085,10 @@ class FileManager {
                     }
                 }
                 
+                if (currentFolder && !folders.includes(currentFolder)) {
+                    folders.splice(1, 0, currentFolder);
+                }
+                
                 // Create dropdown HTML
                 const options = folders.map(folder => {
                     const displayName = folder === '(Root Directory)' ? folder : folder;
@@ -1943,6 +2108,8 @@ class FileManager {
                     
                     <div style="margin-bottom: 15px;">
                         <label for="folder-select">Location:</label>
+                        <input type="text" class="folder-filter" placeholder="Filter folders" autocomplete="off"
+                            style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                         <select id="folder-select" style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                             ${options}
                         </select>
@@ -1953,6 +2120,14 @@ class FileManager {
                         <button id="save-as-btn">Save</button>
                     </div>
                 `;
+
+                // Narrow the folder list through the quick-open index
+                this.bindSuggestionFilter(
+                    modalBody.querySelector('.folder-filter'),
+                    document.getElementById('folder-select'),
+                    'directory',
+                    { firstOption: ['', '(Root Directory)'], selected: currentFolder }
+                );
                 
                 // Function to save the file as a new file
                 const saveAsNewFile = () => {
@@ -2338,6 +2513,7 @@ class FileManager {
             </div>
             <div style="margin-top: 10px;">
                 <label>Or select a document:</label>
+                <input type="text" id="document-filter" placeholder="Search documents" autocomplete="off">
                 <select id="document-select">
                     <option value="">-- Select a document --</option>
                 </select>
@@ -2348,20 +2524,13 @@ class FileManager {
             </div>
         `;
         
-        // Populate the document select dropdown
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                const docSelect = document.getElementById('document-select');
-                
-                files.filter(file => file.type === 'file').forEach(file => {
-                    const option = document.createElement('option');
-                    option.value = file.path;
-                    option.textContent = file.path;
-                    docSelect.appendChild(option);
-                });
-            })
-            .catch(error => console.error('Error loading documents for link:', error));
+        // Populate the document select dropdown from the quick-open index
+        this.bindSuggestionFilter(
+            document.getElementById('document-filter'),
+            document.getElementById('document-select'),
+            'file',
+            { firstOption: ['', '-- Select a document --'] }
+        )().catch(error => console.error('Error loading documents for link:', error));
         
         // Handle document selection
         document.getElementById('document-select').addEventListener('change', function() {
@@ -2481,6 +2650,113 @@ class FileManager {
         }
     }
 
+    // Edit a document together with other sessions instead of taking its lock
+    startCollaboration(path) {
+        // Load the document normally first so unsaved changes and locks are handled
+        this.loadFile(path).then(() => {
+            if (this.currentFilePath !== path) return;
+            
+            // Collaborative editing never takes the exclusive lock
+            if (window.editor && window.editor.editor && this._lockOnChangeHandler) {
+                window.editor.editor.off('change', this._lockOnChangeHandler);
+                this._lockOnChangeHandler = null;
+            }
+            const release = this.lockStatus.hasLock ? this.releaseLock(path) : Promise.resolve();
+            
+            release.then(() => {
+                const session = new CollabSession(path, () => {
+                    // The document was deleted or moved while we were editing it
+                    this.collab = null;
+                    alert('The collaborative session was closed because the document was moved or deleted.');
+                    this.loadFileTree(true);
+                });
+                return session.start().then(() => {
+                    this.collab = session;
+                    this.setEditorReadOnly(false);
+                });
+            }).catch(error => {
+                console.error('Error starting collaborative editing:', error);
+                alert(`Could not start collaborative editing: ${error.message}`);
+            });
+        });
+    }
+    
+    stopCollaboration() {
+        const session = this.collab;
+        this.collab = null;
+        return session.stop();
+    }
+
+    // Fetch the best matching files or folders from the server-side quick-open index
+    fetchSuggestions(query, type, limit = 50) {
+        const params = new URLSearchParams({ q: query, type: type, limit: limit });
+        return fetch(`/api/files/suggest?${params}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`API request failed with status ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => data.results);
+    }
+
+    // Refill a select with suggestions as the user types in a filter input, returns the refresh function
+    bindSuggestionFilter(input, select, type, options = {}) {
+        const {
+            firstOption = null,     // [value, label] always listed first, e.g. the root directory
+            selected = '',          // Value to select, listed even if it isn't a suggestion
+            exclude = () => false   // Predicate hiding paths, e.g. a folder being moved
+        } = options;
+        let debounceTimer = null;
+        let latestRequest = 0;
+
+        const addOption = (value, label) => {
+            const option = document.createElement('option');
+            option.value = value;
+            option.textContent = label;
+            select.appendChild(option);
+        };
+
+        const update = () => {
+            const requestId = ++latestRequest;
+            const current = select.value || selected;
+
+            return this.fetchSuggestions(input.value.trim(), type).then(results => {
+                // Ignore responses overtaken by a newer query
+                if (requestId !== latestRequest) return;
+
+                const paths = results.map(item => item.path).filter(path => !exclude(path));
+                select.innerHTML = '';
+                if (firstOption) {
+                    addOption(firstOption[0], firstOption[1]);
+                }
+                if (current && !paths.includes(current) && !input.value.trim()) {
+                    paths.unshift(current);
+                }
+                paths.forEach(path => {
+                    const item = results.find(result => result.path === path);
+                    addOption(path, item && item.title ? `${path} (${item.title})` : path);
+                });
+
+                if (current && paths.includes(current)) {
+                    select.value = current;
+                } else if (input.value.trim() && paths.length > 0) {
+                    // Typing a query picks the best match
+                    select.value = paths[0];
+                }
+            });
+        };
+
+        input.addEventListener('input', () => {
+            clearTimeout(debounceTimer);
+            debounceTimer = setTimeout(() => {
+                update().catch(error => console.error('Error loading suggestions:', error));
+            }, 150);
+        });
+
+        return update;
+    }
+
     updateDocumentTitle(path) {
         // If no path is provided, show "Untitled Document - Markdown Writer"
         if (!path) {
@@ -2856,16 +3132,21 @@ class FileManager {
         return false;
     }
     
-    checkLockStatus(filePath) {
+    checkLockStatus(filePath, isBackgroundPoll = false) {
         console.log("Checking lock status for:", filePath);
         
-        return fetch(`/api/file/lock?path=${encodeURIComponent(filePath)}`)
+        const url = `/api/file/lock?path=${encodeURIComponent(filePath)}`;
+        return (isBackgroundPoll ? this.backgroundFetch(url) : fetch(url))
             .then(response => response.json())
             .then(data => {
                 console.log("Lock status:", data);
                 return data;
             })
             .catch(error => {
+                // A deferred poll says nothing about the lock, keep the current status
+                if (error.deferred) {
+                    throw error;
+                }
                 console.error("Error checking lock status:", error);
                 return { isLocked: false, error: error.message };
             });
@@ -3120,7 +3401,7 @@ class FileManager {
 
     updateFileTreeLockStatus() {
         // Fetch all locked files to update the file tree
-        fetch('/api/files/locks')
+        this.backgroundFetch('/api/files/locks')
             .then(response => {
                 if (!response.ok) {
                     // If endpoint doesn't exist yet or fails, silently continue
@@ -3357,11 +3638,10 @@ class FileManager {
         modalTitle.textContent = `Move File "${fileName}"`;
         
         // First load the folder structure to populate the dropdown
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                // Filter to get only directories
-                const folders = files.filter(item => item.type === 'directory').map(dir => dir.path);
+        this.fetchSuggestions('', 'directory')
+            .then(results => {
+                // The shallowest folders, deeper ones are found through the filter
+                const folders = results.map(dir => dir.path);
                 
                 // Always include root directory option
                 folders.unshift('(Root Directory)');
@@ -3377,6 +3657,8 @@ class FileManager {
                 modalBody.innerHTML = `
                     <div style="margin-bottom: 15px;">
                         <label for="move-folder-select">Select destination folder:</label>
+                        <input type="text" class="folder-filter" placeholder="Filter folders" autocomplete="off"
+                            style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                         <select id="move-folder-select" style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                             ${options}
                         </select>
@@ -3386,6 +3668,14 @@ class FileManager {
                         <button id="move-file-btn">Move</button>
                     </div>
                 `;
+
+                // Narrow the folder list through the quick-open index
+                this.bindSuggestionFilter(
+                    modalBody.querySelector('.folder-filter'),
+                    document.getElementById('move-folder-select'),
+                    'directory',
+                    { firstOption: ['', '(Root Directory)'] }
+                );
                 
                 // Function to move the file
                 const moveFile = () => {
@@ -3443,8 +3733,8 @@ class FileManager {
                 // Show the modal
                 modal.style.display = 'block';
 
-                // Focus the select element
-                document.getElementById('move-folder-select').focus();
+                // Focus the folder filter
+                modalBody.querySelector('.folder-filter').focus();
             })
             .catch(error => {
                 console.error('Error loading folders for move:', error);
@@ -3463,11 +3753,10 @@ class FileManager {
         modalTitle.textContent = `Move Folder "${folderName}"`;
         
         // First load the folder structure to populate the dropdown
-        fetch('/api/files')
-            .then(response => response.json())
-            .then(files => {
-                // Filter to get only directories
-                let folders = files.filter(item => item.type === 'directory').map(dir => dir.path);
+        this.fetchSuggestions('', 'directory')
+            .then(results => {
+                // The shallowest folders, deeper ones are found through the filter
+                let folders = results.map(dir => dir.path);
                 
                 // Remove the current folder and its subfolders
                 folders = folders.filter(folder => 
@@ -3487,6 +3776,8 @@ class FileManager {
                 modalBody.innerHTML = `
                     <div style="margin-bottom: 15px;">
                         <label for="move-folder-select">Select destination folder:</label>
+                        <input type="text" class="folder-filter" placeholder="Filter folders" autocomplete="off"
+                            style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                         <select id="move-folder-select" style="width: 100%; padding: 8px; margin-top: 5px; box-sizing: border-box;">
                             ${options}
                         </select>
@@ -3496,6 +3787,14 @@ class FileManager {
                         <button id="move-folder-btn">Move</button>
                     </div>
                 `;
+
+                // Narrow the folder list through the quick-open index
+                this.bindSuggestionFilter(
+                    modalBody.querySelector('.folder-filter'),
+                    document.getElementById('move-folder-select'),
+                    'directory',
+                    { firstOption: ['', '(Root Directory)'], exclude: folder => folder === folderPath || folder.startsWith(folderPath + '/') }
+                );
                 
                 // Function to move the folder
                 const moveFolder = () => {
@@ -3553,8 +3852,8 @@ class FileManager {
                 // Show the modal
                 modal.style.display = 'block';
 
-                // Focus the select element
-                document.getElementById('move-folder-select').focus();
+                // Focus the folder filter
+                modalBody.querySelector('.folder-filter').focus();
             })
             .catch(error => {
                 console.error('Error loading folders for move:', error);
@@ -3571,12 +3870,12 @@ class FileManager {
         
         // Set up a new interval to update lock status every 30 seconds
         this._lockStatusInterval = setInterval(() => {
-            // Only check if we have a current file path
-            if (this.currentFilePath) {
+            // Only check if we have a current file path, collaborative documents aren't locked
+            if (this.currentFilePath && !this.collab) {
                 console.log("Updating lock status for:", this.currentFilePath);
                 
                 // Check the lock status
-                this.checkLockStatus(this.currentFilePath)
+                this.checkLockStatus(this.currentFilePath, true)
                     .then(status => {
                         // Update our local status
                         this.lockStatus = {
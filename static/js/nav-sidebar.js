@@ -7,6 +7,7 @@ class NavigationSidebar {
         this.overlay = null;
         this.isActive = false;
         this.headingMap = new Map(); // Maps heading elements to their nav items
+        this.navLinks = []; // Nav links in document order
         
         // Initialize the sidebar when the document is ready
         if (document.readyState === 'loading') {
@@ -139,10 +140,28 @@ class NavigationSidebar {
     scanDocumentHeadings() {
         // Clear the heading map
         this.headingMap.clear();
+        this.navLinks = [];
         
         // Clear the navigation content
         this.navContent.innerHTML = '';
         
+        // Use the server outline while the document is unchanged, no DOM scan needed
+        const serverStats = window.editor && typeof window.editor.getCurrentDocumentStats === 'function'
+            ? window.editor.getCurrentDocumentStats()
+            : null;
+        if (serverStats && Array.isArray(serverStats.outline)) {
+            const entries = serverStats.outline
+                .filter(item => item.level >= 2 && item.level <= 4)
+                .map((item, index) => ({
+                    text: item.text,
+                    level: `h${item.level}`,
+                    // Resolve the heading element only when it is needed
+                    getElement: () => this.getHeadingElements()[index] || null
+                }));
+            this.buildNavigationTree(entries);
+            return;
+        }
+        
         // Get the editor content container
         let contentContainer = null;
         if (window.editor && window.editor.editor) {
@@ -165,7 +184,33 @@ class NavigationSidebar {
         // Find all headings (h2, h3, h4)
         const headings = contentContainer.querySelectorAll('h2, h3, h4');
         
-        if (headings.length === 0) {
+        const entries = Array.from(headings).map(heading => ({
+            text: heading.textContent.trim(),
+            level: heading.tagName.toLowerCase(),
+            element: heading,
+            getElement: () => heading
+        }));
+        this.buildNavigationTree(entries);
+    }
+    
+    /**
+     * Get the rendered h2, h3 and h4 headings of the editor content
+     */
+    getHeadingElements() {
+        let contentContainer = null;
+        if (window.editor && window.editor.editor) {
+            contentContainer = window.editor.editor.isWysiwygMode()
+                ? document.querySelector('.toastui-editor-contents')
+                : document.querySelector('.toastui-editor-md-preview');
+        }
+        return contentContainer ? contentContainer.querySelectorAll('h2, h3, h4') : [];
+    }
+    
+    /**
+     * Build the navigation tree from a list of heading entries
+     */
+    buildNavigationTree(entries) {
+        if (entries.length === 0) {
             this.navContent.innerHTML = '<div class="nav-empty" style="padding: 15px; color: #777; text-align: center;">No headings found in document.</div>';
             return;
         }
@@ -179,9 +224,9 @@ class NavigationSidebar {
         let currentH3 = null;
         
         // Process each heading
-        headings.forEach((heading) => {
-            const headingText = heading.textContent.trim();
-            const headingLevel = heading.tagName.toLowerCase();
+        entries.forEach((entry) => {
+            const headingText = entry.text;
+            const headingLevel = entry.level;
             
             // Create navigation item
             const navItem = document.createElement('li');
@@ -194,11 +239,14 @@ class NavigationSidebar {
             navLink.setAttribute('title', headingText);
             
             // Store reference to the heading element
-            this.headingMap.set(heading, navLink);
+            if (entry.element) {
+                this.headingMap.set(entry.element, navLink);
+            }
+            this.navLinks.push(navLink);
             
             // Add click handler to scroll to heading
             navLink.addEventListener('click', () => {
-                this.scrollToHeading(heading);
+                this.scrollToHeading(entry.getElement());
                 this.closeSidebar();
             });
             
@@ -253,7 +301,7 @@ class NavigationSidebar {
         // Add the navigation tree to the content
         this.navContent.appendChild(navTree);
         
-        console.log(`Navigation tree built with ${headings.length} headings`);
+        console.log(`Navigation tree built with ${entries.length} headings`);
     }
     
     /**
@@ -312,7 +360,9 @@ class NavigationSidebar {
         allNavLinks.forEach(link => link.classList.remove('active'));
         
         // Add active class to the corresponding nav link
-        const activeNavLink = this.headingMap.get(activeHeading);
+        // Trees built from the server outline are matched by heading position
+        const activeNavLink = this.headingMap.get(activeHeading) ||
+            this.navLinks[Array.prototype.indexOf.call(this.getHeadingElements(), activeHeading)];
         if (activeNavLink) {
             activeNavLink.classList.add('active');
         }
@@ -0,0 +1,609 @@
+# storage.py - Pluggable storage backends for the documents store
+import io
+import os
+import sys
+import time
+import uuid
+import codecs
+import shutil
+import sqlite3
+import tempfile
+import threading
+import argparse
+from collections import namedtuple
+from contextlib import contextmanager
+from profiling import track, traced_walk
+
+# Bytes read or written at a time when streaming a document
+CHUNK_SIZE = 64 * 1024
+
+# A document or directory. Directories have no modification time or size.
+Entry = namedtuple('Entry', ['path', 'type', 'mtime_ns', 'size'])
+
+class DocumentTooLarge(Exception):
+    """Raised when a streamed document grows past the size it may have."""
+
+def parent_of(path):
+    """Get the parent directory of a path, '' for the root."""
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+def write_file_atomic(full_path, content):
+    """
+    Write a text file through a temporary file and rename it into place,
+    so concurrent readers and writers never see a partial file.
+    """
+    temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, full_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def copy_text_stream(source, target, max_size=None):
+    """
+    Copy UTF-8 bytes from one binary stream to another in chunks,
+    raising UnicodeDecodeError if they aren't valid text and
+    DocumentTooLarge once more than max_size bytes arrived.
+    Returns the number of bytes copied.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    size = 0
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        # Bodies without a declared length are only known to be too large while reading them
+        if max_size is not None and size > max_size:
+            raise DocumentTooLarge(f"Document is larger than {max_size} bytes")
+        decoder.decode(chunk)
+        target.write(chunk)
+    decoder.decode(b'', final=True)
+    return size
+
+def open_text(binary):
+    """Wrap a binary document stream for reading it line by line."""
+    return io.TextIOWrapper(binary, encoding='utf-8', newline='')
+
+class FilesystemStorage:
+    """
+    Documents as .md files in a directory tree, each with its format
+    options in a .json sidecar next to it. The original layout.
+    """
+
+    def __init__(self, root, trash_root):
+        self.root = root
+        self.trash_root = trash_root
+        os.makedirs(root, exist_ok=True)
+        os.makedirs(trash_root, exist_ok=True)
+
+    def full_path(self, path):
+        return os.path.join(self.root, path)
+
+    def _sidecar(self, path):
+        return self.full_path(path)[:-3] + '.json'
+
+    def is_file(self, path):
+        with track('filesystem'):
+            return os.path.isfile(self.full_path(path))
+
+    def is_dir(self, path):
+        with track('filesystem'):
+            return os.path.isdir(self.full_path(path))
+
+    def stat(self, path):
+        """Get the entry of a document, raising FileNotFoundError if it doesn't exist."""
+        with track('filesystem'):
+            stat = os.stat(self.full_path(path))
+        return Entry(path, 'file', stat.st_mtime_ns, stat.st_size)
+
+    def version(self, path):
+        """
+        Get a key that changes whenever a document or its format options
+        change: (mtime_ns, size, options mtime_ns, options size).
+        """
+        with track('filesystem'):
+            stat = os.stat(self.full_path(path))
+            try:
+                sidecar = os.stat(self._sidecar(path))
+                return stat.st_mtime_ns, stat.st_size, sidecar.st_mtime_ns, sidecar.st_size
+            except FileNotFoundError:
+                return stat.st_mtime_ns, stat.st_size, -1, -1
+
+    def read(self, path):
+        """Read the text of a document."""
+        with track('filesystem'):
+            with open(self.full_path(path), 'r', encoding='utf-8') as f:
+                return f.read()
+
+    def open(self, path):
+        """Open a document for reading its UTF-8 bytes in chunks."""
+        with track('filesystem'):
+            return open(self.full_path(path), 'rb')
+
+    def stream(self, path):
+        """Open a document for sending, returns (binary file, size in bytes)."""
+        f = self.open(path)
+        return f, os.fstat(f.fileno()).st_size
+
+    def read_options(self, path):
+        """Read the raw format options JSON of a document, or None if it has none."""
+        with track('filesystem'):
+            try:
+                with open(self._sidecar(path), 'r', encoding='utf-8') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+    def write(self, path, content, options=None):
+        """Write a document, and its format options JSON unless options is None."""
+        full_path = self.full_path(path)
+        with track('filesystem'):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            write_file_atomic(full_path, content)
+            if options is not None:
+                write_file_atomic(self._sidecar(path), options)
+
+    def write_stream(self, path, stream, options=None, max_size=None):
+        """
+        Write a document from a binary stream through a temporary file,
+        so only one chunk is held in memory. Returns the size written.
+        A stream longer than max_size bytes raises DocumentTooLarge and
+        leaves the stored document as it was.
+        """
+        full_path = self.full_path(path)
+        with track('filesystem'):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, 'wb') as f:
+                    size = copy_text_stream(stream, f, max_size)
+                os.replace(temp_path, full_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            if options is not None:
+                write_file_atomic(self._sidecar(path), options)
+        return size
+
+    def rename(self, old_path, new_path):
+        """Move a document and its format options."""
+        with track('filesystem'):
+            os.makedirs(os.path.dirname(self.full_path(new_path)), exist_ok=True)
+            shutil.move(self.full_path(old_path), self.full_path(new_path))
+            if os.path.exists(self._sidecar(old_path)):
+                shutil.move(self._sidecar(old_path), self._sidecar(new_path))
+
+    def make_dirs(self, path):
+        """Create a directory and any missing parents."""
+        with track('filesystem'):
+            os.makedirs(self.full_path(path), exist_ok=True)
+
+    def rename_dir(self, old_path, new_path):
+        """Move a directory and everything in it."""
+        with track('filesystem'):
+            parent = os.path.dirname(self.full_path(new_path))
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            shutil.move(self.full_path(old_path), self.full_path(new_path))
+
+    def trash(self, path, trash_id):
+        """
+        Move a document with its format options, or a directory, into the
+        trash under an id. Both live on one filesystem, so this is a rename.
+        """
+        full_path = self.full_path(path)
+        target = os.path.join(self.trash_root, trash_id)
+        name = path.rsplit('/', 1)[-1]
+        with track('filesystem'):
+            is_file = os.path.isfile(full_path)
+            os.makedirs(target)
+            os.rename(full_path, os.path.join(target, name))
+            if is_file and os.path.exists(self._sidecar(path)):
+                os.rename(self._sidecar(path), os.path.join(target, name[:-3] + '.json'))
+
+    def restore(self, trash_id, path):
+        """Move a trashed item back to the path it was deleted from."""
+        source = os.path.join(self.trash_root, trash_id)
+        name = path.rsplit('/', 1)[-1]
+        with track('filesystem'):
+            os.makedirs(os.path.dirname(self.full_path(path)), exist_ok=True)
+            os.rename(os.path.join(source, name), self.full_path(path))
+            sidecar = os.path.join(source, name[:-3] + '.json')
+            if name.endswith('.md') and os.path.exists(sidecar):
+                os.rename(sidecar, self._sidecar(path))
+            os.rmdir(source)
+
+    def trash_size(self, trash_id):
+        """Get the bytes used by a trashed item."""
+        size = 0
+        for root, dirs, files in traced_walk(os.path.join(self.trash_root, trash_id)):
+            with track('filesystem'):
+                size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+        return size
+
+    def purge_trash(self, trash_id, limit):
+        """
+        Delete up to limit files of a trashed item, deepest first.
+        Returns True once nothing of the item is left.
+        """
+        top = os.path.join(self.trash_root, trash_id)
+        if not os.path.exists(top):
+            return True
+        removed = 0
+        for root, dirs, files in traced_walk(top, topdown=False):
+            with track('filesystem'):
+                for file in files:
+                    if removed >= limit:
+                        return False
+                    os.remove(os.path.join(root, file))
+                    removed += 1
+                os.rmdir(root)
+        return True
+
+    def walk(self, path=''):
+        """Yield the entries of every directory and document below a directory."""
+        top = self.full_path(path) if path else self.root
+        for root, dirs, files in traced_walk(top):
+            rel_path = os.path.relpath(root, self.root).replace('\\', '/')
+            prefix = '' if rel_path == '.' else rel_path + '/'
+            for directory in dirs:
+                yield Entry(prefix + directory, 'directory', None, None)
+            for file in files:
+                if file.endswith('.md'):
+                    try:
+                        entry = self.stat(prefix + file)
+                    except FileNotFoundError:
+                        continue
+                    yield entry
+
+    def orphaned_options(self):
+        """Yield the paths of .json sidecars left without their document."""
+        for root, dirs, files in traced_walk(self.root):
+            rel_path = os.path.relpath(root, self.root).replace('\\', '/')
+            prefix = '' if rel_path == '.' else rel_path + '/'
+            names = set(files)
+            for file in files:
+                if file.endswith('.json') and file[:-5] + '.md' not in names:
+                    yield prefix + file
+
+class _BlobReader(io.RawIOBase):
+    """
+    File interface over an incremental SQLite blob handle. It isn't
+    seekable, so servers read it from the request thread that opened it
+    instead of handing it to an I/O thread.
+    """
+
+    def __init__(self, blob):
+        self._blob = blob
+        self.size = len(blob)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._blob.close()
+        super().close()
+
+class SQLiteStorage:
+    """
+    Documents and their format options packed into rows of one SQLite
+    database, so a workspace of many short notes is a single file rather
+    than two inodes per note. Directories are rows of their own so empty
+    ones survive.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                parent TEXT NOT NULL,
+                type TEXT NOT NULL,
+                content TEXT,
+                options TEXT,
+                mtime_ns INTEGER,
+                size INTEGER,
+                options_mtime_ns INTEGER,
+                options_size INTEGER
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS trash_entries (
+                trash_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                parent TEXT NOT NULL,
+                type TEXT NOT NULL,
+                content TEXT,
+                options TEXT,
+                mtime_ns INTEGER,
+                size INTEGER,
+                options_mtime_ns INTEGER,
+                options_size INTEGER,
+                PRIMARY KEY (trash_id, path)
+            )
+            ''')
+            conn.commit()
+
+    @contextmanager
+    def _connect(self):
+        # Opening a connection costs more than reading a short note, so each
+        # thread keeps one. Worker processes forked later open their own.
+        with track('storageDb'):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None or self._local.pid != os.getpid():
+                conn = sqlite3.connect(self.db_path, timeout=10.0)
+                conn.execute("PRAGMA synchronous=NORMAL")
+                self._local.conn = conn
+                self._local.pid = os.getpid()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def _ensure_parents(self, conn, path):
+        parent = parent_of(path)
+        while parent:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO entries (path, parent, type) VALUES (?, ?, 'directory')",
+                (parent, parent_of(parent))
+            )
+            if not cursor.rowcount:
+                return
+            parent = parent_of(parent)
+
+    def _get(self, path, columns):
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {columns} FROM entries WHERE path = ? AND type = 'file'", (path,)
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row
+
+    def is_file(self, path):
+        with self._connect() as conn:
+            row = conn.execute("SELECT type FROM entries WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] == 'file'
+
+    def is_dir(self, path):
+        if not path:
+            return True
+        with self._connect() as conn:
+            row = conn.execute("SELECT type FROM entries WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] == 'directory'
+
+    def stat(self, path):
+        mtime_ns, size = self._get(path, 'mtime_ns, size')
+        return Entry(path, 'file', mtime_ns, size)
+
+    def version(self, path):
+        return tuple(self._get(path, 'mtime_ns, size, options_mtime_ns, options_size'))
+
+    def read(self, path):
+        return self._get(path, 'content')[0]
+
+    def _open_blob(self, path):
+        # Incremental blob I/O reads the stored text without loading all of it
+        rowid = self._get(path, 'rowid')[0]
+        with self._connect() as conn:
+            return _BlobReader(conn.blobopen('entries', 'content', rowid, readonly=True))
+
+    def open(self, path):
+        return io.BufferedReader(self._open_blob(path))
+
+    def stream(self, path):
+        reader = self._open_blob(path)
+        return io.BufferedReader(reader), reader.size
+
+    def read_options(self, path):
+        return self._get(path, 'options')[0]
+
+    def write(self, path, content, options=None):
+        now = time.time_ns()
+        size = len(content.encode('utf-8'))
+        with self._connect() as conn:
+            self._ensure_parents(conn, path)
+            if options is None:
+                # Keep the stored format options
+                conn.execute(
+                    "INSERT INTO entries (path, parent, type, content, mtime_ns, size, options_mtime_ns, options_size) "
+                    "VALUES (?, ?, 'file', ?, ?, ?, -1, -1) "
+                    "ON CONFLICT(path) DO UPDATE SET content = excluded.content, "
+                    "mtime_ns = excluded.mtime_ns, size = excluded.size",
+                    (path, parent_of(path), content, now, size)
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    "(path, parent, type, content, options, mtime_ns, size, options_mtime_ns, options_size) "
+                    "VALUES (?, ?, 'file', ?, ?, ?, ?, ?, ?)",
+                    (path, parent_of(path), content, options, now, size, now, len(options.encode('utf-8')))
+                )
+            conn.commit()
+
+    def write_stream(self, path, stream, options=None, max_size=None):
+        # Spool the body to learn its size, then fill a zeroed value of that size in place
+        with tempfile.TemporaryFile() as spool:
+            size = copy_text_stream(stream, spool, max_size)
+            spool.seek(0)
+            now = time.time_ns()
+            with self._connect() as conn:
+                self._ensure_parents(conn, path)
+                if options is None:
+                    conn.execute(
+                        "INSERT INTO entries (path, parent, type, content, mtime_ns, size, options_mtime_ns, options_size) "
+                        "VALUES (?, ?, 'file', CAST(zeroblob(?) AS TEXT), ?, ?, -1, -1) "
+                        "ON CONFLICT(path) DO UPDATE SET content = excluded.content, "
+                        "mtime_ns = excluded.mtime_ns, size = excluded.size",
+                        (path, parent_of(path), size, now, size)
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries "
+                        "(path, parent, type, content, options, mtime_ns, size, options_mtime_ns, options_size) "
+                        "VALUES (?, ?, 'file', CAST(zeroblob(?) AS TEXT), ?, ?, ?, ?, ?)",
+                        (path, parent_of(path), size, options, now, size, now, len(options.encode('utf-8')))
+                    )
+                rowid = conn.execute("SELECT rowid FROM entries WHERE path = ?", (path,)).fetchone()[0]
+                with conn.blobopen('entries', 'content', rowid) as blob:
+                    while True:
+                        chunk = spool.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        blob.write(chunk)
+                conn.commit()
+        return size
+
+    def rename(self, old_path, new_path):
+        with self._connect() as conn:
+            self._ensure_parents(conn, new_path)
+            cursor = conn.execute(
+                "UPDATE entries SET path = ?, parent = ? WHERE path = ? AND type = 'file'",
+                (new_path, parent_of(new_path), old_path)
+            )
+            conn.commit()
+        if not cursor.rowcount:
+            raise FileNotFoundError(old_path)
+
+    def make_dirs(self, path):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO entries (path, parent, type) VALUES (?, ?, 'directory')",
+                (path, parent_of(path))
+            )
+            self._ensure_parents(conn, path)
+            conn.commit()
+
+    def rename_dir(self, old_path, new_path):
+        old_prefix = old_path.rstrip('/') + '/'
+        with self._connect() as conn:
+            self._ensure_parents(conn, new_path)
+            conn.execute(
+                "UPDATE entries SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) "
+                "WHERE substr(path, 1, ?) = ?",
+                (new_path + '/', len(old_prefix) + 1, new_path, len(old_path) + 1, len(old_prefix), old_prefix)
+            )
+            conn.execute(
+                "UPDATE entries SET path = ?, parent = ? WHERE path = ?",
+                (new_path, parent_of(new_path), old_path)
+            )
+            conn.commit()
+
+    def trash(self, path, trash_id):
+        # Moves the rows in one statement each, the content isn't rewritten
+        prefix = path.rstrip('/') + '/'
+        where = "WHERE path = ? OR substr(path, 1, ?) = ?"
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO trash_entries SELECT ?, path, parent, type, content, options, "
+                f"mtime_ns, size, options_mtime_ns, options_size FROM entries {where}",
+                (trash_id, path, len(prefix), prefix)
+            )
+            if not cursor.rowcount:
+                raise FileNotFoundError(path)
+            conn.execute(f"DELETE FROM entries {where}", (path, len(prefix), prefix))
+            conn.commit()
+
+    def restore(self, trash_id, path):
+        # Trashed rows keep their original paths
+        with self._connect() as conn:
+            self._ensure_parents(conn, path)
+            conn.execute(
+                "INSERT INTO entries SELECT path, parent, type, content, options, "
+                "mtime_ns, size, options_mtime_ns, options_size FROM trash_entries WHERE trash_id = ?",
+                (trash_id,)
+            )
+            conn.execute("DELETE FROM trash_entries WHERE trash_id = ?", (trash_id,))
+            conn.commit()
+
+    def trash_size(self, trash_id):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COALESCE(SUM(size + MAX(options_size, 0)), 0) FROM trash_entries WHERE trash_id = ?",
+                (trash_id,)
+            ).fetchone()[0]
+
+    def purge_trash(self, trash_id, limit):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM trash_entries WHERE rowid IN "
+                "(SELECT rowid FROM trash_entries WHERE trash_id = ? LIMIT ?)",
+                (trash_id, limit)
+            )
+            conn.commit()
+        return cursor.rowcount < limit
+
+    def walk(self, path=''):
+        with self._connect() as conn:
+            if path:
+                prefix = path.rstrip('/') + '/'
+                rows = conn.execute(
+                    "SELECT path, type, mtime_ns, size FROM entries WHERE substr(path, 1, ?) = ? ORDER BY path",
+                    (len(prefix), prefix)
+                ).fetchall()
+            else:
+                rows = conn.execute("SELECT path, type, mtime_ns, size FROM entries ORDER BY path").fetchall()
+        for row in rows:
+            yield Entry(*row)
+
+    def orphaned_options(self):
+        # Format options are stored in the row of their document
+        return iter(())
+
+def create_storage(config):
+    """Create the documents storage selected by the configuration."""
+    backend = config['STORAGE_BACKEND']
+    if backend == 'filesystem':
+        return FilesystemStorage(
+            os.path.join(config['WORK_DIR'], 'documents'),
+            os.path.join(config['WORK_DIR'], '.trash')
+        )
+    if backend == 'sqlite':
+        return SQLiteStorage(config['STORAGE_DB'])
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def copy_documents(source, target):
+    """Copy every directory and document, with its format options, between storages."""
+    copied = 0
+    for entry in source.walk():
+        if entry.type == 'directory':
+            target.make_dirs(entry.path)
+        else:
+            target.write(entry.path, source.read(entry.path), source.read_options(entry.path))
+            copied += 1
+    return copied
+
+if __name__ == '__main__':
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Move documents between the configured storage and plain files.')
+    parser.add_argument('action', choices=['export', 'import'],
+                        help='export writes the configured storage out as .md/.json files, import reads them in')
+    parser.add_argument('directory', help='Directory of .md/.json files')
+    args = parser.parse_args()
+
+    configured = create_storage({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
+    files = FilesystemStorage(args.directory, os.path.join(args.directory, '.trash'))
+    if isinstance(configured, FilesystemStorage) and os.path.abspath(configured.root) == os.path.abspath(files.root):
+        sys.exit('The directory is the configured documents directory')
+
+    if args.action == 'export':
+        count = copy_documents(configured, files)
+        print(f"Exported {count} documents to {args.directory}")
+    else:
+        count = copy_documents(files, configured)
+        print(f"Imported {count} documents from {args.directory}")
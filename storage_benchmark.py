@@ -0,0 +1,71 @@
+# storage_benchmark.py - Compare listing, open and save costs of the storage backends
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from config import Config
+from storage import FilesystemStorage, SQLiteStorage
+
+def note_path(i, per_directory):
+    return f"folder-{i // per_directory:04d}/note-{i:06d}.md"
+
+def populate(storage, count, per_directory):
+    """Write count short notes with format options, a directory per per_directory notes."""
+    options = json.dumps(Config.DEFAULT_FORMAT_OPTIONS, indent=2)
+    for i in range(count):
+        storage.write(note_path(i, per_directory), f"# Note {i}\n\nA short note about item {i}.\n", options)
+
+def timed(function, repeat=1):
+    """Get the mean seconds of a call."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+def benchmark(name, storage, count, per_directory, samples):
+    paths = [note_path(random.randrange(count), per_directory) for _ in range(samples)]
+    options = json.dumps(Config.DEFAULT_FORMAT_OPTIONS, indent=2)
+
+    def open_documents():
+        for path in paths:
+            storage.read(path)
+            storage.read_options(path)
+
+    def save_documents():
+        for path in paths:
+            storage.write(path, f"# Edited\n\n{path}\n", options)
+
+    return {
+        'backend': name,
+        'populate': timed(lambda: populate(storage, count, per_directory)),
+        'list': timed(lambda: sum(1 for _ in storage.walk()), repeat=3),
+        'open': timed(open_documents) / samples,
+        'save': timed(save_documents) / samples
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the document storage backends.')
+    parser.add_argument('--count', type=int, default=20000, help='Number of notes')
+    parser.add_argument('--per-directory', type=int, default=200, help='Notes per directory')
+    parser.add_argument('--samples', type=int, default=500, help='Documents opened and saved')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='storage-benchmark-')
+    try:
+        results = [
+            benchmark('filesystem', FilesystemStorage(f"{temp_dir}/documents", f"{temp_dir}/.trash"),
+                      args.count, args.per_directory, args.samples),
+            benchmark('sqlite', SQLiteStorage(f"{temp_dir}/documents.db"),
+                      args.count, args.per_directory, args.samples)
+        ]
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print(f"{args.count} notes, {args.per_directory} per directory")
+    print(f"{'backend':<12}{'populate s':>12}{'list ms':>12}{'open ms':>12}{'save ms':>12}")
+    for result in results:
+        print(f"{result['backend']:<12}{result['populate']:>12.2f}{result['list'] * 1000:>12.1f}"
+              f"{result['open'] * 1000:>12.3f}{result['save'] * 1000:>12.3f}")
@@ -0,0 +1,242 @@
+# sync.py - Content hash manifests for offline sync clients
+import os
+import json
+import hashlib
+from document_index import get_index_db
+from profiling import track
+from storage import CHUNK_SIZE
+
+# Attachments are grouped by the first characters of their content hash name
+ATTACHMENT_BUCKET_CHARS = 2
+
+# Sidecar marker hashed between a document and its format options
+SIDECAR_SEPARATOR = b'\0'
+
+def init_sync_db(work_dir):
+    """Initialize the content hash cache in the index database."""
+    with get_index_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_hashes (
+            file_path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sidecar_mtime_ns INTEGER NOT NULL,
+            sidecar_size INTEGER NOT NULL,
+            hash TEXT NOT NULL
+        )
+        ''')
+        # The manifest of each directory, dropped up the ancestor chain when anything below it changes
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS directory_hashes (
+            dir_path TEXT PRIMARY KEY,
+            manifest TEXT NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+        # Documents may have been changed while the server was down
+        conn.execute("DELETE FROM directory_hashes")
+        conn.commit()
+
+def document_hash(storage, file_path):
+    """
+    Hash a document together with its format options, so a change to
+    either one gives the document a new version.
+    """
+    digest = hashlib.sha256()
+    with storage.open(file_path) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    digest.update(SIDECAR_SEPARATOR)
+    options = storage.read_options(file_path)
+    if options is not None:
+        digest.update(options.encode('utf-8'))
+    return digest.hexdigest()
+
+def directory_hash(entries):
+    """Hash the sorted (type, name, hash) entries of a directory."""
+    digest = hashlib.sha256()
+    for entry in sorted(entries, key=lambda entry: entry['name']):
+        digest.update(f"{entry['type']}\t{entry['name']}\t{entry['hash']}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def _load_cached_hashes(conn, dir_path):
+    if not dir_path:
+        rows = conn.execute("SELECT * FROM content_hashes").fetchall()
+    else:
+        prefix = dir_path.rstrip('/') + '/'
+        rows = conn.execute(
+            "SELECT * FROM content_hashes WHERE substr(file_path, 1, ?) = ?",
+            (len(prefix), prefix)
+        ).fetchall()
+    return {row[0]: (tuple(row[1:5]), row[5]) for row in rows}
+
+def _directory_generation(conn):
+    row = conn.execute("SELECT value FROM sync_state WHERE key = 'directory_generation'").fetchone()
+    return row[0] if row else 0
+
+def directory_manifest(work_dir, storage, dir_path=''):
+    """
+    Get the manifest of one directory: its hash and the hashes of its
+    documents and subdirectories. A subdirectory hash covers everything
+    below it, so clients only descend where hashes differ.
+    Manifests are cached for every directory of the walked subtree until
+    invalidate_directory_hashes drops them.
+    """
+    with get_index_db(work_dir) as conn:
+        row = conn.execute("SELECT manifest FROM directory_hashes WHERE dir_path = ?", (dir_path,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        generation = _directory_generation(conn)
+        cached = _load_cached_hashes(conn, dir_path)
+
+    # Group the subtree by parent directory, then hash it bottom-up
+    children = {dir_path: []}
+    updates = []
+    for entry in storage.walk(dir_path):
+        parent, name = entry.path.rsplit('/', 1) if '/' in entry.path else ('', entry.path)
+        if entry.type == 'directory':
+            children.setdefault(entry.path, [])
+            children.setdefault(parent, []).append({'type': 'directory', 'name': name, 'path': entry.path})
+            continue
+
+        key = storage.version(entry.path)
+        hit = cached.get(entry.path)
+        if hit and hit[0] == key:
+            file_hash = hit[1]
+        else:
+            file_hash = document_hash(storage, entry.path)
+            updates.append((entry.path,) + tuple(key) + (file_hash,))
+        children.setdefault(parent, []).append({
+            'type': 'file',
+            'name': name,
+            'hash': file_hash,
+            'size': entry.size,
+            'modified': entry.mtime_ns / 1e9
+        })
+
+    hashes = {}
+    for path in sorted(children, key=lambda path: path.count('/') + bool(path), reverse=True):
+        for child in children[path]:
+            if child['type'] == 'directory':
+                child['hash'] = hashes[child.pop('path')]
+        hashes[path] = directory_hash(children[path])
+
+    manifests = {
+        path: {
+            'path': path,
+            'hash': hashes[path],
+            'entries': sorted(entries, key=lambda entry: entry['name'])
+        }
+        for path, entries in children.items()
+    }
+
+    with get_index_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR REPLACE INTO content_hashes "
+            "(file_path, mtime_ns, size, sidecar_mtime_ns, sidecar_size, hash) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            updates
+        )
+        # A change during the walk may not be in these manifests, so they are only kept without one
+        if _directory_generation(conn) == generation:
+            conn.executemany(
+                "INSERT OR REPLACE INTO directory_hashes (dir_path, manifest) VALUES (?, ?)",
+                [(path, json.dumps(manifest)) for path, manifest in manifests.items()]
+            )
+        conn.commit()
+
+    return manifests[dir_path]
+
+def invalidate_directory_hashes(work_dir, path):
+    """
+    Drop the cached manifests a change to a document or directory makes
+    stale: those of the directories containing it, and for a directory
+    its own and those below it.
+    """
+    parts = path.split('/')
+    parents = [''] + ['/'.join(parts[:i]) for i in range(1, len(parts))]
+    prefix = path + '/'
+    with get_index_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            f"DELETE FROM directory_hashes WHERE dir_path IN ({', '.join('?' * len(parents))}) "
+            "OR dir_path = ? OR substr(dir_path, 1, ?) = ?",
+            parents + [path, len(prefix), prefix]
+        )
+        conn.execute(
+            "INSERT INTO sync_state (key, value) VALUES ('directory_generation', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        conn.commit()
+
+def get_document_hash(work_dir, storage, file_path):
+    """Get the current hash of one document, or None if it doesn't exist."""
+    try:
+        key = tuple(storage.version(file_path))
+    except FileNotFoundError:
+        return None
+
+    with get_index_db(work_dir) as conn:
+        row = conn.execute(
+            "SELECT mtime_ns, size, sidecar_mtime_ns, sidecar_size, hash FROM content_hashes WHERE file_path = ?",
+            (file_path,)
+        ).fetchone()
+    if row and tuple(row[:4]) == key:
+        return row[4]
+
+    file_hash = document_hash(storage, file_path)
+    store_document_hash(work_dir, storage, file_path, file_hash)
+    return file_hash
+
+def store_document_hash(work_dir, storage, file_path, file_hash):
+    """Record the hash of a document that was just written."""
+    key = tuple(storage.version(file_path))
+    with get_index_db(work_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO content_hashes "
+            "(file_path, mtime_ns, size, sidecar_mtime_ns, sidecar_size, hash) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_path,) + key + (file_hash,)
+        )
+        conn.commit()
+
+def remove_document_hash(work_dir, file_path):
+    """Forget the hash of a deleted document."""
+    with get_index_db(work_dir) as conn:
+        conn.execute("DELETE FROM content_hashes WHERE file_path = ?", (file_path,))
+        conn.commit()
+
+def list_attachments(attachments_dir):
+    """List attachment blob names, skipping the legacy hash map and temp files."""
+    with track('filesystem'):
+        return [name for name in os.listdir(attachments_dir)
+                if not name.endswith(('.json', '.tmp'))
+                and os.path.isfile(os.path.join(attachments_dir, name))]
+
+def attachment_manifest(attachments_dir, bucket=None):
+    """
+    Get the attachment manifest. Attachment names are content hashes, so
+    without a bucket this returns one hash per name prefix; with a bucket
+    it lists the names in it.
+    """
+    buckets = {}
+    for name in list_attachments(attachments_dir):
+        buckets.setdefault(name[:ATTACHMENT_BUCKET_CHARS], []).append(name)
+
+    if bucket is not None:
+        return {'bucket': bucket, 'names': sorted(buckets.get(bucket, []))}
+
+    bucket_hashes = {
+        prefix: hashlib.sha256('\n'.join(sorted(names)).encode('utf-8')).hexdigest()
+        for prefix, names in buckets.items()
+    }
+    overall = hashlib.sha256(
+        ''.join(f"{prefix}\t{bucket_hashes[prefix]}\n" for prefix in sorted(bucket_hashes)).encode('utf-8')
+    ).hexdigest()
+    return {'hash': overall, 'buckets': dict(sorted(bucket_hashes.items()))}
@@ -0,0 +1,27 @@
+# conftest.py - Make the top-level modules importable from the tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The app module, started on a work directory of its own."""
+    work_dir = str(tmp_path_factory.mktemp('work'))
+    from config import Config
+    Config.WORK_DIR = work_dir
+    Config.STORAGE_DB = os.path.join(work_dir, 'documents.db')
+    Config.PUBLISH_DIR = os.path.join(work_dir, 'published')
+
+    # users.json is read from the working directory, without one authentication is off
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    import app
+    yield app
+    os.chdir(cwd)
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,86 @@
+# test_app.py - Request handling of the document API
+import io
+import os
+
+import pytest
+
+# Waitress marks chunked bodies as terminated, so they can be read without a length
+CHUNKED = {'wsgi.input_terminated': True}
+
+def put_chunked(client, path, body):
+    return client.put(
+        f'/api/file/raw?path={path}',
+        input_stream=io.BytesIO(body),
+        headers={'Transfer-Encoding': 'chunked'},
+        environ_overrides=CHUNKED
+    )
+
+def test_chunked_raw_save_is_stored(server, client):
+    response = put_chunked(client, 'chunked.md', b'# Chunked\n' * 50)
+
+    assert response.status_code == 200
+    assert server.storage.read('chunked.md') == '# Chunked\n' * 50
+
+def test_chunked_raw_save_over_the_size_limit_is_refused(server, client, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'MAX_CONTENT_LENGTH', 1000)
+
+    response = put_chunked(client, 'too-large.md', b'x' * 5000)
+
+    assert response.status_code == 413
+    assert not server.storage.is_file('too-large.md')
+
+@pytest.fixture
+def quota(server, monkeypatch):
+    """A hard quota of 1000 bytes on the quota directory, with the usage index counted."""
+    monkeypatch.setitem(server.app.config, 'DIRECTORY_QUOTAS', {'quota': {'hard': 1000}})
+    work_dir = server.app.config['WORK_DIR']
+    server.usage.rebuild(work_dir, server.storage, os.path.join(work_dir, 'attachments'))
+
+def test_chunked_raw_save_over_a_quota_is_refused(server, client, quota):
+    response = put_chunked(client, 'quota/chunked.md', b'x' * 5000)
+
+    assert response.status_code == 507
+    assert response.get_json()['quota']['path'] == 'quota'
+    assert not server.storage.is_file('quota/chunked.md')
+
+def test_sync_push_over_a_quota_is_a_conflict(server, client, quota):
+    response = client.post('/api/sync/push', json={
+        'changes': [{'path': 'quota/pushed.md', 'baseHash': None, 'content': 'x' * 5000}]
+    })
+
+    assert [conflict['reason'] for conflict in response.get_json()['conflicts']] == ['quota']
+    assert not server.storage.is_file('quota/pushed.md')
+
+def test_collab_snapshot_over_a_quota_keeps_the_edits(server, client, quota, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'COLLABORATION_ENABLED', True)
+    server.storage.make_dirs('quota')
+    server.storage.write('quota/shared.md', 'hello')
+    hub_id = client.post('/api/collab/join', json={'path': 'quota/shared.md', 'clientId': 'one'}).get_json()['hubId']
+    client.post('/api/collab/ops', json={
+        'path': 'quota/shared.md', 'hubId': hub_id, 'clientId': 'one', 'rev': 0, 'op': [5, 'x' * 5000]
+    })
+
+    response = client.post('/api/collab/snapshot', json={'path': 'quota/shared.md', 'clientId': 'one'})
+
+    assert response.status_code == 507
+    assert server.storage.read('quota/shared.md') == 'hello'
+    assert server.collab_hub.is_active('quota/shared.md')
+
+@pytest.mark.parametrize('url', ['/api/recent', '/api/activity'])
+@pytest.mark.parametrize('limit', ['-1', '0'])
+def test_list_limits_are_clamped(client, url, limit):
+    client.put('/api/file/raw?path=listed.md', data=b'listed')
+
+    response = client.get(f'{url}?limit={limit}')
+
+    assert len(response.get_json()['items']) == 1
+
+def test_restored_directory_returns_to_the_recent_list(server, client):
+    server.storage.make_dirs('restored/inner')
+    client.put('/api/file/raw?path=restored/inner/a.md', data=b'a')
+    trash_id = client.delete('/api/directory?path=restored').get_json()['trashId']
+    assert 'restored/inner/a.md' not in [item['path'] for item in client.get('/api/recent').get_json()['items']]
+
+    client.post('/api/trash/restore', json={'id': trash_id})
+
+    assert client.get('/api/recent?limit=1').get_json()['items'][0]['path'] == 'restored/inner/a.md'
@@ -0,0 +1,102 @@
+# test_collab.py - Concurrent edits converge and snapshots never go back in time
+import random
+import threading
+import time
+
+import pytest
+
+import collab
+
+def random_operation(rng, text):
+    """Make a random operation on a text."""
+    op = []
+    index = 0
+    while index < len(text):
+        length = rng.randint(1, len(text) - index)
+        kind = rng.choice(('retain', 'delete', 'insert'))
+        if kind == 'retain':
+            collab._push(op, length)
+            index += length
+        elif kind == 'delete':
+            collab._push(op, -length)
+            index += length
+        else:
+            collab._push(op, rng.choice(('x', 'yz', 'é')))
+    if rng.random() < 0.5:
+        collab._push(op, 'end')
+    return op
+
+@pytest.mark.parametrize('op, expected', [
+    ([5, ' there', 6], 'hello there world'),
+    ([-6, 5], 'world'),
+    ([5, -6, '!'], 'hello!'),
+    (['> ', 11], '> hello world'),
+])
+def test_apply_operation(op, expected):
+    assert collab.apply_operation('hello world', op) == expected
+
+def test_apply_rejects_wrong_length():
+    with pytest.raises(collab.CollabError):
+        collab.apply_operation('hello', [3])
+
+def test_transform_orders_inserts_at_the_same_place():
+    a, b = ['a', 3], ['b', 3]
+    a2, b2 = collab.transform(a, b)
+    assert collab.apply_operation(collab.apply_operation('xyz', a), b2) == 'abxyz'
+    assert collab.apply_operation(collab.apply_operation('xyz', b), a2) == 'abxyz'
+
+def test_transform_converges():
+    rng = random.Random(35)
+    for _ in range(500):
+        text = ''.join(rng.choice('abcdef') for _ in range(rng.randint(0, 12)))
+        a, b = random_operation(rng, text), random_operation(rng, text)
+        a2, b2 = collab.transform(a, b)
+        assert collab.apply_operation(collab.apply_operation(text, a), b2) == \
+            collab.apply_operation(collab.apply_operation(text, b), a2)
+
+@pytest.fixture
+def hub(tmp_path):
+    documents = {'notes.md': 'hello'}
+    writes = []
+
+    def save_document(file_path, text):
+        # The first snapshot is slow, so a later one overtakes it without claims
+        if not writes:
+            writes.append(None)
+            time.sleep(0.3)
+        documents[file_path] = text
+        writes.append(text)
+
+    collab.init_collab_db(str(tmp_path))
+    hub = collab.CollabHub(str(tmp_path), documents.__getitem__, save_document)
+    hub.documents = documents
+    return hub
+
+def test_submit_transforms_over_concurrent_operations(hub):
+    joined = hub.join('notes.md', 'one')
+    hub.join('notes.md', 'two')
+    hub.submit('notes.md', joined['hubId'], 'one', 0, [5, ' world'])
+    result = hub.submit('notes.md', joined['hubId'], 'two', 0, ['Oh, ', 5])
+
+    assert result['rev'] == 2
+    assert hub.persist('notes.md')
+    assert hub.documents['notes.md'] == 'Oh, hello world'
+
+def test_concurrent_persists_keep_the_newest_text(hub):
+    hub_id = hub.join('notes.md', 'one')['hubId']
+    hub.submit('notes.md', hub_id, 'one', 0, [5, ' one'])
+
+    slow = threading.Thread(target=hub.persist, args=('notes.md',))
+    slow.start()
+    time.sleep(0.1)
+    # Edited and snapshotted again while the first snapshot is still being written
+    hub.submit('notes.md', hub_id, 'one', 1, [9, ' two'])
+    hub.persist('notes.md')
+    slow.join()
+
+    assert hub.documents['notes.md'] == 'hello one two'
+    # Nothing newer than the document is left, so the idle hub can close
+    hub.leave('notes.md', 'one')
+    hub.run_maintenance()
+    assert not hub.is_active('notes.md')
+    assert hub.documents['notes.md'] == 'hello one two'
@@ -0,0 +1,119 @@
+# test_coordination.py - Server processes sharing one work directory stay consistent
+import io
+import os
+import sqlite3
+import multiprocessing
+from datetime import datetime, timedelta
+
+import pytest
+
+WORKERS = 4
+
+# Spawned like the publisher's pool, so every worker imports the app for itself
+context = multiprocessing.get_context('spawn')
+
+class WorkerError(str):
+    """An exception raised in a worker process."""
+
+def worker(work_dir, backend, startup, barrier, results, index, action):
+    """Start an app process on the shared work directory and run one action in it."""
+    # users.json is read from the working directory, without one authentication is off
+    os.chdir(work_dir)
+    from config import Config
+    Config.WORK_DIR = work_dir
+    Config.STORAGE_BACKEND = backend
+    Config.STORAGE_DB = os.path.join(work_dir, 'documents.db')
+    Config.PUBLISH_DIR = os.path.join(work_dir, 'published')
+    # Startup creates the databases and switches them to WAL, which the
+    # prefork launcher does once before forking, so imports take turns
+    with startup:
+        import app as server
+
+    client = server.app.test_client()
+    session_id = f'session-{index}'
+    # Every process is started before any of them acts
+    barrier.wait()
+    barrier.wait()
+
+    # Failures are sent back, so the test reports them instead of waiting for a result
+    try:
+        if action == 'save':
+            # Large enough that a torn write would mix the contents of two workers
+            content = f'# Worker {index}\n\n' + str(index) * 256 * 1024
+            for _ in range(5):
+                response = client.post('/api/file', json={'path': 'shared.md', 'content': content, 'force_save': True})
+                if response.status_code != 200:
+                    raise RuntimeError(response.get_json())
+            results.put((index, content))
+        elif action == 'upload':
+            response = client.post('/api/upload', data={'file': (io.BytesIO(b'same bytes' * 1000), 'image.png')})
+            results.put((index, response.get_json()))
+        elif action == 'lock':
+            results.put((index, server.acquire_lock('locked.md', session_id)))
+    except Exception as e:
+        results.put((index, WorkerError(repr(e))))
+
+def run_workers(work_dir, action, backend='filesystem', setup=None):
+    """Run the action in WORKERS processes at once, calling setup once they have started."""
+    startup = context.Lock()
+    barrier = context.Barrier(WORKERS + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(str(work_dir), backend, startup, barrier, results, index, action))
+        for index in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        barrier.wait(timeout=120)
+        if setup:
+            setup()
+        barrier.wait(timeout=30)
+        collected = dict(results.get(timeout=120) for _ in processes)
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+    assert all(process.exitcode == 0 for process in processes)
+    assert not [result for result in collected.values() if isinstance(result, WorkerError)]
+    return collected
+
+@pytest.mark.parametrize('backend', ['filesystem', 'sqlite'])
+def test_concurrent_saves_leave_one_whole_version(tmp_path, backend):
+    contents = run_workers(tmp_path, 'save', backend)
+
+    from storage import create_storage
+    storage = create_storage({
+        'STORAGE_BACKEND': backend,
+        'STORAGE_DB': str(tmp_path / 'documents.db'),
+        'WORK_DIR': str(tmp_path)
+    })
+    assert storage.read('shared.md') in contents.values()
+    # Writes go through temp files renamed into place, none may be left behind
+    assert [entry.path for entry in storage.walk()] == ['shared.md']
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')]
+
+def test_concurrent_identical_uploads_store_one_attachment(tmp_path):
+    uploads = run_workers(tmp_path, 'upload')
+
+    filenames = {upload['filename'] for upload in uploads.values()}
+    assert len(filenames) == 1
+    assert sum(not upload['duplicate'] for upload in uploads.values()) == 1
+    assert os.listdir(tmp_path / 'attachments') == list(filenames)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('temp_upload_')]
+
+def test_expired_lock_is_taken_over_once(tmp_path):
+    def expire_lock():
+        expired = (datetime.now() - timedelta(minutes=11)).isoformat()
+        with sqlite3.connect(str(tmp_path / 'locks.db')) as conn:
+            conn.execute(
+                "INSERT INTO file_locks (file_path, session_id, timestamp, created_at) VALUES (?, ?, ?, ?)",
+                ('locked.md', 'gone', expired, expired)
+            )
+
+    locks = run_workers(tmp_path, 'lock', setup=expire_lock)
+
+    winners = [index for index, (success, _, _) in locks.items() if success]
+    assert len(winners) == 1
+    success, owner, message = locks[winners[0]]
+    assert owner == f'session-{winners[0]}' and message == 'Expired lock taken over'
+    assert all(owner == f'session-{winners[0]}' for success, owner, _ in locks.values() if not success)
@@ -0,0 +1,51 @@
+# test_publisher.py - Published sites only ever contain attachments
+import os
+
+import pytest
+
+import publisher
+from storage import FilesystemStorage
+
+@pytest.fixture
+def workspace(tmp_path):
+    storage = FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    attachments_dir = tmp_path / 'attachments'
+    attachments_dir.mkdir()
+    (attachments_dir / 'photo.png').write_bytes(b'png')
+    (tmp_path / 'secret.txt').write_text('secret')
+    return storage, str(attachments_dir), str(tmp_path / 'site')
+
+@pytest.mark.parametrize('url', [
+    '/attachment/../secret.txt',
+    '/attachment/../../secret.txt',
+    'attachments/%2e%2e/secret.txt',
+    '/attachment/sub/photo.png',
+])
+def test_attachment_paths_are_rejected(url):
+    assert publisher.parse_reference(url) == ('attachment', None)
+
+def test_traversal_is_not_copied(workspace):
+    storage, attachments_dir, output_dir = workspace
+    storage.write('notes.md', '![a](/attachment/photo.png) ![b](/attachment/../secret.txt)')
+
+    summary = publisher.publish(storage, attachments_dir, output_dir)
+
+    assert summary['attachmentsCopied'] == 1
+    site_files = [name for _, _, names in os.walk(output_dir) for name in names]
+    assert 'secret.txt' not in site_files
+    assert 'photo.png' in site_files
+    with open(os.path.join(output_dir, 'notes.html'), encoding='utf-8') as f:
+        assert 'secret.txt' not in f.read()
+
+def test_concurrent_publish_is_refused(workspace):
+    storage, attachments_dir, output_dir = workspace
+    with publisher.output_lock(output_dir):
+        with pytest.raises(publisher.PublishInProgress):
+            publisher.publish(storage, attachments_dir, output_dir)
+    publisher.publish(storage, attachments_dir, output_dir)
+
+def test_publish_names_do_not_collide():
+    subtrees = ['', 'a', 'a/b', 'a-b', 'a/-b', 'a-/b', 'a%2Db', 'workspace', 'workspace/x', 'a/b/c']
+    names = [publisher.publish_name(subtree) for subtree in subtrees]
+    assert len(set(names)) == len(subtrees)
+    assert publisher.publish_name('/notes/daily/') == 'notes-daily'
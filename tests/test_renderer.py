@@ -0,0 +1,64 @@
+# test_renderer.py - Rendered documents must not carry scripts
+from html.parser import HTMLParser
+
+import pytest
+
+import renderer
+
+class ElementCollector(HTMLParser):
+    """Collect the (tag, attributes) of every element, with entities decoded."""
+
+    def __init__(self):
+        super().__init__()
+        self.elements = []
+
+    def handle_starttag(self, tag, attrs):
+        self.elements.append((tag, dict(attrs)))
+
+    handle_startendtag = handle_starttag
+
+def parse(html):
+    collector = ElementCollector()
+    collector.feed(html)
+    return collector.elements
+
+@pytest.mark.parametrize('content', [
+    '<script>alert(1)</script>',
+    'Text <img src=x onerror=alert(1)> more',
+    '[x](javascript:alert(1))',
+])
+def test_payloads_are_not_rendered_as_markup(content):
+    html = renderer.render_markdown(content)
+    for tag, attrs in parse(html):
+        assert tag not in ('script', 'img')
+        assert not any(name.startswith('on') for name in attrs)
+        assert not renderer.url_scheme(attrs.get('href', '')).startswith('javascript')
+
+@pytest.mark.parametrize('content', [
+    '[x](JaVa\tScript:alert(1))',
+    '[x](&#106;avascript:alert(1))',
+    '[x](javascript\\:alert(1))',
+    '[x](data:text/html,hi)',
+    '![x](x.png){: onerror="alert(1)" }',
+])
+def test_obfuscated_payloads_are_dropped(content):
+    for tag, attrs in parse(renderer.render_markdown(content)):
+        assert not any(name.startswith('on') for name in attrs)
+        for name in ('href', 'src'):
+            assert renderer.is_safe_url(attrs.get(name, ''))
+
+def test_safe_links_are_kept():
+    html = renderer.render_markdown('[a](https://example.com) [b](mailto:a@example.com) [c](notes/n.md#top)')
+    hrefs = [attrs['href'] for tag, attrs in parse(html) if tag == 'a']
+    assert hrefs == ['https://example.com', 'mailto:a@example.com', '/view/notes/n.md#top']
+
+def test_raw_html_is_shown_as_text():
+    assert '&lt;b&gt;bold&lt;/b&gt;' in renderer.render_markdown('<b>bold</b>')
+
+@pytest.mark.parametrize('content', [
+    'Text\n{: style="position:fixed;top:0;left:0;width:100%;height:100%" }',
+    '[x](https://example.com){: style="position:fixed" }',
+])
+def test_styles_are_stripped(content):
+    for tag, attrs in parse(renderer.render_markdown(content)):
+        assert 'style' not in attrs
@@ -0,0 +1,32 @@
+# test_scrub.py - The scrubber reports damaged documents, not ordinary ones
+import pytest
+
+from scrub import Scrubber, Throttle
+from storage import FilesystemStorage, SQLiteStorage
+
+@pytest.fixture(params=['filesystem', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'filesystem':
+        return FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    return SQLiteStorage(str(tmp_path / 'documents.db'))
+
+def check(storage, tmp_path, path):
+    scrubber = Scrubber(str(tmp_path), storage, str(tmp_path / 'attachments'))
+    return scrubber.check_document(path, Throttle(1024 * 1024 * 1024))
+
+def test_document_without_options_is_intact(storage, tmp_path):
+    storage.write('plain.md', 'no options')
+
+    assert check(storage, tmp_path, 'plain.md') is None
+
+def test_invalid_options_are_reported(storage, tmp_path):
+    storage.write('broken.md', 'text', '{"font": ')
+
+    assert check(storage, tmp_path, 'broken.md')[0] == 'invalid-options'
+
+def test_unreadable_sidecar_is_reported(tmp_path):
+    storage = FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    storage.write('damaged.md', 'text')
+    (tmp_path / 'documents' / 'damaged.json').write_bytes(b'\xff\xfe{}')
+
+    assert check(storage, tmp_path, 'damaged.md')[0] == 'unreadable-options'
@@ -0,0 +1,97 @@
+# test_storage.py - Both storage backends behave the same
+import io
+
+import pytest
+
+from storage import FilesystemStorage, SQLiteStorage, copy_documents
+
+@pytest.fixture(params=['filesystem', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'filesystem':
+        return FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    return SQLiteStorage(str(tmp_path / 'documents.db'))
+
+def paths(storage, path=''):
+    return sorted((entry.path, entry.type) for entry in storage.walk(path))
+
+def test_write_and_read(storage):
+    storage.write('notes/a.md', 'héllo', '{"font": "serif"}')
+
+    assert storage.is_file('notes/a.md') and storage.is_dir('notes')
+    assert storage.read('notes/a.md') == 'héllo'
+    assert storage.read_options('notes/a.md') == '{"font": "serif"}'
+    assert storage.stat('notes/a.md').size == len('héllo'.encode('utf-8'))
+
+    # Writing without options keeps the stored ones
+    storage.write('notes/a.md', 'changed')
+    assert storage.read('notes/a.md') == 'changed'
+    assert storage.read_options('notes/a.md') == '{"font": "serif"}'
+
+def test_missing_document(storage):
+    assert not storage.is_file('missing.md')
+    with pytest.raises(FileNotFoundError):
+        storage.version('missing.md')
+
+def test_version_follows_content_and_options(storage):
+    storage.write('a.md', 'one')
+    assert storage.version('a.md')[2:] == (-1, -1)
+    before = storage.version('a.md')
+
+    storage.write('a.md', 'one', '{}')
+    assert storage.version('a.md') != before
+
+def test_streams(storage):
+    content = 'ü' * (100 * 1024)
+    assert storage.write_stream('big.md', io.BytesIO(content.encode('utf-8')), '{}') == len(content.encode('utf-8'))
+    assert storage.read('big.md') == content
+
+    body, size = storage.stream('big.md')
+    with body:
+        assert body.read() == content.encode('utf-8')
+    assert size == len(content.encode('utf-8'))
+
+    with pytest.raises(UnicodeDecodeError):
+        storage.write_stream('bad.md', io.BytesIO(b'\xff\xfe'))
+    assert not storage.is_file('bad.md')
+
+def test_rename(storage):
+    storage.write('a.md', 'text', '{"font": "serif"}')
+    storage.make_dirs('old/inner')
+    storage.write('old/inner/b.md', 'b')
+
+    storage.rename('a.md', 'moved/a.md')
+    storage.rename_dir('old', 'new')
+
+    assert paths(storage) == [
+        ('moved', 'directory'), ('moved/a.md', 'file'),
+        ('new', 'directory'), ('new/inner', 'directory'), ('new/inner/b.md', 'file')
+    ]
+    assert storage.read_options('moved/a.md') == '{"font": "serif"}'
+    assert paths(storage, 'new') == [('new/inner', 'directory'), ('new/inner/b.md', 'file')]
+
+def test_trash_restore_and_purge(storage):
+    storage.write('dir/a.md', 'a', '{}')
+    storage.write('dir/b.md', 'b')
+
+    storage.trash('dir', 'first')
+    assert paths(storage) == []
+    assert storage.trash_size('first') == 4
+
+    storage.restore('first', 'dir')
+    assert paths(storage) == [('dir', 'directory'), ('dir/a.md', 'file'), ('dir/b.md', 'file')]
+    assert storage.read_options('dir/a.md') == '{}'
+
+    storage.trash('dir/a.md', 'second')
+    assert not storage.purge_trash('second', 1)
+    assert storage.purge_trash('second', 10)
+    assert storage.trash_size('second') == 0
+
+def test_copy_between_backends(storage, tmp_path):
+    storage.write('a.md', 'a', '{"font": "serif"}')
+    storage.make_dirs('empty')
+    exported = FilesystemStorage(str(tmp_path / 'export'), str(tmp_path / 'export' / '.trash'))
+
+    assert copy_documents(storage, exported) == 1
+    assert exported.read('a.md') == 'a'
+    assert exported.read_options('a.md') == '{"font": "serif"}'
+    assert exported.is_dir('empty')
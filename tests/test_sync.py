@@ -0,0 +1,63 @@
+# test_sync.py - Cached directory manifests follow the documents below them
+import pytest
+
+import sync
+from document_index import get_index_db
+from storage import FilesystemStorage
+
+@pytest.fixture
+def workspace(tmp_path):
+    storage = FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    for path in ('a/b/one.md', 'a/b/two.md', 'a/c/three.md', 'd/four.md'):
+        storage.make_dirs(path.rsplit('/', 1)[0])
+        storage.write(path, f'# {path}')
+    sync.init_sync_db(str(tmp_path))
+    return str(tmp_path), storage
+
+def cached_directories(work_dir):
+    with get_index_db(work_dir) as conn:
+        return {row[0] for row in conn.execute("SELECT dir_path FROM directory_hashes")}
+
+def test_walk_caches_every_directory(workspace):
+    work_dir, storage = workspace
+    root = sync.directory_manifest(work_dir, storage)
+
+    assert cached_directories(work_dir) == {'', 'a', 'a/b', 'a/c', 'd'}
+    assert sync.directory_manifest(work_dir, storage) == root
+
+def test_nested_edit_changes_only_its_ancestors(workspace):
+    work_dir, storage = workspace
+    before = {path: sync.directory_manifest(work_dir, storage, path)['hash'] for path in ('', 'a', 'a/b', 'a/c', 'd')}
+
+    storage.write('a/b/one.md', '# Edited')
+    sync.invalidate_directory_hashes(work_dir, 'a/b/one.md')
+
+    assert cached_directories(work_dir) == {'a/c', 'd'}
+    after = {path: sync.directory_manifest(work_dir, storage, path)['hash'] for path in before}
+    assert [path for path in before if before[path] != after[path]] == ['', 'a', 'a/b']
+
+def test_directory_change_drops_its_subtree(workspace):
+    work_dir, storage = workspace
+    sync.directory_manifest(work_dir, storage)
+
+    sync.invalidate_directory_hashes(work_dir, 'a')
+
+    assert cached_directories(work_dir) == {'d'}
+
+def test_change_during_walk_is_not_cached(workspace):
+    work_dir, storage = workspace
+    walk = storage.walk
+
+    def walk_with_change(path=''):
+        for entry in walk(path):
+            yield entry
+        # Another request saves a document after it was walked
+        storage.write('d/four.md', '# Edited')
+        sync.invalidate_directory_hashes(work_dir, 'd/four.md')
+
+    storage.walk = walk_with_change
+    stale = sync.directory_manifest(work_dir, storage)
+    storage.walk = walk
+
+    assert cached_directories(work_dir) == set()
+    assert sync.directory_manifest(work_dir, storage)['hash'] != stale['hash']
@@ -0,0 +1,85 @@
+# test_trash.py - Deletes can be undone until the purger removes them
+import time
+
+import pytest
+
+import trash
+from coordination import get_coordination_db
+from storage import FilesystemStorage, SQLiteStorage
+
+@pytest.fixture(params=['filesystem', 'sqlite'])
+def trash_bin(request, tmp_path):
+    if request.param == 'filesystem':
+        storage = FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    else:
+        storage = SQLiteStorage(str(tmp_path / 'documents.db'))
+    trash.init_trash_db(str(tmp_path))
+    return trash.TrashBin(str(tmp_path), storage)
+
+def deleted_ago(trash_bin, trash_id, seconds):
+    """Backdate a trashed item."""
+    with get_coordination_db(trash_bin.work_dir) as conn:
+        conn.execute("UPDATE trash_items SET deleted_at = ? WHERE trash_id = ?", (time.time() - seconds, trash_id))
+        conn.commit()
+
+def test_move_and_restore(trash_bin):
+    trash_bin.storage.write('notes/a.md', 'a', '{}')
+    trash_id = trash_bin.move('notes', 'directory', 'session')
+
+    assert not trash_bin.storage.is_dir('notes')
+    assert [(item['id'], item['path'], item['type']) for item in trash_bin.list_items()] == \
+        [(trash_id, 'notes', 'directory')]
+
+    assert trash_bin.restore(trash_id)['path'] == 'notes'
+    assert trash_bin.storage.read('notes/a.md') == 'a'
+    assert trash_bin.list_items() == []
+    assert trash_bin.restore(trash_id) is None
+
+def test_restore_into_an_occupied_path_is_refused(trash_bin):
+    trash_bin.storage.write('a.md', 'deleted')
+    trash_id = trash_bin.move('a.md', 'file')
+    trash_bin.storage.write('a.md', 'written since')
+
+    with pytest.raises(trash.TrashError):
+        trash_bin.restore(trash_id)
+
+    assert trash_bin.storage.read('a.md') == 'written since'
+    assert [item['id'] for item in trash_bin.list_items()] == [trash_id]
+
+def test_purge_by_age(trash_bin):
+    trash_bin.storage.write('old.md', 'old')
+    trash_bin.storage.write('new.md', 'new')
+    old_id = trash_bin.move('old.md', 'file')
+    new_id = trash_bin.move('new.md', 'file')
+    deleted_ago(trash_bin, old_id, 3600)
+
+    assert trash_bin.purge(retention=60, max_size=1024, pause=0) == 1
+
+    assert [item['id'] for item in trash_bin.list_items()] == [new_id]
+    assert trash_bin.restore(old_id) is None
+    assert trash_bin.storage.trash_size(old_id) == 0
+
+def test_purge_oldest_while_over_the_size_limit(trash_bin):
+    ids = []
+    for index, name in enumerate(('first.md', 'second.md', 'third.md')):
+        trash_bin.storage.write(name, 'x' * 10)
+        ids.append(trash_bin.move(name, 'file'))
+        deleted_ago(trash_bin, ids[-1], 30 - index)
+
+    assert trash_bin.purge(retention=3600, max_size=20, pause=0) == 1
+
+    assert sorted(item['id'] for item in trash_bin.list_items()) == sorted(ids[1:])
+
+def test_interrupted_purge_is_finished(trash_bin):
+    trash_bin.storage.write('a.md', 'a')
+    trash_id = trash_bin.move('a.md', 'file')
+    with get_coordination_db(trash_bin.work_dir) as conn:
+        conn.execute("UPDATE trash_items SET purging = 1 WHERE trash_id = ?", (trash_id,))
+        conn.commit()
+
+    # Being purged, it can no longer be restored
+    assert trash_bin.list_items() == []
+    assert trash_bin.restore(trash_id) is None
+
+    assert trash_bin.purge(retention=3600, max_size=1024, pause=0) == 1
+    assert trash_bin.storage.trash_size(trash_id) == 0
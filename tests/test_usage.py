@@ -0,0 +1,47 @@
+# test_usage.py - Usage rollups stay in step with the documents
+import usage
+from storage import FilesystemStorage
+
+def make_workspace(tmp_path):
+    storage = FilesystemStorage(str(tmp_path / 'documents'), str(tmp_path / 'trash'))
+    storage.make_dirs('a/b')
+    storage.write('a/one.md', 'x' * 10)
+    storage.write('a/b/two.md', 'x' * 20)
+    (tmp_path / 'attachments').mkdir()
+    usage.init_usage_db(str(tmp_path))
+    return str(tmp_path), storage
+
+def test_rebuild_rolls_up_directories(tmp_path):
+    work_dir, storage = make_workspace(tmp_path)
+
+    assert usage.rebuild(work_dir, storage, str(tmp_path / 'attachments')) == 2
+    directories = usage.get_all_directories(work_dir)
+    assert {path: totals['bytes'] for path, totals in directories.items()} == {'': 30, 'a': 30, 'a/b': 20}
+
+def test_rebuild_keeps_changes_made_during_the_walk(tmp_path):
+    work_dir, storage = make_workspace(tmp_path)
+    walk = storage.walk
+    changed = []
+
+    def walk_with_change(path=''):
+        for entry in walk(path):
+            yield entry
+        # A save recorded after the walk passed the document
+        if not changed:
+            changed.append(True)
+            storage.write('a/one.md', 'x' * 100)
+            usage.set_document(work_dir, 'a/one.md', 100)
+
+    storage.walk = walk_with_change
+    usage.rebuild(work_dir, storage, str(tmp_path / 'attachments'))
+
+    assert usage.get_all_directories(work_dir)['a'] == {'files': 2, 'bytes': 120}
+
+def test_hard_headroom_is_the_tightest_quota(tmp_path):
+    work_dir, storage = make_workspace(tmp_path)
+    usage.rebuild(work_dir, storage, str(tmp_path / 'attachments'))
+    config = {'QUOTA_SOFT_LIMIT': None, 'QUOTA_HARD_LIMIT': 1000, 'DIRECTORY_QUOTAS': {'a/b': {'hard': 50}}}
+
+    assert usage.hard_headroom(work_dir, 'a/b/three.md', config) == (30, {'path': 'a/b', 'used': 20, 'limit': 50})
+    assert usage.hard_headroom(work_dir, 'a/three.md', config)[0] == 970
+    assert usage.check_quotas(work_dir, 'a/b/three.md', 31, config)[0]['path'] == 'a/b'
@@ -0,0 +1,163 @@
+# trash.py - Recoverable deletes with deferred, batched purging
+import time
+import uuid
+from coordination import get_coordination_db
+
+class TrashError(Exception):
+    """Raised when a trashed item can't be restored."""
+
+def init_trash_db(work_dir):
+    """Initialize the trash metadata table in the coordination database."""
+    with get_coordination_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS trash_items (
+            trash_id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            type TEXT NOT NULL,
+            session_id TEXT,
+            deleted_at REAL NOT NULL,
+            size INTEGER,
+            purging INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS trash_items_deleted_at ON trash_items (deleted_at)")
+        conn.commit()
+
+def _row_to_item(row):
+    trash_id, path, kind, session_id, deleted_at, size = row
+    return {
+        'id': trash_id,
+        'path': path,
+        'type': kind,
+        'sessionId': session_id,
+        'deletedAt': deleted_at,
+        'size': size
+    }
+
+class TrashBin:
+    """
+    Deleted documents and directories, moved aside in storage so a delete
+    is a rename and can be undone. The metadata lives in the coordination
+    database so every server process sees the same trash. Sizes are
+    measured by the purger rather than on delete.
+    """
+
+    def __init__(self, work_dir, storage):
+        self.work_dir = work_dir
+        self.storage = storage
+
+    def move(self, path, kind, session_id=None):
+        """Move a document or directory to the trash, returns its trash id."""
+        trash_id = uuid.uuid4().hex
+        with get_coordination_db(self.work_dir) as conn:
+            conn.execute(
+                "INSERT INTO trash_items (trash_id, path, type, session_id, deleted_at) VALUES (?, ?, ?, ?, ?)",
+                (trash_id, path, kind, session_id, time.time())
+            )
+            conn.commit()
+
+        try:
+            self.storage.trash(path, trash_id)
+        except Exception:
+            with get_coordination_db(self.work_dir) as conn:
+                conn.execute("DELETE FROM trash_items WHERE trash_id = ?", (trash_id,))
+                conn.commit()
+            raise
+        return trash_id
+
+    def list_items(self):
+        """List the restorable items, newest first."""
+        with get_coordination_db(self.work_dir) as conn:
+            rows = conn.execute(
+                "SELECT trash_id, path, type, session_id, deleted_at, size FROM trash_items "
+                "WHERE purging = 0 ORDER BY deleted_at DESC"
+            ).fetchall()
+        return [_row_to_item(row) for row in rows]
+
+    def restore(self, trash_id):
+        """
+        Move an item back to its original path. Returns the item, or None
+        if it isn't in the trash or is being purged.
+        """
+        with get_coordination_db(self.work_dir) as conn:
+            row = conn.execute(
+                "SELECT trash_id, path, type, session_id, deleted_at, size FROM trash_items "
+                "WHERE trash_id = ? AND purging = 0",
+                (trash_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        item = _row_to_item(row)
+        if self.storage.is_file(item['path']) or self.storage.is_dir(item['path']):
+            raise TrashError(f"Something already exists at {item['path']}")
+
+        # Claim the item so the purger can't start on it meanwhile
+        with get_coordination_db(self.work_dir) as conn:
+            cursor = conn.execute("DELETE FROM trash_items WHERE trash_id = ? AND purging = 0", (trash_id,))
+            conn.commit()
+        if not cursor.rowcount:
+            return None
+
+        try:
+            self.storage.restore(trash_id, item['path'])
+        except Exception:
+            with get_coordination_db(self.work_dir) as conn:
+                conn.execute(
+                    "INSERT INTO trash_items (trash_id, path, type, session_id, deleted_at, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    row
+                )
+                conn.commit()
+            raise
+        return item
+
+    def _measure(self):
+        with get_coordination_db(self.work_dir) as conn:
+            unmeasured = [row[0] for row in conn.execute("SELECT trash_id FROM trash_items WHERE size IS NULL")]
+        for trash_id in unmeasured:
+            size = self.storage.trash_size(trash_id)
+            with get_coordination_db(self.work_dir) as conn:
+                conn.execute("UPDATE trash_items SET size = ? WHERE trash_id = ?", (size, trash_id))
+                conn.commit()
+
+    def _due(self, retention, max_size):
+        """Get the ids to purge: items past the retention, then the oldest while over the size limit."""
+        with get_coordination_db(self.work_dir) as conn:
+            rows = conn.execute(
+                "SELECT trash_id, deleted_at, size, purging FROM trash_items ORDER BY deleted_at"
+            ).fetchall()
+
+        cutoff = time.time() - retention
+        total = sum(row[2] or 0 for row in rows)
+        due = []
+        for trash_id, deleted_at, size, purging in rows:
+            # Purges interrupted by a restart are picked up again
+            if purging or deleted_at < cutoff or total > max_size:
+                due.append(trash_id)
+                total -= size or 0
+        return due
+
+    def purge(self, retention, max_size, batch_size=100, pause=0.5):
+        """
+        Permanently delete the items that are due, batch_size documents at
+        a time with a pause between batches so purging never hogs the disk.
+        Returns the number of items purged.
+        """
+        self._measure()
+        purged = 0
+        for trash_id in self._due(retention, max_size):
+            with get_coordination_db(self.work_dir) as conn:
+                cursor = conn.execute("UPDATE trash_items SET purging = 1 WHERE trash_id = ?", (trash_id,))
+                conn.commit()
+            if not cursor.rowcount:
+                continue  # Restored meanwhile
+
+            while not self.storage.purge_trash(trash_id, batch_size):
+                time.sleep(pause)
+
+            with get_coordination_db(self.work_dir) as conn:
+                conn.execute("DELETE FROM trash_items WHERE trash_id = ?", (trash_id,))
+                conn.commit()
+            purged += 1
+            time.sleep(pause)
+        return purged
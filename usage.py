@@ -0,0 +1,292 @@
+# usage.py - Incrementally maintained disk usage rollups and quota checks
+import os
+from document_index import get_index_db
+from sync import list_attachments
+
+class QuotaExceeded(Exception):
+    """A write that would pass a hard quota."""
+    def __init__(self, quota):
+        scope = f"directory {quota['path']}" if quota['path'] else 'workspace'
+        super().__init__(f"Storage quota of the {scope} exceeded")
+        self.quota = quota
+
+def ancestors(path):
+    """Get the directories containing a path, from the root ('') down."""
+    parts = path.split('/')[:-1]
+    return [''] + ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+def init_usage_db(work_dir):
+    """Initialize the usage tables in the index database."""
+    with get_index_db(work_dir) as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_files (
+            path TEXT PRIMARY KEY,
+            bytes INTEGER NOT NULL
+        )
+        ''')
+        # Each directory row covers its whole subtree, '' is the documents root
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_directories (
+            path TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_attachments (
+            username TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+
+def is_built(work_dir):
+    """Check if the usage index has been built from the stored documents."""
+    with get_index_db(work_dir) as conn:
+        row = conn.execute("SELECT value FROM usage_state WHERE key = 'built'").fetchone()
+    return row is not None
+
+def document_bytes(storage, path):
+    """Get the bytes a document uses, including its format options."""
+    _, size, _, options_size = storage.version(path)
+    return size + max(options_size, 0)
+
+def _generation(conn):
+    row = conn.execute("SELECT value FROM usage_state WHERE key = 'generation'").fetchone()
+    return int(row[0]) if row else 0
+
+def _bump_generation(conn):
+    conn.execute(
+        "INSERT INTO usage_state (key, value) VALUES ('generation', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+    )
+
+def _apply(conn, directories, files, size):
+    for directory in directories:
+        conn.execute(
+            "INSERT INTO usage_directories (path, files, bytes) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET files = files + excluded.files, bytes = bytes + excluded.bytes",
+            (directory, files, size)
+        )
+
+def _subtree(conn, path):
+    """Get (files, bytes) of a document or of everything below a directory."""
+    prefix = path + '/'
+    return conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM usage_files WHERE path = ? OR substr(path, 1, ?) = ?",
+        (path, len(prefix), prefix)
+    ).fetchone()
+
+def rebuild(work_dir, storage, attachments_dir):
+    """
+    Recount every document and attachment. Walks everything, so only run it in the background.
+    A change recorded during the walk may be missing from the count, so the
+    walk is repeated until one finishes without any.
+    """
+    while True:
+        with get_index_db(work_dir) as conn:
+            generation = _generation(conn)
+        files, directories, attachment_sizes = _count(storage, attachments_dir)
+
+        with get_index_db(work_dir) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if _generation(conn) != generation:
+                conn.rollback()
+                continue
+            conn.execute("DELETE FROM usage_files")
+            conn.execute("DELETE FROM usage_directories")
+            conn.execute("DELETE FROM usage_attachments")
+            conn.executemany("INSERT INTO usage_files (path, bytes) VALUES (?, ?)", files.items())
+            conn.executemany(
+                "INSERT INTO usage_directories (path, files, bytes) VALUES (?, ?, ?)",
+                [(path, totals[0], totals[1]) for path, totals in directories.items()]
+            )
+            # Uploads from before the index have no known uploader
+            conn.execute(
+                "INSERT INTO usage_attachments (username, files, bytes) VALUES ('', ?, ?)",
+                (len(attachment_sizes), sum(attachment_sizes))
+            )
+            conn.execute("INSERT OR REPLACE INTO usage_state (key, value) VALUES ('built', '1')")
+            conn.commit()
+        return len(files)
+
+def _count(storage, attachments_dir):
+    """Walk the documents and attachments, returning (files, directories, attachment sizes)."""
+    files = {}
+    directories = {'': [0, 0]}
+    for entry in storage.walk():
+        if entry.type == 'directory':
+            continue
+        try:
+            size = document_bytes(storage, entry.path)
+        except FileNotFoundError:
+            continue
+        files[entry.path] = size
+        for directory in ancestors(entry.path):
+            totals = directories.setdefault(directory, [0, 0])
+            totals[0] += 1
+            totals[1] += size
+
+    attachment_sizes = []
+    for name in list_attachments(attachments_dir):
+        try:
+            attachment_sizes.append(os.path.getsize(os.path.join(attachments_dir, name)))
+        except FileNotFoundError:
+            continue
+    return files, directories, attachment_sizes
+
+def set_document(work_dir, path, size):
+    """Record the new size of a saved document and roll the change up its directories."""
+    with get_index_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT bytes FROM usage_files WHERE path = ?", (path,)).fetchone()
+        conn.execute("INSERT OR REPLACE INTO usage_files (path, bytes) VALUES (?, ?)", (path, size))
+        _apply(conn, ancestors(path), 0 if row else 1, size - (row[0] if row else 0))
+        _bump_generation(conn)
+        conn.commit()
+
+def remove(work_dir, path):
+    """Forget a document, or a directory and everything below it."""
+    prefix = path + '/'
+    with get_index_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        files, size = _subtree(conn, path)
+        for table in ('usage_files', 'usage_directories'):
+            conn.execute(
+                f"DELETE FROM {table} WHERE path = ? OR substr(path, 1, ?) = ?",
+                (path, len(prefix), prefix)
+            )
+        _apply(conn, ancestors(path), -files, -size)
+        _bump_generation(conn)
+        conn.commit()
+
+def move(work_dir, old_path, new_path):
+    """Move the usage of a renamed document or directory to its new place."""
+    prefix = old_path + '/'
+    with get_index_db(work_dir) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        files, size = _subtree(conn, old_path)
+        for table in ('usage_files', 'usage_directories'):
+            conn.execute(
+                f"UPDATE {table} SET path = ? || substr(path, ?) WHERE path = ? OR substr(path, 1, ?) = ?",
+                (new_path, len(old_path) + 1, old_path, len(prefix), prefix)
+            )
+        _apply(conn, ancestors(old_path), -files, -size)
+        _apply(conn, ancestors(new_path), files, size)
+        _bump_generation(conn)
+        conn.commit()
+
+def add_tree(work_dir, storage, path):
+    """Count a document or directory that came back, such as one restored from the trash."""
+    if storage.is_dir(path):
+        paths = [entry.path for entry in storage.walk(path) if entry.type == 'file']
+    else:
+        paths = [path]
+    for file_path in paths:
+        set_document(work_dir, file_path, document_bytes(storage, file_path))
+
+def add_attachment(work_dir, size, username=None):
+    """Count a newly stored attachment against its uploader."""
+    with get_index_db(work_dir) as conn:
+        conn.execute(
+            "INSERT INTO usage_attachments (username, files, bytes) VALUES (?, 1, ?) "
+            "ON CONFLICT(username) DO UPDATE SET files = files + 1, bytes = bytes + excluded.bytes",
+            (username or '', size)
+        )
+        _bump_generation(conn)
+        conn.commit()
+
+def get_all_directories(work_dir):
+    """Get {path: {'files', 'bytes'}} of every directory with a single query."""
+    with get_index_db(work_dir) as conn:
+        rows = conn.execute("SELECT path, files, bytes FROM usage_directories").fetchall()
+    return {path: {'files': files, 'bytes': size} for path, files, size in rows}
+
+def get_directory(work_dir, path=''):
+    """Get the totals of a directory and of each directory directly inside it."""
+    prefix = path + '/' if path else ''
+    with get_index_db(work_dir) as conn:
+        row = conn.execute("SELECT files, bytes FROM usage_directories WHERE path = ?", (path,)).fetchone()
+        children = conn.execute(
+            "SELECT path, files, bytes FROM usage_directories "
+            "WHERE path != '' AND substr(path, 1, ?) = ? AND instr(substr(path, ?), '/') = 0 "
+            "ORDER BY bytes DESC",
+            (len(prefix), prefix, len(prefix) + 1)
+        ).fetchall()
+    totals = {'files': row[0], 'bytes': row[1]} if row else {'files': 0, 'bytes': 0}
+    return totals, [{'path': child, 'files': files, 'bytes': size} for child, files, size in children]
+
+def get_attachments(work_dir):
+    """Get the attachment totals and the share of each uploader."""
+    with get_index_db(work_dir) as conn:
+        rows = conn.execute("SELECT username, files, bytes FROM usage_attachments ORDER BY bytes DESC").fetchall()
+    return {
+        'files': sum(row[1] for row in rows),
+        'bytes': sum(row[2] for row in rows),
+        'users': [{'username': username or None, 'files': files, 'bytes': size} for username, files, size in rows]
+    }
+
+def _limits(work_dir, path, config):
+    """Get (directory, used, soft, hard) of each quota a write to path counts against."""
+    # Only the root and the directories with a quota that contain the write are looked up
+    quoted = [directory for directory in (ancestors(path)[1:] if path else [])
+              if config['DIRECTORY_QUOTAS'].get(directory)]
+    directories = [''] + quoted
+    with get_index_db(work_dir) as conn:
+        used = dict(conn.execute(
+            f"SELECT path, bytes FROM usage_directories WHERE path IN ({', '.join('?' * len(directories))})",
+            directories
+        ).fetchall())
+        attachments = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM usage_attachments").fetchone()[0]
+
+    limits = [('', used.get('', 0) + attachments, config['QUOTA_SOFT_LIMIT'], config['QUOTA_HARD_LIMIT'])]
+    for directory in quoted:
+        quota = config['DIRECTORY_QUOTAS'][directory]
+        limits.append((directory, used.get(directory, 0), quota.get('soft'), quota.get('hard')))
+    return limits
+
+def check_quotas(work_dir, path, delta, config):
+    """
+    Check a write growing the workspace by delta bytes against the quotas.
+    path is the document written, or None for an attachment.
+    Returns (error, warnings): error describes an exceeded hard quota.
+    """
+    if delta <= 0:
+        return None, []
+
+    error = None
+    warnings = []
+    for directory, used, soft, hard in _limits(work_dir, path, config):
+        quota = {'path': directory, 'used': used, 'requested': delta}
+        if hard is not None and used + delta > hard:
+            error = dict(quota, limit=hard)
+        elif soft is not None and used + delta > soft:
+            warnings.append(dict(quota, limit=soft))
+    return error, warnings
+
+def hard_headroom(work_dir, path, config):
+    """
+    Get the bytes a write to path may still add before a hard quota is exceeded.
+    Returns (bytes, quota) of the tightest hard quota, or (None, None) without one.
+    """
+    headroom, tightest = None, None
+    for directory, used, _, hard in _limits(work_dir, path, config):
+        if hard is not None and (headroom is None or hard - used < headroom):
+            headroom, tightest = hard - used, {'path': directory, 'used': used, 'limit': hard}
+    return headroom, tightest
+
+if __name__ == '__main__':
+    # Recount after documents were changed outside the server, such as by an import
+    from config import Config
+    from storage import create_storage
+    storage = create_storage({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
+    init_usage_db(Config.WORK_DIR)
+    count = rebuild(Config.WORK_DIR, storage, os.path.join(Config.WORK_DIR, 'attachments'))
+    print(f"Counted {count} documents")